@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the html parsing backends.
+
+First, record a set of fixtures from a live wiki:
+
+    benchmark_parsers.py record fixtures/ --site www.scp-wiki.net scp-173
+
+Then compare the parsers on the recorded data:
+
+    benchmark_parsers.py run fixtures/
+
+For every kind of fixture, the script checks that all parsers produce the
+same results, and prints the average time each of them takes per fixture.
+"""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import argparse
+import json
+import lxml.html
+import pathlib
+import timeit
+
+import pyscp
+
+###############################################################################
+
+PARSERS = {
+    'soup': pyscp.parsers.SoupParser(),
+    'lxml': pyscp.parsers.LxmlParser()}
+
+###############################################################################
+
+
+def record(directory, site, pages):
+    """Download module responses for the given pages into the directory."""
+    wiki = pyscp.wikidot.Wiki(site)
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    fixtures = []
+    for page in map(wiki, pages):
+        thread = page._pdata[1]
+        fixtures += [
+            ('pdata', wiki.req.get(page.url).text),
+            ('history', page._module(
+                'history/PageRevisionListModule',
+                page=1, perpage=99999)['body']),
+            ('votes', page._module('pagerate/WhoRatedPageModule')['body']),
+            ('files', page._module('files/PageFilesModule')['body'])]
+        if thread:
+            fixtures.append(('posts', wiki._module(
+                'forum/ForumViewThreadPostsModule', t=thread)['body']))
+    fixtures += [
+        ('list_pages', next(wiki._list_pages_raw(
+            **pyscp.wikidot.list_pages_kwargs(
+                body='title created_by created_at rating tags')))['body']),
+        ('categories', wiki._module('forum/ForumStartModule')['body'])]
+    for idx, (kind, html) in enumerate(fixtures):
+        path = directory / '{:03}-{}.json'.format(idx, kind)
+        with path.open('w', encoding='utf-8') as file:
+            json.dump({'kind': kind, 'html': html}, file)
+    print('Recorded {} fixtures.'.format(len(fixtures)))
+
+
+def run(directory, number):
+    """Compare the parsers on the fixtures in the directory."""
+    fixtures = {}
+    for path in sorted(pathlib.Path(directory).glob('*.json')):
+        with path.open(encoding='utf-8') as file:
+            data = json.load(file)
+        fixtures.setdefault(data['kind'], []).append(data['html'])
+    print('{:12} {:>8} {:>10} {:>10} {:>8}'.format(
+        'fixture', 'count', 'soup, ms', 'lxml, ms', 'speedup'))
+    for kind, htmls in sorted(fixtures.items()):
+        results = {
+            name: normalize([list_if_needed(getattr(p, kind)(h))
+                             for h in htmls])
+            for name, p in PARSERS.items()}
+        if results['soup'] != results['lxml']:
+            print('{:12} parsers disagree!'.format(kind))
+        times = {
+            name: timeit.timeit(
+                lambda: [list_if_needed(getattr(p, kind)(h)) for h in htmls],
+                number=number) * 1000 / number / len(htmls)
+            for name, p in PARSERS.items()}
+        print('{:12} {:>8} {:>10.2f} {:>10.2f} {:>7.1f}x'.format(
+            kind, len(htmls), times['soup'], times['lxml'],
+            times['soup'] / times['lxml']))
+
+
+def list_if_needed(value):
+    return value if isinstance(value, (tuple, list, set, int)) else list(value)
+
+
+def normalize(value):
+    """Reserialize html strings, to ignore differences like <br/> vs <br>."""
+    if isinstance(value, str) and value.startswith('<'):
+        return lxml.html.tostring(
+            lxml.html.fragment_fromstring(value), encoding='unicode')
+    if isinstance(value, (tuple, list)):
+        return [normalize(i) for i in value]
+    return value
+
+###############################################################################
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    commands = parser.add_subparsers(dest='command')
+    rec = commands.add_parser('record')
+    rec.add_argument('directory')
+    rec.add_argument('pages', nargs='+')
+    rec.add_argument('--site', default='www.scp-wiki.net')
+    bench = commands.add_parser('run')
+    bench.add_argument('directory')
+    bench.add_argument('--number', type=int, default=10)
+    args = parser.parse_args()
+    if args.command == 'record':
+        record(args.directory, args.site, args.pages)
+    elif args.command == 'run':
+        run(args.directory, args.number)
+    else:
+        parser.print_help()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+"""
+Upgrade an existing snapshot.
+
+Adds the tables introduced by newer versions of pyscp to a snapshot made
+by an older one, or rebuilds them from the saved data:
+
+    upgrade_snapshot.py snapshot.db --stats --search
+
+With --compress, the html of the pages and the contents of the posts saved
+in the old uncompressed format are compressed, and the file is vacuumed.
+"""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import argparse
+
+import pyscp
+
+###############################################################################
+
+
+def upgrade(dbpath, stats=False, search=False, compress=False):
+    creator = pyscp.snapshot.SnapshotCreator(
+        dbpath, update=True, parse_workers=0)
+    if compress:
+        pyscp.orm.compress_column(pyscp.orm.Page.html)
+        pyscp.orm.compress_column(pyscp.orm.ForumPost.content)
+        pyscp.orm.flush()
+    if stats:
+        creator.build_stats()
+    if search:
+        creator.build_search_index()
+    pyscp.orm.finish_bulk_load(vacuum=compress)
+
+###############################################################################
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('dbpath')
+    parser.add_argument(
+        '--stats', action='store_true',
+        help='rebuild the PageStats table')
+    parser.add_argument(
+        '--search', action='store_true',
+        help='rebuild the full-text search index')
+    parser.add_argument(
+        '--compress', action='store_true',
+        help='compress the page and post contents')
+    args = parser.parse_args()
+    pyscp.utils.default_logging()
+    upgrade(
+        args.dbpath, stats=args.stats, search=args.search,
+        compress=args.compress)
@@ -1 +1 @@
-from pyscp import core, utils, snapshot, wikidot
\ No newline at end of file
+from pyscp import core, utils, cache, parsers, store, snapshot, wikidot, aio
\ No newline at end of file
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+"""
+Asynchronous Wikidot access classes.
+
+This module mirrors the read-only part of pyscp.wikidot on top of asyncio,
+which allows a single process to keep hundreds of requests in flight at the
+same time. The network layer is provided by aiohttp, which is an optional
+dependency; the parsing of the returned data is shared with pyscp.wikidot.
+
+Properties that require network access are awaitable:
+
+    async with AsyncWiki('www.scp-wiki.net') as wiki:
+        async for page in wiki.list_pages(tag='scp'):
+            print(page.url, len(await page.votes))
+"""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import asyncio
+import functools
+import json
+import logging
+import random
+import requests
+import urllib.parse
+
+import pyscp.core
+import pyscp.parsers
+import pyscp.wikidot
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+###############################################################################
+# Global Constants And Variables
+###############################################################################
+
+log = logging.getLogger(__name__)
+
+###############################################################################
+# Utility Functions
+###############################################################################
+
+
+def cached_task(func):
+    """
+    Awaitable counterpart of pyscp.utils.cached_property.
+
+    The coroutine is scheduled as a task the first time the property is
+    accessed, and every following access returns the same task, so that
+    concurrent awaiters share a single request.
+    """
+    @property
+    @functools.wraps(func)
+    def wrapper(self):
+        if func.__name__ not in self._cache:
+            self._cache[func.__name__] = asyncio.ensure_future(func(self))
+        return self._cache[func.__name__]
+    return wrapper
+
+###############################################################################
+
+
+class AsyncPage:
+    """Asynchronous counterpart of wikidot.Page."""
+
+    def __init__(self, wiki, url):
+        self.url = url
+        self._wiki = wiki
+        self._body = {}
+        self._cache = {}
+
+    def __repr__(self):
+        return '{}.{}({}, {})'.format(
+            self.__module__, self.__class__.__name__,
+            repr(self.url), repr(self._wiki))
+
+    def __eq__(self, other):
+        if not hasattr(other, 'url') or not hasattr(other, '_wiki'):
+            return False
+        return self.url == other.url and self._wiki is other._wiki
+
+    ###########################################################################
+    # Internal Methods
+    ###########################################################################
+
+    async def _module(self, *args, **kwargs):
+        """Call Wikidot module."""
+        page_id = (await self._pdata)[0]
+        return await self._wiki._module(*args, page_id=page_id, **kwargs)
+
+    @cached_task
+    async def _pdata(self):
+        return self._wiki.parser.pdata(await self._wiki._get(self.url))
+
+    @cached_task
+    async def _thread(self):
+        return self._wiki.Thread(self._wiki, (await self._pdata)[1])
+
+    ###########################################################################
+    # Properties
+    ###########################################################################
+
+    @property
+    def name(self):
+        return self.url.split('/')[-1]
+
+    @cached_task
+    async def html(self):
+        return (await self._pdata)[2]
+
+    @cached_task
+    async def history(self):
+        """Return the revision history of the page."""
+        page_id = (await self._pdata)[0]
+        pages = self._wiki._pager(
+            'history/PageRevisionListModule', _key='page',
+            page=1, perpage=100, page_id=page_id)
+        bodies = [data['body'] async for data in pages]
+        # history pages come newest first, their rows oldest first
+        return [
+            i for body in reversed(bodies)
+            for i in self._wiki.parser.history(body)]
+
+    @cached_task
+    async def votes(self):
+        """Return all votes made on the page."""
+        data = await self._module('pagerate/WhoRatedPageModule')
+        return self._wiki.parser.votes(data['body'])
+
+    @cached_task
+    async def tags(self):
+        if 'tags' in self._body:
+            return set(self._body['tags'].split())
+        return (await self._pdata)[3]
+
+    @cached_task
+    async def rating(self):
+        if 'rating' in self._body:
+            return int(self._body['rating'])
+        return sum(
+            v.value for v in await self.votes
+            if v.user != '(account deleted)')
+
+    @cached_task
+    async def posts(self):
+        """List of the comments made on the page."""
+        return await (await self._thread).posts
+
+
+class AsyncThread(pyscp.core.Thread):
+    """Asynchronous counterpart of wikidot.Thread."""
+
+    def __init__(self, wiki, _id, title=None, description=None):
+        super().__init__(wiki, _id, title, description)
+        self._cache = {}
+
+    @cached_task
+    async def posts(self):
+        if self._id is None:
+            return []
+        pages = self._wiki._pager(
+            'forum/ForumViewThreadPostsModule', _key='pageNo', t=self._id)
+        return [post async for page in pages
+                for post in self._wiki.parser.posts(page['body'])]
+
+
+class AsyncWiki:
+    """
+    Asynchronous counterpart of wikidot.Wiki.
+
+    At most `concurrency` requests are allowed to be in flight at any given
+    time; everything above that waits for a free slot. Failed requests are
+    retried up to `max_attempts` times, same as by InsistentRequest, with
+    an exponential backoff starting at `backoff` seconds. The underlying
+    aiohttp session is created on first use, and should be closed with
+    AsyncWiki.close or by using the wiki as an async context manager.
+    """
+
+    Page = AsyncPage
+    Thread = AsyncThread
+    parser = pyscp.wikidot.Wiki.parser
+
+    ###########################################################################
+    # Special Methods
+    ###########################################################################
+
+    def __init__(
+            self, site, concurrency=100, max_attempts=10, backoff=0.5,
+            max_backoff=60):
+        if aiohttp is None:
+            raise ImportError('AsyncWiki requires the aiohttp package.')
+        parsed = urllib.parse.urlparse(site)
+        netloc = parsed.netloc if parsed.netloc else parsed.path
+        if '.' not in netloc:
+            netloc += '.wikidot.com'
+        self.site = urllib.parse.urlunparse(['http', netloc, '', '', '', ''])
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._session = None
+        self._semaphore = None
+
+    def __repr__(self):
+        return '{}.{}({})'.format(
+            self.__module__, self.__class__.__name__, repr(self.site))
+
+    def __call__(self, name):
+        url = name if self.site in name else '{}/{}'.format(self.site, name)
+        url = url.replace(' ', '-').replace('_', '-').lower()
+        return self.Page(self, url)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    ###########################################################################
+    # Internal Methods
+    ###########################################################################
+
+    async def _sleep(self, attempt):
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        await asyncio.sleep(random.uniform(0, delay))
+
+    async def _request(self, method, url, **kwargs):
+        """Make an auto-retrying request, similar to InsistentRequest."""
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                cookies={'wikidot_token7': '123456'},
+                timeout=aiohttp.ClientTimeout(total=60))
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        log.debug('%s: %s', method, url)
+        for attempt in range(self.max_attempts):
+            if attempt:
+                await self._sleep(attempt)
+            async with self._semaphore:
+                try:
+                    async with self._session.request(
+                            method, url, allow_redirects=False,
+                            **kwargs) as resp:
+                        status = resp.status
+                        text = await resp.text()
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    continue
+            if 200 <= status < 300:
+                return text
+            elif 300 <= status < 400:
+                raise requests.HTTPError(
+                    'Redirect attempted with url: {}'.format(url))
+            elif status == 404:
+                raise requests.HTTPError('Page not found: {}'.format(url))
+        raise requests.ConnectionError(
+            'Max retries exceeded with url: {}'.format(url))
+
+    async def _get(self, url):
+        return await self._request('GET', url)
+
+    async def _module(self, _name, **kwargs):
+        """Call a Wikidot module."""
+        data = dict(
+            pageId=kwargs.get('page_id', None),
+            moduleName=_name,
+            wikidot_token7='123456',
+            **kwargs)
+        # unlike requests, aiohttp doesn't drop or stringify the values
+        data = {k: str(v) for k, v in data.items() if v is not None}
+        response = await self._request(
+            'POST', self.site + '/ajax-module-connector.php', data=data,
+            headers={'Content-Type': 'application/x-www-form-urlencoded;'})
+        response = json.loads(response)
+        if response['status'] != 'ok':
+            log.error(response)
+            raise RuntimeError(response.get('message') or response['status'])
+        return response
+
+    async def _pager(self, _name, _key, _update=None, **kwargs):
+        """
+        Iterate over multi-page module results.
+
+        Once the first page reveals the total number of pages, all of the
+        remaining pages are requested at once, and yielded in order.
+        """
+        first_page = await self._module(_name, **kwargs)
+        yield first_page
+        size = self.parser.pager_size(first_page['body'])
+        tasks = [
+            asyncio.ensure_future(self._module(_name, **dict(
+                kwargs, **{_key: idx if _update is None else _update(idx)})))
+            for idx in range(2, size + 1)]
+        try:
+            for task in tasks:
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    ###########################################################################
+    # Public Methods
+    ###########################################################################
+
+    async def close(self):
+        """Close the underlying http session."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def list_pages(self, **kwargs):
+        """
+        Return pages matching the specified criteria.
+
+        Unlike wikidot.Wiki.list_pages, this doesn't take the scp-wiki
+        authorship metadata into account when filtering by author.
+        """
+        kwargs = pyscp.wikidot.list_pages_kwargs(**kwargs)
+        pages = self._pager(
+            'list/ListPagesModule',
+            _key='offset',
+            _update=lambda x: 250 * (x - 1),
+            perPage=250,
+            **kwargs)
+        async for response in pages:
+            for data in self.parser.list_pages(response['body']):
+                page = self(data['fullname'])
+                page._body = data
+                yield page
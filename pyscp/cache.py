@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+"""
+Persistent response cache.
+
+This module contains the on-disk cache used by wikidot.Wiki to avoid
+re-downloading the same pages and module responses between runs. The cache
+is a single sqlite file holding zlib-compressed json blobs, each with its
+own expiration time. Once the total size of the stored blobs exceeds the
+size cap, the least recently used entries are evicted. The access times
+used for that are kept in memory and saved along with the next write, so
+that cache hits don't have to wait on the disk.
+"""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+
+###############################################################################
+# Global Constants And Variables
+###############################################################################
+
+log = logging.getLogger(__name__)
+
+# time-to-live in seconds for the responses of specific modules.
+# 'GET' is used for the plain page requests. Modules with a ttl of 0 are
+# never cached.
+DEFAULT_TTL = {
+    'GET': 24 * 3600,
+    'list/ListPagesModule': 3600,
+    'pagerate/WhoRatedPageModule': 3600,
+    'history/PageRevisionListModule': 6 * 3600,
+    'forum/ForumViewThreadPostsModule': 6 * 3600,
+    'viewsource/ViewSourceModule': 24 * 3600,
+    'files/PageFilesModule': 24 * 3600,
+    # the recent changes are what tells which cached responses are stale
+    'changes/SiteChangesListModule': 0}
+
+# number of cache hits after which their access times are saved anyway
+MAX_PENDING = 1000
+
+###############################################################################
+
+
+class ResponseCache:
+    """
+    Thread-safe on-disk cache with per-entry TTL and LRU eviction.
+
+    The `ttl` argument is a dict of {name: seconds} that is merged on top
+    of DEFAULT_TTL; names not found in it expire after `default_ttl`
+    seconds. Every entry can carry a tag, which allows discarding all
+    entries related to the same page at once.
+    """
+
+    def __init__(
+            self, path, ttl=None, default_ttl=24 * 3600, max_size=2 ** 30):
+        self.path = path
+        self.ttl = dict(DEFAULT_TTL, **(ttl or {}))
+        self.default_ttl = default_ttl
+        self.max_size = max_size
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._accessed = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                tag TEXT,
+                value BLOB,
+                size INTEGER,
+                expires REAL,
+                accessed REAL);
+            CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed);
+            CREATE INDEX IF NOT EXISTS cache_tag ON cache (tag);""")
+        self._size = self._conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, repr(self.path))
+
+    ###########################################################################
+
+    @staticmethod
+    def key(name, **kwargs):
+        """Build a cache key from the module name and its arguments."""
+        return name + json.dumps(kwargs, sort_keys=True, default=str)
+
+    def caches(self, name):
+        """Check whether the responses of the module are cached at all."""
+        return self.ttl.get(name, self.default_ttl) > 0
+
+    def get(self, key):
+        """Return the cached value, or None if missing or expired."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expires FROM cache WHERE key = ?',
+                (key,)).fetchone()
+            if row and row[1] < time.time():
+                self._delete('key = ?', key)
+                row = None
+            if not row:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._accessed[key] = time.time()
+            if len(self._accessed) >= MAX_PENDING:
+                self._save_accessed()
+                self._conn.commit()
+        return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+
+    def set(self, key, value, name=None, tag=None):
+        """Store the value, with the expiration time based on the name."""
+        if not self.caches(name):
+            return
+        blob = zlib.compress(json.dumps(value).encode('utf-8'))
+        now = time.time()
+        expires = now + self.ttl.get(name, self.default_ttl)
+        with self._lock:
+            self._save_accessed()
+            self._delete('key = ?', key)
+            self._conn.execute(
+                'INSERT INTO cache VALUES (?, ?, ?, ?, ?, ?)',
+                (key, tag, blob, len(blob), expires, now))
+            self._size += len(blob)
+            self._evict()
+            self._conn.commit()
+
+    def discard(self, tag):
+        """Remove all entries with the given tag."""
+        with self._lock:
+            self._save_accessed()
+            self._delete('tag = ?', str(tag))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._accessed.clear()
+            self._delete('1 = ?', 1)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._save_accessed()
+            self._conn.commit()
+            self._conn.close()
+
+    ###########################################################################
+
+    def _delete(self, condition, value):
+        freed = self._conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM cache WHERE ' + condition,
+            (value,)).fetchone()[0]
+        self._conn.execute('DELETE FROM cache WHERE ' + condition, (value,))
+        self._size -= freed
+
+    def _save_accessed(self):
+        """Write the access times of the recent hits."""
+        if self._accessed:
+            self._conn.executemany(
+                'UPDATE cache SET accessed = ? WHERE key = ?',
+                [(v, k) for k, v in self._accessed.items()])
+            self._accessed.clear()
+
+    def _evict(self):
+        """Drop expired, then least recently used entries over the cap."""
+        if self._size <= self.max_size:
+            return
+        self._delete('expires < ?', time.time())
+        rows = self._conn.execute(
+            'SELECT key, size FROM cache ORDER BY accessed').fetchall()
+        for key, size in rows:
+            if self._size <= self.max_size:
+                break
+            self._conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+            self._size -= size
+        log.debug('Cache size after eviction: %d bytes.', self._size)
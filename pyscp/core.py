@@ -39,6 +39,11 @@ import pyscp.utils
 
 log = logging.getLogger(__name__)
 
+
+def count_words(text):
+    """Count the words in the text, as used by Page.wordcount."""
+    return len(re.findall(r"[\w'█_-]+", text))
+
 ###############################################################################
 # Abstract Base Classes
 ###############################################################################
@@ -145,18 +150,63 @@ class Page(metaclass=abc.ABCMeta):
     @property
     def _raw_title(self):
         """Title as displayed on the page."""
-        title = self._soup.find(id='page-title')
-        return title.text.strip() if title else ''
+        return self._analysis.title
 
     @property
     def _raw_author(self):
         return self.history[0].user
 
-    @property
+    @pyscp.utils.cached_property
     def _soup(self):
         """BeautifulSoup of the contents of the page."""
         return bs4.BeautifulSoup(self.html, 'lxml')
 
+    @pyscp.utils.cached_property
+    def _analysis(self):
+        """
+        Data extracted from the html of the page.
+
+        Everything is extracted from a single parse of the html. Unless
+        the wiki's keep_soup attribute is set, the parse tree is discarded
+        afterwards to limit the memory usage. Pages without any html, such
+        as deleted pages, get an empty analysis.
+        """
+        if not self.html:
+            return Analysis(
+                title='', text='', wordcount=0, links=[], images=[],
+                parent=None)
+        soup = self._soup
+        if not self._wiki.keep_soup:
+            self._cache.pop('_soup', None)
+
+        title = soup.find(id='page-title')
+        title = title.text.strip() if title else ''
+        content = soup.find(id='page-content')
+        text = content.text if content else ''
+
+        links = []
+        for element in content('a') if content else []:
+            href = element.get('href', None)
+            if (not href or href[0] != '/' or  # bad or absolute link
+                    href[-4:] in ('.png', '.jpg', '.gif')):
+                continue
+            url = self._wiki.site + href.rstrip('|')
+            if url not in links:
+                links.append(url)
+
+        parent = None
+        breadcrumb = soup.select('#breadcrumbs a')
+        if breadcrumb:
+            parent = self._wiki.site + breadcrumb[-1]['href']
+
+        return Analysis(
+            title=title,
+            text=text,
+            wordcount=count_words(text),
+            links=links,
+            images=[i['src'] for i in soup('img')],
+            parent=parent)
+
     ###########################################################################
     # Properties
     ###########################################################################
@@ -179,18 +229,18 @@ class Page(metaclass=abc.ABCMeta):
     @property
     def text(self):
         """Plain text of the page."""
-        return self._soup.find(id='page-content').text
+        return self._analysis.text
 
     @property
     def wordcount(self):
         """Number of words encountered on the page."""
-        return len(re.findall(r"[\w'█_-]+", self.text))
+        return self._analysis.wordcount
 
     @property
     def images(self):
         """Number of images dislayed on the page."""
         # TODO: needs more work.
-        return [i['src'] for i in self._soup('img')]
+        return list(self._analysis.images)
 
     @property
     def name(self):
@@ -243,7 +293,6 @@ class Page(metaclass=abc.ABCMeta):
             v.value for v in self.votes if v.user != '(account deleted)')
 
     @property
-    @pyscp.utils.listify()
     def links(self):
         """
         Other pages linked from this one.
@@ -251,25 +300,12 @@ class Page(metaclass=abc.ABCMeta):
         Returns an ordered list of unique urls. Off-site links or links to
         images are not included.
         """
-        unique = set()
-        for element in self._soup.select('#page-content a'):
-            href = element.get('href', None)
-            if (not href or href[0] != '/' or  # bad or absolute link
-                    href[-4:] in ('.png', '.jpg', '.gif')):
-                continue
-            url = self._wiki.site + href.rstrip('|')
-            if url not in unique:
-                unique.add(url)
-                yield url
+        return list(self._analysis.links)
 
     @property
     def parent(self):
         """Parent of the current page."""
-        if not self.html:
-            return None
-        breadcrumb = self._soup.select('#breadcrumbs a')
-        if breadcrumb:
-            return self._wiki.site + breadcrumb[-1]['href']
+        return self._analysis.parent
 
     @property
     def is_mainlist(self):
@@ -370,6 +406,9 @@ class Wiki(metaclass=abc.ABCMeta):
     Page = Page
     Thread = Thread
 
+    # whether pages should keep their parse tree after it was analyzed.
+    keep_soup = False
+
     ###########################################################################
     # Special Methods
     ###########################################################################
@@ -494,4 +533,6 @@ File = nt('File', 'url name filetype size')
 Metadata = nt('Metadata', 'url user role date')
 Category = nt('Category', 'id title description size')
 Image = nt('Image', 'url source status notes data')
+Change = nt('Change', 'url time user revision comment')
+Analysis = nt('Analysis', 'title text wordcount links images parent')
 del nt
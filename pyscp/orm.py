@@ -4,31 +4,487 @@
 # Module Imports
 ###############################################################################
 
-import concurrent.futures
+import contextlib
 import logging
+import pathlib
 import peewee
 import queue
+import threading
+import time
+import zlib
 
-from itertools import islice
+from itertools import groupby, islice
 
 ###############################################################################
 # Global Constants And Variables
 ###############################################################################
 
 log = logging.getLogger('pyscp.orm')
-pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
-queue = queue.Queue()
 
+# per-connection settings used by connect.
+# 'bulk' trades durability for speed while a snapshot is being created.
+# In WAL mode, the writes committed before the process dies survive it,
+# which is all a resumed snapshot needs; only a power loss can lose them.
+PRAGMAS = {
+    'default': [],
+    'bulk': [
+        ('journal_mode', 'wal'),
+        ('synchronous', 'off'),
+        ('cache_size', -512 * 1024),
+        ('temp_store', 'memory')],
+    'read': [
+        ('synchronous', 'full'),
+        ('cache_size', -64 * 1024),
+        ('temp_store', 'memory'),
+        ('mmap_size', 2 ** 30)]}
+
+# preset dictionaries for compress, by format version. Wikidot pages are
+# short and share much of their markup, which a plain zlib stream would
+# have to spell out anew in every page. Once a snapshot is written with a
+# dictionary, it must stay unchanged; add a new version instead.
+ZDICTS = {1: """\
+<span class="printuser avatarhover"><a href="http://www.wikidot.com/user:info/\
+" onclick="WIKIDOT.page.listeners.userInfo(\
+); return false;" ><img class="small" src="http://www.wikidot.com/avatar.php?\
+userid=&amp;amp;size=small&amp;amp;timestamp=" alt="" style="background-image:\
+url(http://www.wikidot.com/userkarma.php?u=)" /></a>\
+<span class="odate time_ format_%25e%20%25b%20%25Y%2C%20%25H%3A%25M%7C\
+agohover">\
+<div class="collapsible-block"><div class="collapsible-block-folded">\
+<a class="collapsible-block-link" href="javascript:;">+ show</a></div>\
+<div class="collapsible-block-unfolded" style="display:none">\
+<div class="collapsible-block-unfolded-link">\
+<a class="collapsible-block-link" href="javascript:;">- hide</a></div>\
+<div class="collapsible-block-content">\
+<div class="yui-navset"><ul class="yui-nav"><li class="selected title active">\
+<a href="javascript:;"><em></em></a></li><li class="title"></ul>\
+<div class="yui-content"><div id="wiki-tab-0-0">\
+<div class="page-rate-widget-box"><span class="rate-points">rating:&nbsp;\
+<span class="number prw54353">+</span></span><span class="rateup btn \
+btn-default"><a title="I like it" href="javascript:;" onclick="WIKIDOT.\
+modules.PageRateWidgetModule.listeners.rate(event, 1)">+</a></span><span \
+class="ratedown btn btn-default"><a title="I don't like it" href="javascript\
+:;" onclick="WIKIDOT.modules.PageRateWidgetModule.listeners.rate(event, -1)\
+">&#8211;</a></span><span class="cancel btn btn-default"><a title="Cancel my \
+vote" href="javascript:;" onclick="WIKIDOT.modules.PageRateWidgetModule.\
+listeners.cancelVote(event)">x</a></span></div>
+<div class="footer-wikiwalk-nav">
+<div style="text-align: center;">
+<p>&#171; <a href="/scp-">SCP-</a> | SCP- | <a href="/scp-">SCP-</a> &#187;</p>
+</div>
+</div>
+<div class="scp-image-block block-right" style="width:300px;">\
+<img src="http://scp-wiki.wdfiles.com/local--files/scp-/" \
+style="width:300px;" \
+alt="" class="image" />
+<div class="scp-image-caption" style="width:300px;">
+<table class="wiki-content-table">
+<tr>
+<th></th>
+<td></td>
+</tr>
+</table>
+<blockquote>
+<span style="text-decoration: line-through;"></span>
+<div style="text-align: center;">
+<ul>
+<li></li>
+</ul>
+<hr />
+<br />
+<p><strong>Item #:</strong> SCP-</p>
+<p><strong>Object Class:</strong> Euclid</p>
+<p><strong>Object Class:</strong> Safe</p>
+<p><strong>Object Class:</strong> Keter</p>
+<p><strong>Special Containment Procedures:</strong> </p>
+<p><strong>Description:</strong> </p>
+<p><strong>Addendum</strong></p>
+<div id="main-content">
+<div id="action-area-top"></div>
+<div id="page-title">
+</div>
+<div id="breadcrumbs"><a href="/"></a> &raquo; </div>
+<div id="page-content">
+</div>
+<div id="page-info-break"></div>
+<div class="page-tags">
+<span><a href="/system:page-tags/tag/#pages"></a></span>
+</div>
+<a href="/"></a>
+<em></em>
+<strong></strong>
+<p></p>
+""".encode('utf-8')}
+
+###############################################################################
+# Database Writer
+###############################################################################
+
+
+class Writer:
+    """
+    Background database writer.
+
+    All writes are passed through a queue to a single long-lived thread.
+    The thread collects queued items into batches of up to `batch_size` rows,
+    waiting at most `flush_interval` seconds for a batch to fill up, and
+    writes each batch in a single transaction. Consecutive inserts into the
+    same table are executed with a single executemany call. At most
+    `maxsize` items are held in the queue; beyond that, the callers block
+    until the writer catches up.
+
+    Writes queued inside a Writer.group block are applied all together or
+    not at all.
+    """
+
+    def __init__(self, batch_size=5000, flush_interval=1.0, maxsize=1000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize)
+        self.rows = 0
+        self._started = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def __repr__(self):
+        return '{}(depth={}, rate={:.0f})'.format(
+            self.__class__.__name__, self.depth, self.rate)
+
+    ###########################################################################
+    # Properties
+    ###########################################################################
+
+    @property
+    def depth(self):
+        """Number of items waiting to be written."""
+        return self.queue.qsize()
+
+    @property
+    def rate(self):
+        """Average number of rows written per second."""
+        if not self._started:
+            return 0.0
+        return self.rows / max(time.time() - self._started, 1e-6)
+
+    ###########################################################################
+    # Public Methods
+    ###########################################################################
+
+    def execute(self, fn, args=(), kw=None):
+        """Queue a function call to be executed by the writer thread."""
+        self._put(('call', fn, args, kw or {}))
+
+    def insert(self, model, rows):
+        """Queue the rows, which are dicts of field values, for insertion."""
+        rows = list(rows)
+        if rows:
+            self._put(('insert', model, rows))
+
+    @contextlib.contextmanager
+    def group(self):
+        """
+        Make the writes queued by the current thread inside the block atomic.
+
+        The writes are held back until the block exits, and are then queued
+        as a single item, executed in its own savepoint. If the block raises,
+        nothing is queued; if any of the writes fails, all of them are
+        rolled back.
+        """
+        if getattr(self._local, 'group', None) is not None:
+            yield
+            return
+        self._local.group = []
+        try:
+            yield
+            items = self._local.group
+        finally:
+            self._local.group = None
+        if items:
+            self._put(('group', items))
+
+    def flush(self):
+        """Block until everything queued so far is committed."""
+        self.queue.join()
+
+    def close(self):
+        """Flush the queue and stop the writer thread."""
+        with self._lock:
+            if self._thread is None:
+                return
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    ###########################################################################
+    # Internal Methods
+    ###########################################################################
+
+    def _put(self, item):
+        group = getattr(self._local, 'group', None)
+        if group is not None:
+            group.append(item)
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='pyscp-writer', daemon=True)
+                self._started = self._started or time.time()
+                self._thread.start()
+        self.queue.put(item)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                db.close()
+                self.queue.task_done()
+                return
+            batch = [item]
+            size = self._size(item)
+            deadline = time.time() + self.flush_interval
+            stop = False
+            while size < self.batch_size:
+                try:
+                    item = self.queue.get(
+                        timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+                size += self._size(item)
+            try:
+                self._write(batch)
+            except Exception:
+                log.exception('Failed to write a batch of {} items.'
+                              .format(len(batch)))
+            if stop:
+                db.close()
+            for _ in range(len(batch) + stop):
+                self.queue.task_done()
+            if stop:
+                return
+
+    @classmethod
+    def _size(cls, item):
+        if item[0] == 'group':
+            return sum(cls._size(i) for i in item[1])
+        return len(item[2]) if item[0] == 'insert' else 1
+
+    def _write(self, batch):
+        log.debug('Writing {} queue items.'.format(len(batch)))
+        with db.transaction():
+            self._write_items(batch)
+
+    def _write_items(self, items, strict=False):
+        for kind, group in groupby(items, key=self._group):
+            group = list(group)
+            if kind[0] == 'insert':
+                rows = [row for _, _, rows in group for row in rows]
+                self._insert_rows(kind[1], kind[2], rows, strict)
+            elif kind[0] == 'group':
+                self._write_group(group[0][1])
+            else:
+                for _, fn, args, kw in group:
+                    if strict:
+                        fn(*args, **kw)
+                    else:
+                        self._call(fn, args, kw)
+
+    def _write_group(self, items):
+        try:
+            with db.atomic():
+                self._write_items(items, strict=True)
+        except Exception:
+            log.exception(
+                'Failed to write a group of {} items; rolled back.'
+                .format(len(items)))
+
+    @staticmethod
+    def _group(item):
+        if item[0] == 'insert':
+            return 'insert', item[1], tuple(sorted(item[2][0]))
+        return item[0], id(item)
+
+    def _insert_rows(self, model, columns, rows, strict=False):
+        fields = [model._meta.fields[c] for c in columns]
+        quote = '{0}{{}}{0}'.format(db.quote_char).format
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote(model._meta.db_table),
+            ', '.join(quote(f.db_column) for f in fields),
+            ', '.join(db.interpolation for _ in fields))
+        # rows of the same table can still differ in their keys
+        for keys, part in groupby(rows, key=lambda r: tuple(sorted(r))):
+            part = list(part)
+            if keys != columns:
+                self._insert_rows(model, keys, part, strict)
+                continue
+            params = [[f.db_value(r[c]) for f, c in zip(fields, columns)]
+                      for r in part]
+            try:
+                with db.atomic():
+                    db.get_cursor().executemany(sql, params)
+                self.rows += len(part)
+            except Exception:
+                if strict:
+                    raise
+                # fall back to row-by-row, to lose only the offending rows
+                self.rows += sum(
+                    self._call(db.execute_sql, (sql, row), {})
+                    for row in params)
+
+    @staticmethod
+    def _call(fn, args, kw):
+        """Call the function in a savepoint, returning whether it worked."""
+        try:
+            with db.atomic():
+                fn(*args, **kw)
+            return True
+        except Exception:
+            log.exception(
+                'Exception while processing queue item: {}'
+                .format(dict(fn=fn, args=args, kw=kw)))
+            return False
+
+
+writer = Writer()
 
-def queue_execution(fn, args=(), kw={}):
-    queue.put(dict(fn=fn, args=args, kw=kw))
-    pool.submit(async_write)
+
+def queue_execution(fn, args=(), kw=None):
+    writer.execute(fn, args, kw)
+
+
+def flush():
+    """Wait until all queued writes are committed."""
+    writer.flush()
+
+
+def close():
+    writer.close()
+
+
+class IdTable:
+    """
+    Thread-safe interning table for the rows of a lookup model.
+
+    Maps the values of the given field (e.g. user names) to their ids,
+    assigning the next free id to every value seen for the first time.
+    New values are kept in memory until IdTable.flush queues them all
+    for insertion at once.
+    """
+
+    def __init__(self, model, field='name'):
+        self.model = model
+        self.field = field
+        self._ids = {}
+        self._new = []
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '{}({}, {})'.format(
+            self.__class__.__name__, self.model.__name__, repr(self.field))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, value):
+        return value in self._ids
+
+    def __getitem__(self, value):
+        try:
+            return self._ids[value]
+        except KeyError:
+            pass
+        with self._lock:
+            if value not in self._ids:
+                self._last += 1
+                self._ids[value] = self._last
+                self._new.append(value)
+            return self._ids[value]
+
+    def load(self):
+        """Read the values already present in the database."""
+        field = getattr(self.model, self.field)
+        query = self.model.select(self.model.id, field).tuples()
+        with self._lock:
+            self._ids = {value: id_ for id_, value in query}
+            self._new = []
+            self._last = max(self._ids.values(), default=0)
+
+    def flush(self):
+        """Queue the newly seen values for insertion."""
+        with self._lock:
+            new, self._new = self._new, []
+            rows = [{'id': self._ids[v], self.field: v} for v in new]
+            # queued under the lock, so that the values are always written
+            # before any rows that other threads interned them for
+            self.model.insert_many(rows)
+
+    def clear(self):
+        with self._lock:
+            self._ids = {}
+            self._new = []
+            self._last = 0
 
 ###############################################################################
 # Database ORM Classes
 ###############################################################################
 
-db = peewee.Proxy()
+
+class DatabaseProxy(peewee.Proxy):
+    """
+    Database proxy which can point to a different database in each thread.
+
+    The database set by initialize (see connect) is shared by all threads.
+    Inside a DatabaseProxy.using block, the models are bound to the given
+    database instead, in the current thread only. This allows any number
+    of snapshots to be open at once.
+    """
+
+    __slots__ = ['obj', '_callbacks', '_local']
+
+    def __init__(self):
+        super().__init__()
+        self._local = threading.local()
+
+    def __getattr__(self, attr):
+        stack = getattr(self._local, 'stack', None)
+        if stack:
+            return getattr(stack[-1], attr)
+        return super().__getattr__(attr)
+
+    @contextlib.contextmanager
+    def using(self, database):
+        """Use the database in the current thread within the block."""
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        self._local.stack.append(database)
+        try:
+            yield database
+        finally:
+            self._local.stack.pop()
+
+
+db = DatabaseProxy()
+
+
+class CompressedTextField(peewee.TextField):
+    """
+    Text field stored in compressed form.
+
+    Values are compressed on write, but returned as stored on read: pass
+    them to decompress when the text is actually needed. Uncompressed
+    text, as found in older snapshots, is returned by decompress unchanged.
+    """
+
+    def db_value(self, value):
+        return compress(value) if isinstance(value, str) else value
+
+    def python_value(self, value):
+        return value
 
 
 class BaseModel(peewee.Model):
@@ -38,39 +494,56 @@ class BaseModel(peewee.Model):
 
     @classmethod
     def create(cls, **kw):
-        queue_execution(fn=super().create, kw=kw)
+        writer.insert(cls, [kw])
+
+    @classmethod
+    def create_table(cls, indexes=True):
+        """
+        Create the table, unless it already exists.
+
+        Unique indexes are always created right away. Creation of the other
+        indexes can be deferred until after the data is loaded, by passing
+        indexes=False and calling create_indexes later.
+        """
+        queue_execution(fn=cls._create_table, args=(indexes,))
+
+    @classmethod
+    def _create_table(cls, indexes):
+        if not cls.table_exists():
+            db.create_table(cls)
+        for sql in cls._index_sql(unique=True):
+            db.execute_sql(sql)
+        if indexes:
+            for sql in cls._index_sql(unique=False):
+                db.execute_sql(sql)
 
     @classmethod
-    def create_table(cls):
-        if not hasattr(cls, '_id_cache'):
-            cls._id_cache = []
-        queue_execution(fn=super().create_table, args=(True,))
+    def _index_sql(cls, unique):
+        """Return CREATE INDEX statements for the (non-)unique indexes."""
+        table = cls._meta.db_table
+        for field in cls._fields_to_index():
+            if field.unique != unique:
+                continue
+            yield 'CREATE {}INDEX IF NOT EXISTS "{}" ON "{}" ("{}")'.format(
+                'UNIQUE ' if unique else '',
+                db.compiler().index_name(table, [field.db_column]),
+                table, field.db_column)
 
     @classmethod
     def insert_many(cls, data):
         data_iter = iter(data)
         chunk = list(islice(data_iter, 500))
         while chunk:
-            queue_execution(
-                fn=lambda x: super(BaseModel, cls).insert_many(x).execute(),
-                args=(chunk, ))
+            writer.insert(cls, chunk)
             chunk = list(islice(data_iter, 500))
 
     @classmethod
     def convert_to_id(cls, data, key='user'):
+        """Replace the values under the key with their ids in cls.ids."""
         for row in data:
-            if row[key] not in cls._id_cache:
-                cls._id_cache.append(row[key])
-            row[key] = cls._id_cache.index(row[key]) + 1
+            row[key] = cls.ids[row[key]]
             yield row
 
-    @classmethod
-    def write_ids(cls, field_name):
-        cls.insert_many([
-            {'id': cls._id_cache.index(value) + 1, field_name: value}
-            for value in set(cls._id_cache)])
-        cls._id_cache.clear()
-
 
 class ForumCategory(BaseModel):
     title = peewee.CharField()
@@ -85,7 +558,7 @@ class ForumThread(BaseModel):
 
 class Page(BaseModel):
     url = peewee.CharField(unique=True)
-    html = peewee.TextField()
+    html = CompressedTextField()
     thread = peewee.ForeignKeyField(
         ForumThread, related_name='page', null=True)
 
@@ -115,7 +588,7 @@ class ForumPost(BaseModel):
     parent = peewee.ForeignKeyField('self', null=True)
     title = peewee.CharField(null=True)
     time = peewee.DateTimeField()
-    content = peewee.TextField()
+    content = CompressedTextField()
 
 
 class Tag(BaseModel):
@@ -148,43 +621,254 @@ class Image(BaseModel):
     status = peewee.ForeignKeyField(ImageStatus)
     notes = peewee.TextField(null=True)
 
-###############################################################################
-# Helper Functions
-###############################################################################
 
+class PageStats(BaseModel):
+    """Per-page aggregates, precomputed for fast filtering and sorting."""
+    page = peewee.ForeignKeyField(Page, related_name='stats', unique=True)
+    rating = peewee.IntegerField(index=True)
+    upvotes = peewee.IntegerField(index=True)
+    downvotes = peewee.IntegerField(index=True)
+    # text affinity keeps comparisons against partial dates like '2015'
+    # textual; a datetime column would coerce them to numbers
+    created = peewee.CharField(null=True, index=True)
+    author = peewee.CharField(null=True, index=True)
+    category = peewee.CharField(index=True)
+    # name of the parent page, from the breadcrumbs
+    parent = peewee.CharField(null=True, index=True)
+    revisions = peewee.IntegerField(index=True)
+    comments = peewee.IntegerField(index=True)
+    wordcount = peewee.IntegerField(index=True)
 
-def async_write(buffer=[]):
-    item = queue.get()
-    buffer.append(item)
-    if len(buffer) > 500 or queue.empty():
-        log.debug('Processing {} queue items.'.format(len(buffer)))
-        with db.transaction():
-            write_buffer(buffer)
-        buffer.clear()
 
+class Progress(BaseModel):
+    """Units of work completed by the snapshot being taken."""
+    kind = peewee.CharField()
+    key = peewee.CharField()
 
-def write_buffer(buffer):
-    for item in buffer:
-        try:
-            item['fn'](*item.get('args', ()), **item.get('kw', {}))
-        except:
-            log.exception(
-                'Exception while processing queue item: {}'
-                .format(item))
-        queue.task_done()
 
+for _model in User, Tag, OverrideType, ImageStatus:
+    _model.ids = IdTable(_model)
 
-def create_tables(*tables):
-    for table in tables:
-        eval(table).create_table()
+###############################################################################
+# Helper Functions
+###############################################################################
 
 
-def connect(dbpath):
+def page_category(url):
+    """Return the Wikidot category of the page at the url."""
+    name = url.split('/')[-1]
+    return name.split(':')[0] if ':' in name else '_default'
+
+
+def compress(text, version=max(ZDICTS)):
+    """Compress the text, prefixing the format version."""
+    packer = zlib.compressobj(9, zdict=ZDICTS[version])
+    data = packer.compress(text.encode('utf-8')) + packer.flush()
+    return bytes([version]) + data
+
+
+def decompress(value):
+    """Return the text stored by CompressedTextField."""
+    if not isinstance(value, bytes):
+        return value
+    unpacker = zlib.decompressobj(zdict=ZDICTS[value[0]])
+    return (unpacker.decompress(value[1:]) + unpacker.flush()).decode('utf-8')
+
+
+def compress_column(field):
+    """
+    Compress the values of the field which are still stored as text.
+
+    The rows are read and rewritten in chunks through the writer. The file
+    only shrinks after the database is vacuumed.
+    """
+    table, column = field.model_class._meta.db_table, field.db_column
+    # a raw cursor streams the rows, instead of loading them all at once
+    cursor = db.execute_sql(
+        'SELECT id, "{1}" FROM "{0}" WHERE typeof("{1}") = \'text\''
+        .format(table, column))
+    sql = 'UPDATE "{}" SET "{}" = ? WHERE id = ?'.format(table, column)
+    chunk = []
+    for id_, value in cursor:
+        chunk.append((compress(value), id_))
+        if len(chunk) == 500:
+            queue_execution(fn=_execute_many, args=(sql, chunk))
+            chunk = []
+    if chunk:
+        queue_execution(fn=_execute_many, args=(sql, chunk))
+
+
+def _execute_many(sql, rows):
+    db.get_cursor().executemany(sql, rows)
+
+
+def delete_pages(ids):
+    """Remove the pages, along with their revisions, votes, and comments."""
+    ids = list(ids)
+    threads = [
+        p._data['thread'] for p in Page.select().where(Page.id << ids)
+        if p._data['thread']]
+    for table in Revision, Vote, PageTag:
+        table.delete().where(table.page << ids).execute()
+    if threads:
+        ForumPost.delete().where(ForumPost.thread << threads).execute()
+        ForumThread.delete().where(ForumThread.id << threads).execute()
+    Page.delete().where(Page.id << ids).execute()
+
+
+def create_tables(*tables, indexes=True):
+    for table in tables:
+        eval(table).create_table(indexes)
+
+
+def create_indexes():
+    """Create the indexes deferred by create_table(indexes=False)."""
+    for model in BaseModel.__subclasses__():
+        if model.table_exists():
+            for sql in model._index_sql(unique=False):
+                db.execute_sql(sql)
+
+
+def finish_bulk_load(vacuum=False):
+    """
+    Prepare the database for reading once all the data is loaded.
+
+    Stops the writer, builds the deferred indexes, and gathers statistics
+    for the query planner. Vacuuming additionally defragments the file,
+    which is worth doing once before distributing a snapshot. Finally, the
+    journal is switched back from WAL, so the snapshot is a single file.
+    """
+    close()
+    log.info('Creating indexes.')
+    create_indexes()
+    db.execute_sql('ANALYZE')
+    if vacuum:
+        log.info('Vacuuming the database.')
+        db.execute_sql('VACUUM')
+    try:
+        db.execute_sql('PRAGMA journal_mode = delete')
+    except peewee.OperationalError:
+        log.warning('The database is in use, leaving it in WAL mode.')
+
+
+class SqliteDatabase(peewee.SqliteDatabase):
+    """
+    Sqlite database running extra setup statements on every connection.
+
+    The connections also provide the page_category SQL function.
+    """
+
+    def __init__(self, database, setup=(), **kwargs):
+        self._setup = list(setup)
+        super().__init__(database, **kwargs)
+
+    def _add_conn_hooks(self, conn):
+        super()._add_conn_hooks(conn)
+        conn.create_function('page_category', 1, page_category)
+        for sql in self._setup:
+            conn.execute(sql)
+
+
+def open_database(dbpath, mode='default', setup=(), readonly=False):
+    """
+    Create a database object for the file, without connecting to it.
+
+    The database keeps a separate connection for each thread that uses
+    it. The mode selects the connection settings from PRAGMAS. Read-only
+    connections can't modify the file, and can be opened by any number of
+    threads and processes at once.
+    """
+    if mode not in PRAGMAS:
+        raise ValueError('Unknown connection mode: {}'.format(mode))
+    kwargs = dict(setup=setup, pragmas=list(PRAGMAS[mode]))
+    if readonly:
+        dbpath = pathlib.Path(dbpath).absolute().as_uri() + '?mode=ro'
+        kwargs['uri'] = True
+    return SqliteDatabase(dbpath, **kwargs)
+
+
+def connect(dbpath, mode='default', setup=()):
+    """
+    Connect to the database.
+
+    The mode selects the connection settings from PRAGMAS: 'bulk' for
+    loading large amounts of data, 'read' for querying finished snapshots.
+    The setup statements are executed on each new connection, which is
+    needed for per-connection objects such as temporary views.
+    """
     log.info('Connecting to the database at {}'.format(dbpath))
-    db.initialize(peewee.SqliteDatabase(dbpath))
+    db.initialize(open_database(dbpath, mode, setup))
     db.connect()
 
 
+def table_columns(name):
+    """Return the names of the columns of the table or view, if it exists."""
+    return [row[1] for row in db.execute_sql(
+        'PRAGMA table_info("{}")'.format(name))]
+
+
+def has_table(name):
+    """Check whether a table, or a (temporary) view, exists."""
+    return bool(db.execute_sql(
+        'SELECT 1 FROM sqlite_master WHERE name = ? UNION ALL '
+        'SELECT 1 FROM sqlite_temp_master WHERE name = ?',
+        (name, name)).fetchone())
+
+
+def create_search_table():
+    """
+    Create the full-text search table, unless it already exists.
+
+    Every row is either a page (kind 'page', ref is the page id) or a forum
+    post (kind 'post', ref is the post id). For both, `page` is the id of
+    the page the row belongs to, if any, which is used to filter the
+    results by tags.
+    """
+    db.execute_sql(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5('
+        'title, body, kind UNINDEXED, ref UNINDEXED, page UNINDEXED, '
+        "tokenize='unicode61 remove_diacritics 2')")
+
+
+def search_table_exists():
+    return has_table('search')
+
+
+def index_search_rows(rows):
+    """Insert (title, body, kind, ref, page) tuples into the search table."""
+    db.get_cursor().executemany(
+        'INSERT INTO search (title, body, kind, ref, page) '
+        'VALUES (?, ?, ?, ?, ?)', rows)
+
+
+def delete_search_rows(pages):
+    """Remove the rows belonging to the given pages."""
+    pages = list(pages)
+    for idx in range(0, len(pages), 500):
+        chunk = pages[idx:idx + 500]
+        db.execute_sql(
+            'DELETE FROM search WHERE page IN ({})'
+            .format(', '.join('?' * len(chunk))), chunk)
+
+
+def search(query, limit=20, pages=None):
+    """
+    Return the (kind, ref) of the best matches for the fts5 query.
+
+    If `pages` is a select query of page ids, only the rows belonging to
+    those pages are returned.
+    """
+    sql = 'SELECT kind, ref FROM search WHERE search MATCH ?'
+    params = [query]
+    if pages is not None:
+        subquery, subparams = pages.sql()
+        sql += ' AND page IN ({})'.format(subquery)
+        params += subparams
+    sql += ' ORDER BY rank LIMIT ?'
+    params.append(limit)
+    return db.execute_sql(sql, params).fetchall()
+
+
 ###############################################################################
 # Macros
 ###############################################################################
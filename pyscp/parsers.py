@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+
+"""
+Wikidot HTML parsers.
+
+The responses returned by Wikidot modules are fixed-shape html fragments.
+This module contains the parsers that turn those fragments into the named
+tuples defined in pyscp.core. Two interchangeable backends are provided:
+
+SoupParser builds a full BeautifulSoup tree for every fragment. It is the
+slowest of the two, but also the most forgiving, and serves as the
+reference implementation.
+
+LxmlParser uses raw lxml trees and XPath, which is several times faster.
+Any method it doesn't override falls back to the BeautifulSoup version.
+"""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import arrow
+import bs4
+import lxml.html
+import re
+
+import pyscp.core
+import pyscp.utils
+
+###############################################################################
+# BeautifulSoup Helpers
+###############################################################################
+
+
+@pyscp.utils.ignore((IndexError, TypeError))
+def parse_element_id(element):
+    """Extract the id number from the link."""
+    return int(element['href'].split('/')[2].split('-')[1])
+
+
+def parse_element_time(element):
+    """Extract and format time from an html element."""
+    unixtime = element.find(class_='odate')['class'][1].split('_')[1]
+    return arrow.get(unixtime).format('YYYY-MM-DD HH:mm:ss')
+
+
+def crawl_posts(post_containers, parent=None):
+    """
+    Retrieve posts from the comment tree.
+
+    For each post-container in the given list, returns a tuple of
+    (post, parent), followed by the posts of all the post-container
+    children of the current post-container, depth-first. The tree is
+    walked iteratively, so deeply nested threads don't hit the recursion
+    limit.
+    """
+    stack = [(c, parent) for c in reversed(post_containers)]
+    while stack:
+        container, parent = stack.pop()
+        yield container.find(class_='post'), parent
+        children = container(class_='post-container', recursive=False)
+        container_id = int(container['id'].split('-')[1])
+        stack.extend((c, container_id) for c in reversed(children))
+
+###############################################################################
+
+
+class SoupParser:
+    """Parse Wikidot html with BeautifulSoup."""
+
+    @staticmethod
+    def _soup(html):
+        return bs4.BeautifulSoup(html, 'lxml')
+
+    def pager_size(self, html):
+        """Extract the total number of pages from a paginated module."""
+        counter = self._soup(html).find(class_='pager-no')
+        return int(counter.text.split(' ')[-1]) if counter else 1
+
+    def pdata(self, html):
+        """Extract page id, thread id, contents, and tags from the page."""
+        soup = self._soup(html)
+        return (int(re.search('pageId = ([0-9]+);', html).group(1)),
+                parse_element_id(soup.find(id='discuss-button')),
+                str(soup.find(id='main-content')),
+                {e.text for e in soup.select('.page-tags a')})
+
+    def ids(self, html):
+        """
+        Extract only the page id and the thread id from the page.
+
+        Same as the first two values returned by pdata, but found with
+        regular expressions, without parsing the whole page.
+        """
+        page_id = int(re.search('pageId = ([0-9]+);', html).group(1))
+        button = re.search('<a [^>]*id="discuss-button"[^>]*>', html)
+        href = button and re.search('href="([^"]*)"', button.group(0))
+        try:
+            thread_id = int(href.group(1).split('/')[2].split('-')[1])
+        except (AttributeError, IndexError, ValueError):
+            thread_id = None
+        return page_id, thread_id
+
+    def parent(self, html):
+        """
+        Extract the name of the parent page from the page contents.
+
+        The parent is the last link of the breadcrumbs, if there are any.
+        Found with regular expressions, same as the ids.
+        """
+        crumbs = re.search(
+            '<div id="breadcrumbs">(.*?)</div>', html, re.DOTALL)
+        links = re.findall('href="([^"]*)"', crumbs.group(1)) if crumbs else []
+        return (links[-1].split('/')[-1] or None) if links else None
+
+    def source(self, html):
+        """Extract the page source from ViewSourceModule."""
+        return self._soup(html).text[11:].strip().replace(chr(160), ' ')
+
+    def text(self, html, element='page-content'):
+        """
+        Extract the plain text of the element with the given id.
+
+        By default, that's the contents of the page. If element is None,
+        returns the text of the whole fragment.
+        """
+        soup = self._soup(html)
+        content = soup.find(id=element) if element else soup
+        return content.text if content else ''
+
+    @pyscp.utils.listify()
+    def history(self, html):
+        """Parse PageRevisionListModule into a sorted list of revisions."""
+        for row in reversed(self._soup(html)('tr')[1:]):
+            rev_id = int(row['id'].split('-')[-1])
+            cells = row('td')
+            number = int(cells[0].text.strip('.'))
+            user = cells[4].text
+            time = parse_element_time(cells[5])
+            comment = cells[6].text if cells[6].text else None
+            yield pyscp.core.Revision(rev_id, number, user, time, comment)
+
+    def votes(self, html):
+        """Parse WhoRatedPageModule into a list of votes."""
+        spans = [i.text.strip() for i in self._soup(html)('span')]
+        pairs = zip(spans[::2], spans[1::2])
+        return [pyscp.core.Vote(u, 1 if v == '+' else -1) for u, v in pairs]
+
+    @pyscp.utils.listify()
+    def files(self, html):
+        """
+        Parse PageFilesModule into a list of files.
+
+        The urls of the files are relative to the site.
+        """
+        table = self._soup(html).select('table.page-files')
+        for row in table[0]('tr')[1:] if table else []:
+            url = row.find('a')['href']
+            name = row.find('a').text.strip()
+            filetype = row('td')[1].text.strip()
+            size = row('td')[2].text.strip()
+            yield pyscp.core.File(url, name, filetype, size)
+
+    def posts(self, html):
+        """Parse a single page of ForumViewThreadPostsModule into posts."""
+        body = self._soup(html).body
+        if not body:
+            return
+        containers = body(class_='post-container', recursive=False)
+        for post, parent in crawl_posts(containers):
+            post_id = int(post['id'].split('-')[1])
+            title = post.find(class_='title').text.strip()
+            title = title if title else None
+            content = post.find(class_='content')
+            content.attrs.clear()
+            content = str(content)
+            user = post.find(class_='printuser').text
+            time = parse_element_time(post)
+            yield pyscp.core.Post(
+                post_id, title, content, user, time, parent)
+
+    def list_pages(self, html):
+        """Parse ListPagesModule into a list of field dicts."""
+        return [
+            {r('td')[0].text: r('td')[1].text.strip() for r in page('tr')}
+            for page in self._soup(html).select('div.list-pages-item')]
+
+    @pyscp.utils.listify()
+    def categories(self, html):
+        """Parse ForumStartModule into a list of categories."""
+        for elem in [e.parent for e in self._soup(html)(class_='name')]:
+            cat_id = parse_element_id(elem.select('.title a')[0])
+            title, description, size = [
+                elem.find(class_=i).text.strip()
+                for i in ('title', 'description', 'threads')]
+            yield pyscp.core.Category(cat_id, title, description, int(size))
+
+    @pyscp.utils.listify()
+    def threads(self, html):
+        """Parse ForumViewCategoryModule into (id, title, description)."""
+        for elem in self._soup(html)(class_='name'):
+            thread_id = parse_element_id(elem.select('.title a')[0])
+            title, description = [
+                elem.find(class_=i).text.strip()
+                for i in ('title', 'description')]
+            yield thread_id, title, description
+
+    @pyscp.utils.listify()
+    def changes(self, html):
+        """
+        Parse SiteChangesListModule into a list of changes.
+
+        The urls of the pages are relative to the site.
+        """
+        for item in self._soup(html)(class_='changes-list-item'):
+            revision = item.find(class_='revision-no')
+            revision = re.search(r'[0-9]+', revision.text if revision else '')
+            comment = item.find(class_='comments')
+            comment = comment.text.strip() if comment else None
+            yield pyscp.core.Change(
+                item.select('.title a')[0]['href'],
+                parse_element_time(item.find(class_='mod-date')),
+                item.find(class_='mod-by').text.strip(),
+                int(revision.group()) if revision else None,
+                comment or None)
+
+    @pyscp.utils.listify()
+    def images(self, html):
+        """Parse an image-review page into a list of images."""
+        elems = [e('td') for e in self._soup(html)('tr')]
+        for elem in [e for e in elems if e]:
+            url = elem[0].find('img')['src']
+            source = elem[2].a['href'] if elem[2]('a') else None
+            status, notes = [elem[i].text for i in (3, 4)]
+            status, notes = [i if i else None for i in (status, notes)]
+            yield pyscp.core.Image(url, source, status, notes, None)
+
+
+###############################################################################
+# lxml Helpers
+###############################################################################
+
+
+def _has_class(name):
+    """XPath predicate matching elements with the given css class."""
+    return (
+        'contains(concat(" ", normalize-space(@class), " "), " {} ")'
+        .format(name))
+
+
+def _find_class(element, name):
+    """First descendant with the given css class, or None."""
+    found = element.xpath('(.//*[{}])[1]'.format(_has_class(name)))
+    return found[0] if found else None
+
+
+def _text(element):
+    return element.text_content() if element is not None else ''
+
+
+def _element_id(element):
+    try:
+        return int(element.get('href').split('/')[2].split('-')[1])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def _element_time(element):
+    odate = _find_class(element, 'odate')
+    unixtime = odate.get('class').split()[1].split('_')[1]
+    return arrow.get(unixtime).format('YYYY-MM-DD HH:mm:ss')
+
+
+class LxmlParser(SoupParser):
+    """Parse Wikidot html with lxml and XPath."""
+
+    @staticmethod
+    def _tree(html):
+        return lxml.html.document_fromstring(html if html.strip() else '<p>')
+
+    def pager_size(self, html):
+        counter = self._tree(html).xpath(
+            '//*[{}]'.format(_has_class('pager-no')))
+        return int(_text(counter[0]).split(' ')[-1]) if counter else 1
+
+    def pdata(self, html):
+        tree = self._tree(html)
+        discuss = tree.get_element_by_id('discuss-button', None)
+        content = tree.get_element_by_id('main-content', None)
+        if content is not None:
+            content = lxml.html.tostring(
+                content, encoding='unicode', with_tail=False)
+        tags = tree.xpath('//*[{}]//a'.format(_has_class('page-tags')))
+        return (int(re.search('pageId = ([0-9]+);', html).group(1)),
+                _element_id(discuss),
+                str(content),
+                {_text(e) for e in tags})
+
+    def text(self, html, element='page-content'):
+        tree = self._tree(html)
+        content = tree.get_element_by_id(element, None) if element else tree
+        return content.text_content() if content is not None else ''
+
+    @pyscp.utils.listify()
+    def history(self, html):
+        for row in reversed(self._tree(html).xpath('//tr')[1:]):
+            rev_id = int(row.get('id').split('-')[-1])
+            cells = row.xpath('.//td')
+            number = int(_text(cells[0]).strip('.'))
+            user = _text(cells[4])
+            time = _element_time(cells[5])
+            comment = _text(cells[6]) or None
+            yield pyscp.core.Revision(rev_id, number, user, time, comment)
+
+    def votes(self, html):
+        spans = [_text(i).strip() for i in self._tree(html).xpath('//span')]
+        pairs = zip(spans[::2], spans[1::2])
+        return [pyscp.core.Vote(u, 1 if v == '+' else -1) for u, v in pairs]
+
+    @pyscp.utils.listify()
+    def files(self, html):
+        table = self._tree(html).xpath(
+            '(//table[{}])[1]'.format(_has_class('page-files')))
+        for row in table[0].xpath('.//tr')[1:] if table else []:
+            link = row.xpath('.//a')[0]
+            cells = row.xpath('.//td')
+            yield pyscp.core.File(
+                link.get('href'), _text(link).strip(),
+                _text(cells[1]).strip(), _text(cells[2]).strip())
+
+    def posts(self, html):
+        if not html.strip():
+            return
+        containers = self._tree(html).xpath(
+            '/html/body/*[{}]'.format(_has_class('post-container')))
+        stack = [(c, None) for c in reversed(containers)]
+        while stack:
+            container, parent = stack.pop()
+            post = _find_class(container, 'post')
+            title = _text(_find_class(post, 'title')).strip() or None
+            content = _find_class(post, 'content')
+            content.attrib.clear()
+            content = lxml.html.tostring(
+                content, encoding='unicode', with_tail=False)
+            user = _text(_find_class(post, 'printuser'))
+            yield pyscp.core.Post(
+                int(post.get('id').split('-')[1]), title, content, user,
+                _element_time(post), parent)
+            children = container.xpath(
+                './*[{}]'.format(_has_class('post-container')))
+            container_id = int(container.get('id').split('-')[1])
+            stack.extend((c, container_id) for c in reversed(children))
+
+    def list_pages(self, html):
+        items = self._tree(html).xpath(
+            '//div[{}]'.format(_has_class('list-pages-item')))
+        return [
+            {_text(r[0]): _text(r[1]).strip()
+             for r in (row.xpath('.//td') for row in item.xpath('.//tr'))}
+            for item in items]
+
+    @pyscp.utils.listify()
+    def categories(self, html):
+        names = self._tree(html).xpath('//*[{}]'.format(_has_class('name')))
+        for elem in [e.getparent() for e in names]:
+            link = elem.xpath(
+                './/*[{}]//a'.format(_has_class('title')))[0]
+            title, description, size = [
+                _text(_find_class(elem, i)).strip()
+                for i in ('title', 'description', 'threads')]
+            yield pyscp.core.Category(
+                _element_id(link), title, description, int(size))
+
+    @pyscp.utils.listify()
+    def threads(self, html):
+        names = self._tree(html).xpath('//*[{}]'.format(_has_class('name')))
+        for elem in names:
+            link = elem.xpath(
+                './/*[{}]//a'.format(_has_class('title')))[0]
+            title, description = [
+                _text(_find_class(elem, i)).strip()
+                for i in ('title', 'description')]
+            yield _element_id(link), title, description
+
+    @pyscp.utils.listify()
+    def changes(self, html):
+        items = self._tree(html).xpath(
+            '//*[{}]'.format(_has_class('changes-list-item')))
+        for item in items:
+            link = item.xpath('.//*[{}]//a'.format(_has_class('title')))[0]
+            revision = re.search(
+                r'[0-9]+', _text(_find_class(item, 'revision-no')))
+            comment = _text(_find_class(item, 'comments')).strip()
+            yield pyscp.core.Change(
+                link.get('href'),
+                _element_time(_find_class(item, 'mod-date')),
+                _text(_find_class(item, 'mod-by')).strip(),
+                int(revision.group()) if revision else None,
+                comment or None)
+
+    @pyscp.utils.listify()
+    def images(self, html):
+        for row in self._tree(html).xpath('//tr'):
+            cells = row.xpath('.//td')
+            if not cells:
+                continue
+            url = cells[0].xpath('.//img')[0].get('src')
+            links = cells[2].xpath('.//a')
+            source = links[0].get('href') if links else None
+            status, notes = [_text(cells[i]) or None for i in (3, 4)]
+            yield pyscp.core.Image(url, source, status, notes, None)
+
+###############################################################################
+# Snapshot Parsing
+###############################################################################
+
+# Module-level, so that they can be sent to a process pool along with the
+# parser, and the parsing of the pages saved to a snapshot isn't limited
+# to a single core.
+
+
+def parse_page(parser, data):
+    """
+    Parse the responses downloaded for a page by SnapshotCreator.
+
+    Replaces the raw html of the page and of its history, votes and posts
+    modules with the page contents, tags, and lists of core.Revision,
+    core.Vote and core.Post tuples.
+    """
+    if data is None or data['html'] is None:
+        return data
+    _, _, html, tags = parser.pdata(data['html'])
+    # history pages come newest first, their rows oldest first
+    history = [
+        i for body in reversed(data['history']) for i in parser.history(body)]
+    return dict(
+        data, html=html, tags=tags, history=history,
+        votes=parser.votes(data['votes']),
+        posts=parse_posts(parser, data['posts']))
+
+
+def parse_posts(parser, bodies):
+    """Parse the pages of a forum thread into a list of core.Post tuples."""
+    return [i for body in bodies for i in parser.posts(body)]
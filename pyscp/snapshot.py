@@ -14,14 +14,14 @@ and communication with the sqlite Snapshots.
 import bs4
 import concurrent.futures
 import functools
-import itertools
 import logging
 import operator
+import os
 import pathlib
 import re
 import requests
 
-from pyscp import core, orm, utils
+from pyscp import core, orm, parsers, store, utils
 
 ###############################################################################
 # Global Constants And Variables
@@ -32,9 +32,45 @@ log = logging.getLogger(__name__)
 ###############################################################################
 
 
+def using_db(func):
+    """Run the method with the database of the wiki it belongs to."""
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        wiki = getattr(self, '_wiki', self)
+        with orm.db.using(wiki.db):
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+def with_processes(func):
+    """Run the method with the parse processes of the creator started."""
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if not self.parse_workers or self.processes is not None:
+            return func(self, *args, **kwargs)
+        # the workers are all started before the crawler threads are: a
+        # process forked while another thread holds a lock (such as the
+        # import lock) would never be able to take it
+        orm.flush()
+        self.processes = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.parse_workers)
+        try:
+            self.processes.submit(int).result()
+            return func(self, *args, **kwargs)
+        finally:
+            self.processes.shutdown()
+            self.processes = None
+    return wrapper
+
+###############################################################################
+
+
 class Page(core.Page):
     """Page object."""
 
+    # values read along with the page by Wiki.list_pages
+    _row = {}
+
     ###########################################################################
     # Internal Methods
     ###########################################################################
@@ -44,24 +80,87 @@ class Page(core.Page):
         pt, st = [getattr(orm, i) for i in (ptable, stable)]
         return pt.select(pt, st.name).join(st).where(pt.page == self._id)
 
+    def _from_preload(self, field, key):
+        """Return the value loaded by Wiki.preload, or None."""
+        cache = self._wiki._preloaded.get(field)
+        if cache is not None:
+            return cache.get(key, ())
+
     @utils.cached_property
+    @using_db
     def _pdata(self):
         """Preload the ids and contents of the page."""
+        pdata = self._from_preload('pdata', self.url)
+        if pdata:
+            return pdata
         pdata = orm.Page.get(orm.Page.url == self.url)
         return pdata.id, pdata._data['thread'], pdata.html
 
+    @property
+    def _id(self):
+        """Unique ID number of the page."""
+        return self._row['id'] if 'id' in self._row else self._pdata[0]
+
+    @utils.cached_property
+    def _thread(self):
+        """Thread object corresponding to the page's comments thread."""
+        if 'thread' in self._row:
+            return self._wiki.Thread(self._wiki, self._row['thread'])
+        return super()._thread
+
+    @property
+    def _raw_author(self):
+        if 'author' in self._row:
+            return self._row['author']
+        return super()._raw_author
+
     ###########################################################################
     # Properties
     ###########################################################################
 
-    @property
+    @utils.cached_property
     def html(self):
         """Return HTML contents of the page."""
-        return self._pdata[2]
+        return orm.decompress(self._pdata[2])
+
+    @utils.cached_property
+    @using_db
+    def _stats(self):
+        """Row of the PageStats table, if the snapshot has one."""
+        stats = self._from_preload('stats', self._id)
+        if stats is None and self._wiki._has_stats:
+            stats = (self._wiki._select_stats()
+                     .where(orm.PageStats.page == self._id).dicts().first())
+        return stats or None
+
+    @property
+    def rating(self):
+        """Rating of the page, excluding deleted accounts."""
+        if 'rating' in self._row:
+            return self._row['rating']
+        return self._stats['rating'] if self._stats else super().rating
+
+    @property
+    def created(self):
+        """When was the page created."""
+        if self._row.get('created'):
+            return self._row['created']
+        if self._stats and self._stats['created']:
+            return self._stats['created']
+        return super().created
+
+    @property
+    def wordcount(self):
+        """Number of words encountered on the page."""
+        return self._stats['wordcount'] if self._stats else super().wordcount
 
     @utils.cached_property
+    @using_db
     def history(self):
         """Return the revisions of the page."""
+        preloaded = self._from_preload('history', self._id)
+        if preloaded is not None:
+            return list(preloaded)
         revs = self._query('Revision')
         revs = sorted(revs, key=lambda x: x.number)
         return [core.Revision(
@@ -69,14 +168,22 @@ class Page(core.Page):
                 for r in revs]
 
     @utils.cached_property
+    @using_db
     def votes(self):
         """Return all votes made on the page."""
+        preloaded = self._from_preload('votes', self._id)
+        if preloaded is not None:
+            return list(preloaded)
         return [core.Vote(v.user.name, v.value)
                 for v in self._query('Vote')]
 
     @utils.cached_property
+    @using_db
     def tags(self):
         """Return the set of tags with which the page is tagged."""
+        preloaded = self._from_preload('tags', self._id)
+        if preloaded is not None:
+            return set(preloaded)
         return {pt.tag.name for pt in self._query('PageTag', 'Tag')}
 
 
@@ -84,13 +191,18 @@ class Thread(core.Thread):
     """Discussion/forum thread."""
 
     @utils.cached_property
+    @using_db
     def posts(self):
         """Post objects belonging to this thread."""
+        cache = self._wiki._preloaded.get('posts')
+        if cache is not None:
+            return [p._replace(content=orm.decompress(p.content))
+                    for p in cache.get(self._id, ())]
         fp = orm.ForumPost
         us = orm.User
         query = fp.select(fp, us.name).join(us).where(fp.thread == self._id)
         return [core.Post(
-                p.id, p.title, p.content, p.user.name,
+                p.id, p.title, orm.decompress(p.content), p.user.name,
                 str(p.time), p._data['parent'])
                 for p in query]
 
@@ -106,13 +218,37 @@ class Wiki(core.Wiki):
     # Special Methods
     ###########################################################################
 
-    def __init__(self, site, dbpath):
-        """Create wiki instance."""
+    def __init__(self, site, dbpath, snapshot=None):
+        """
+        Create wiki instance.
+
+        The dbpath can also point to a store.Store, in which case the
+        snapshot argument selects which of the stored snapshots to open,
+        by id or by time (see Store.resolve). By default, the newest one.
+
+        Each wiki has its own read-only database handle, with a separate
+        connection for every thread, and doesn't touch the connection
+        opened by orm.connect. To query the orm models directly, bind
+        them to the wiki first: `with orm.db.using(wiki.db): ...`.
+        """
         super().__init__(site)
         if not pathlib.Path(dbpath).exists():
             raise FileNotFoundError(dbpath)
         self.dbpath = dbpath
-        orm.connect(dbpath)
+        self.snapshot = snapshot
+        setup = ()
+        if store.is_store(dbpath):
+            with store.Store(dbpath) as st:
+                setup = st.views(snapshot)
+        elif snapshot is not None:
+            raise ValueError('{} is not a snapshot store.'.format(dbpath))
+        self.db = orm.open_database(
+            dbpath, mode='read', setup=setup, readonly=True)
+        self._preloaded = {}
+        with orm.db.using(self.db):
+            self._stats_columns = set(
+                orm.table_columns(orm.PageStats._meta.db_table))
+        self._has_stats = bool(self._stats_columns)
 
     def __repr__(self):
         """Pretty-print current instance."""
@@ -126,18 +262,92 @@ class Wiki(core.Wiki):
     # Internal Methods
     ###########################################################################
 
+    def _select_stats(self):
+        """Select the PageStats, without the columns the snapshot lacks."""
+        ps = orm.PageStats
+        return ps.select(*[
+            f for f in ps._meta.sorted_fields
+            if f.db_column in self._stats_columns])
+
+    # Each filter returns a condition on the pages, for the where clause of
+    # the list_pages query, so that any combination of them stays a single
+    # query. With PageStats, most of them only touch its indexed columns.
+
     @staticmethod
     def _filter_author(author):
-        return (orm.Page.select(orm.Page.url)
-                .join(orm.Revision).join(orm.User)
-                .where(orm.Revision.number == 0)
-                .where(orm.User.name == author))
+        return orm.Page.id << (
+            orm.Page.select(orm.Page.id)
+            .join(orm.Revision).join(orm.User)
+            .where(orm.Revision.number == 0)
+            .where(orm.User.name == author))
 
     @staticmethod
-    def _filter_tag(tag):
-        return (orm.Page.select(orm.Page.url)
-                .join(orm.PageTag).join(orm.Tag)
-                .where(orm.Tag.name == tag))
+    def _tagged(names):
+        """Ids of the pages with any of the tags."""
+        pt = orm.PageTag
+        return (pt.select(pt.page).join(orm.Tag)
+                .where(orm.Tag.name << list(names)))
+
+    def _filter_tag(self, tag):
+        return orm.Page.id << self._tagged([tag])
+
+    def _filter_tags(self, tags):
+        """
+        Filter by a Wikidot tag expression.
+
+        Tags prefixed with '+' are required, and tags prefixed with '-' are
+        excluded. Of the remaining tags, the page needs at least one. A
+        lone '-' selects the pages without any tags.
+        """
+        pg, pt = orm.Page, orm.PageTag
+        tags = tags.split()
+        if tags == ['-']:
+            return ~(pg.id << pt.select(pt.page))
+        if '=' in tags or '==' in tags:
+            raise ValueError(
+                'Tags of the current page are not supported in snapshots.')
+        required = [t[1:] for t in tags if t.startswith('+')]
+        excluded = [t[1:] for t in tags if t.startswith('-')]
+        anyof = [t for t in tags if t[0] not in '+-']
+        conditions = [pg.id << self._tagged([t]) for t in required]
+        if anyof:
+            conditions.append(pg.id << self._tagged(anyof))
+        if excluded:
+            conditions.append(~(pg.id << self._tagged(excluded)))
+        if conditions:
+            return functools.reduce(operator.and_, conditions)
+
+    def _filter_category(self, category):
+        """
+        Filter by a list of Wikidot categories.
+
+        Categories prefixed with '-' are excluded, and '*' stands for all of
+        them. Pages without a category in their name are in '_default'.
+        """
+        if 'category' in self._stats_columns:
+            column = orm.PageStats.category
+        else:
+            column = orm.peewee.fn.page_category(orm.Page.url)
+        names = category.split()
+        included = [c for c in names if c[0] != '-']
+        excluded = [c[1:] for c in names if c[0] == '-']
+        conditions = []
+        if included and '*' not in included:
+            conditions.append(column << included)
+        if excluded:
+            conditions.append(~(column << excluded))
+        if conditions:
+            return functools.reduce(operator.and_, conditions)
+
+    def _filter_parent(self, parent):
+        """Filter by the name of the parent page; '-' selects orphans."""
+        if 'parent' not in self._stats_columns:
+            raise RuntimeError(
+                'The snapshot has no page parents. Rebuild its stats with '
+                'bin/upgrade_snapshot.py --stats first.')
+        if parent == '-':
+            return orm.PageStats.parent >> None
+        return orm.PageStats.parent == parent
 
     @staticmethod
     def _get_operator(string):
@@ -150,36 +360,266 @@ class Wiki(core.Wiki):
 
     def _filter_rating(self, rating):
         compare, values = self._get_operator(rating)
-        rating = int(values[0])
-        return (orm.Page.select(orm.Page.url)
-                .join(orm.Vote).group_by(orm.Page.url)
-                .having(compare(orm.peewee.fn.sum(orm.Vote.value), rating)))
+        # same rating as list_pages reads and sorts by, which counts
+        # pages without votes as 0, and ignores deleted accounts
+        return compare(self._columns()['rating'], int(values[0]))
 
     def _filter_created(self, created):
         compare, values = self._get_operator(created)
         date = '-'.join(values[::2])
-        return (orm.Page.select(orm.Page.url)
-                .join(orm.Revision).where(orm.Revision.number == 0)
-                .group_by(orm.Page.url)
-                .having(compare(
-                    orm.peewee.fn.substr(orm.Revision.time, 1, len(date)),
-                    date)))
+        if self._has_stats:
+            return self._compare_prefix(compare, orm.PageStats.created, date)
+        return orm.Page.id << (
+            orm.Page.select(orm.Page.id)
+            .join(orm.Revision).where(orm.Revision.number == 0)
+            .group_by(orm.Page.id)
+            .having(compare(
+                orm.peewee.fn.substr(orm.Revision.time, 1, len(date)),
+                date)))
+
+    @staticmethod
+    def _compare_prefix(compare, field, prefix):
+        """
+        Compare the beginning of the field to the prefix.
+
+        Equivalent to compare(substr(field, 1, len(prefix)), prefix), but
+        expressed as a range, which allows using the index on the field.
+        The upper bound works because '~' sorts after every character that
+        can appear in a timestamp.
+        """
+        upper = prefix + '~'
+        return {
+            operator.eq: (field >= prefix) & (field < upper),
+            operator.gt: field >= upper,
+            operator.ge: field >= prefix,
+            operator.lt: field < prefix,
+            operator.le: field < upper}[compare]
+
+    # Wikidot's names of the orderings supported by list_pages
+    _orders = dict(
+        fullname='url', created_at='created', rating='rating',
+        created_by='author')
+
+    def _columns(self):
+        """Expressions of the values that list_pages can read with the page."""
+        pg, rv, vt, us = orm.Page, orm.Revision, orm.Vote, orm.User
+        if self._has_stats:
+            ps = orm.PageStats
+            return dict(
+                url=pg.url, rating=ps.rating, created=ps.created,
+                author=ps.author)
+        first = (rv.page == pg.id) & (rv.number == 0)
+        return dict(
+            url=pg.url,
+            rating=vt.select(orm.peewee.fn.COALESCE(orm.peewee.fn.SUM(
+                vt.value), 0)).join(us).where(
+                    (vt.page == pg.id) & (us.name != '(account deleted)')),
+            created=rv.select(rv.time).where(first),
+            author=us.select(us.name).join(rv).where(first))
 
+    def _order(self, order, columns):
+        key, *direction = (order or 'fullname').split()
+        if key == 'random':
+            return [orm.peewee.fn.Random()]
+        if key not in self._orders or direction not in ([], ['asc'], ['desc']):
+            raise ValueError('Unknown order: {}'.format(order))
+        column = columns[self._orders[key]]
+        column = column.desc() if direction == ['desc'] else column.asc()
+        return [column, orm.Page.url]
+
+    @using_db
     def _list_pages_parsed(self, **kwargs):
-        query = orm.Page.select(orm.Page.url)
-        keys = ('author', 'tag', 'rating', 'created')
-        keys = [k for k in keys if k in kwargs]
+        """
+        Iterate over the pages matching the filters.
+
+        The pages are read by a single query, and yielded as they come out
+        of the database cursor, so that even listing the whole site takes
+        constant memory. The cursor belongs to the calling thread, which
+        has to be the one consuming the pages. Each page carries its ids,
+        along with the values of the requested `fields` ('rating',
+        'created', 'author'), which are then available without any further
+        queries.
+
+        The order ('fullname', 'created_at', 'rating', 'created_by', or
+        'random', optionally followed by 'asc' or 'desc'), offset, and
+        limit arguments work the same as in Wikidot's ListPages, and so do
+        the tags, category and parent filters. All the filters are
+        compiled into the where clause of the same query.
+        """
+        pg = orm.Page
+        fields = list(kwargs.get('fields', ()))
+        columns = self._columns()
+        unknown = set(fields) - (set(columns) - {'url'})
+        if unknown:
+            raise ValueError(
+                'Unknown list_pages fields: {}'.format(', '.join(unknown)))
+        query = pg.select(pg.url, pg.id, pg.thread, *[
+            columns[f] for f in fields])
+        if self._has_stats:
+            query = query.join(orm.PageStats, orm.peewee.JOIN.LEFT_OUTER)
+        keys = (
+            'author', 'tag', 'tags', 'category', 'parent', 'rating', 'created')
         for k in keys:
-            query = query & getattr(self, '_filter_' + k)(kwargs[k])
+            if kwargs.get(k) is None:
+                continue
+            condition = getattr(self, '_filter_' + k)(kwargs[k])
+            if condition is not None:
+                query = query.where(condition)
+        query = query.order_by(*self._order(kwargs.get('order'), columns))
+        if 'offset' in kwargs:
+            query = query.offset(kwargs['offset'])
         if 'limit' in kwargs:
             query = query.limit(kwargs['limit'])
-        return map(self, [p.url for p in query])
+        # a raw cursor, since peewee would keep all the rows it returns
+        cursor = orm.db.execute_sql(*query.sql())
+        return self._iter_pages(cursor, ['id', 'thread'] + fields)
+
+    def _iter_pages(self, cursor, columns):
+        for url, *values in cursor:
+            page = self(url)
+            page._row = dict(zip(columns, values))
+            yield page
+
+    ###########################################################################
+    # Public Methods
+    ###########################################################################
+
+    def list_pages(self, **kwargs):
+        """
+        Return pages matching the specified criteria.
+
+        See _list_pages_parsed for the supported arguments. The pages are
+        streamed from a database cursor opened by the calling thread, and
+        sqlite connections can't be shared between threads, so the result
+        must be consumed in the thread that called list_pages.
+        """
+        return super().list_pages(**kwargs)
+
+    @using_db
+    def preload(self, fields=('pdata', 'history', 'votes', 'tags', 'posts')):
+        """
+        Load the given fields of all pages at once.
+
+        Each field is read with a single query over the whole table, and
+        then served from memory by the Page and Thread properties, instead
+        of querying the database separately for every page. Preloading
+        'pdata' keeps the html of every page in memory, in the compressed
+        form it's stored in; it's only decompressed when accessed. If the
+        snapshot has the PageStats table, 'stats' can be preloaded as well.
+        """
+        unknown = set(fields) - set(self._loaders)
+        if unknown:
+            raise ValueError('Unknown fields: {}'.format(', '.join(unknown)))
+        for field in fields:
+            log.info('Preloading %s.', field)
+            self._preloaded[field] = getattr(self, self._loaders[field])()
+
+    _loaders = dict(
+        pdata='_load_pdata', history='_load_history', votes='_load_votes',
+        tags='_load_tags', posts='_load_posts', stats='_load_stats')
+
+    @staticmethod
+    def _load_pdata():
+        query = orm.Page.select(
+            orm.Page.url, orm.Page.id, orm.Page.thread, orm.Page.html)
+        return {url: (id_, thread, html)
+                for url, id_, thread, html in query.tuples()}
+
+    @staticmethod
+    def _group(query, make):
+        """Group the rows of the query by the first column."""
+        grouped = {}
+        for row in query.tuples():
+            grouped.setdefault(row[0], []).append(make(*row[1:]))
+        return grouped
+
+    def _load_history(self):
+        rv, us = orm.Revision, orm.User
+        query = (
+            rv.select(rv.page, rv.id, rv.number, us.name, rv.time, rv.comment)
+            .join(us).order_by(rv.page, rv.number))
+        return self._group(query, lambda i, n, u, t, c:
+                           core.Revision(i, n, u, str(t), c))
+
+    def _load_votes(self):
+        vt, us = orm.Vote, orm.User
+        query = vt.select(vt.page, us.name, vt.value).join(us).order_by(vt.id)
+        return self._group(query, core.Vote)
+
+    def _load_tags(self):
+        pt, tg = orm.PageTag, orm.Tag
+        query = pt.select(pt.page, tg.name).join(tg)
+        return self._group(query, lambda name: name)
+
+    def _load_stats(self):
+        return {row['page']: row for row in self._select_stats().dicts()}
+
+    def _load_posts(self):
+        fp, us = orm.ForumPost, orm.User
+        query = (
+            fp.select(fp.thread, fp.id, fp.title, fp.content, us.name,
+                      fp.time, fp.parent)
+            .join(us).order_by(fp.id))
+        return self._group(query, lambda i, ti, c, u, t, p:
+                           core.Post(i, ti, c, u, str(t), p))
+
+    @using_db
+    def search(self, query, limit=20, tags=None, category=None):
+        """
+        Find the pages and posts best matching the query.
+
+        The query uses the sqlite fts5 syntax: words, "quoted phrases",
+        AND/OR/NOT operators, prefix* searches, and column filters such as
+        'title: scp'. If tags are given, only the pages tagged with all of
+        them, and the posts in their discussions, are searched. The
+        category works the same as in list_pages, and narrows the search
+        further.
+
+        Returns a list ordered by relevance, containing Page objects for
+        the matched pages and core.Post tuples for the matched posts.
+        """
+        if not orm.search_table_exists():
+            raise RuntimeError(
+                'The snapshot has no search index. Build it with '
+                'SnapshotCreator.build_search_index.')
+        pg = orm.Page
+        conditions = []
+        if tags:
+            tags = set(tags.split() if isinstance(tags, str) else tags)
+            pt, tg = orm.PageTag, orm.Tag
+            conditions.append(pg.id << (
+                pt.select(pt.page).join(tg).where(tg.name << list(tags))
+                .group_by(pt.page)
+                .having(orm.peewee.fn.COUNT(tg.id) == len(tags))))
+        if category:
+            conditions.append(self._filter_category(category))
+        conditions = [c for c in conditions if c is not None]
+        pages = None
+        if conditions:
+            pages = pg.select(pg.id)
+            if self._has_stats:
+                pages = pages.join(orm.PageStats, orm.peewee.JOIN.LEFT_OUTER)
+            pages = pages.where(functools.reduce(operator.and_, conditions))
+        matches = orm.search(query, limit, pages)
+        ids = {kind: [ref for k, ref in matches if k == kind]
+               for kind in ('page', 'post')}
+        pg, fp, us = orm.Page, orm.ForumPost, orm.User
+        urls = dict(pg.select(pg.id, pg.url)
+                    .where(pg.id << (ids['page'] or [0])).tuples())
+        posts = {p.id: core.Post(
+                 p.id, p.title, orm.decompress(p.content), p.user.name,
+                 str(p.time), p._data['parent'])
+                 for p in fp.select(fp, us.name).join(us)
+                 .where(fp.id << (ids['post'] or [0]))}
+        return [self(urls[ref]) if kind == 'page' else posts[ref]
+                for kind, ref in matches]
 
     ###########################################################################
     # SCP-Wiki Specific Methods
     ###########################################################################
 
     @functools.lru_cache(maxsize=1)
+    @using_db
     def list_images(self):
         """Image metadata."""
         query = (
@@ -209,90 +649,440 @@ class SnapshotCreator:
     metadata is saved.
     """
 
-    def __init__(self, dbpath):
-        """Create an instance."""
-        if pathlib.Path(dbpath).exists():
+    parser = parsers.LxmlParser()
+
+    def __init__(
+            self, dbpath, update=False, resume=False,
+            fetch_workers=20, parse_workers=None):
+        """
+        Create an instance.
+
+        Refuses to overwrite an existing snapshot, unless update is True,
+        in which case the snapshot must exist. With resume=True, an
+        interrupted snapshot in the file is continued by take_snapshot.
+
+        Pages and threads are downloaded by `fetch_workers` threads, and
+        parsed by a pool of `parse_workers` processes (by default, one per
+        core), so that parsing isn't held back by the GIL. The processes
+        only run while take_snapshot or update_snapshot does. On platforms
+        that don't fork, scripts calling those must guard their entry
+        point with `if __name__ == '__main__'`, as usual with
+        multiprocessing. With parse_workers=0, the pages are parsed in a
+        thread instead.
+        """
+        exists = pathlib.Path(dbpath).exists()
+        if exists and not (update or resume):
             raise FileExistsError(dbpath)
-        orm.connect(dbpath)
-        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=20)
+        if update and not exists:
+            raise FileNotFoundError(dbpath)
+        orm.connect(dbpath, mode='bulk')
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=fetch_workers)
+        self.fetch_workers = fetch_workers
+        if parse_workers is None:
+            parse_workers = os.cpu_count() or 1
+        self.parse_workers = parse_workers
+        self.processes = None
+        self.resume = resume
+        self._done = None
+        # whether to bypass the wiki's response cache
+        self._fresh = False
 
-    def take_snapshot(self, wiki, forums=False):
-        """Take new snapshot."""
+    @with_processes
+    def take_snapshot(self, wiki, forums=False, vacuum=False, search=False):
+        """
+        Take new snapshot.
+
+        The indexes are only built after all of the data is saved; with
+        vacuum=True, the database file is also compacted at the end.
+        With search=True, the full-text index used by Wiki.search is
+        built as well.
+
+        Every page and forum thread is saved in a single transaction,
+        together with a record of its completion. If the snapshot is
+        interrupted, a new instance created with resume=True skips the
+        recorded work, and downloads only what remains.
+        """
         self.wiki = wiki
+        self._fresh = False
+        orm.create_tables('Progress', indexes=False)
+        orm.flush()
+        self._done = set()
+        if self.resume:
+            self._done = set(
+                orm.Progress.select(orm.Progress.kind, orm.Progress.key)
+                .tuples())
+            log.info('Resuming snapshot: %d items done.', len(self._done))
+        if ('snapshot', 'complete') in self._done:
+            log.info('Snapshot already complete.')
+            orm.finish_bulk_load(vacuum)
+            return
+        for table in orm.User, orm.Tag, orm.OverrideType, orm.ImageStatus:
+            if self.resume and orm.has_table(table._meta.db_table):
+                table.ids.load()
+            else:
+                table.ids.clear()
         self._save_all_pages()
         if forums:
             self._save_forums()
         if 'scp-wiki' in self.wiki.site:
             self._save_meta()
-        orm.queue.join()
+        orm.flush()
         self._save_cache()
-        orm.queue.join()
+        self.build_stats()
+        if search:
+            self.build_search_index()
+        orm.Progress.create(kind='snapshot', key='complete')
+        orm.finish_bulk_load(vacuum)
         log.info('Snapshot succesfully taken.')
 
+    @with_processes
+    def update_snapshot(self, wiki, since=None):
+        """
+        Bring an existing snapshot up to date.
+
+        Reads the recent changes of the site, made since the given time
+        (by default, the time of the newest revision in the snapshot), and
+        downloads only the pages that were touched. Their old rows are
+        replaced; pages that no longer exist are removed. The responses
+        cached by the wiki, if it has a cache, may predate the changes, so
+        all of the pages are downloaded anew.
+        """
+        self.wiki = wiki
+        self._fresh = True
+        self._done = None
+        if since is None:
+            since = orm.Revision.select(
+                orm.peewee.fn.Max(orm.Revision.time)).scalar()
+        urls = sorted({c.url for c in wiki.list_changes(str(since))})
+        log.info('%d pages changed since %s.', len(urls), since)
+        for table in orm.User, orm.Tag:
+            table.ids.load()
+        query = orm.Page.select(orm.Page.url, orm.Page.id).tuples()
+        self._saved = dict(query)
+        self._saved_ids = set(self._saved.values())
+        self._updated = set()
+        bar = utils.ProgressBar('UPDATING PAGES'.ljust(20), len(urls) or 1)
+        bar.start()
+        pages = (self.wiki(url) for url in urls)
+        for data in self._crawl(pages, self._fetch_page, self._parse_page):
+            self._update_page(data)
+            bar.value += 1
+        bar.stop()
+        orm.flush()
+        self._save_cache()
+        self.build_stats(recount=self._updated)
+        if orm.search_table_exists():
+            self.build_search_index(pages=self._updated)
+        orm.finish_bulk_load()
+        log.info('Snapshot succesfully updated.')
+
+    def build_stats(self, recount=None):
+        """
+        Rebuild the PageStats table from the saved data.
+
+        Word counts and parents require parsing the html of the pages, so
+        only the pages with ids in `recount` are parsed again, if it's
+        given, and the rest keep their previous values. This method can
+        also be used to add the table to an existing snapshot, or to
+        upgrade the table made by an older version.
+        """
+        fn = orm.peewee.fn
+        pg, ps, rv, vt, fp, us = (
+            orm.Page, orm.PageStats, orm.Revision, orm.Vote, orm.ForumPost,
+            orm.User)
+        counted = {}
+        columns = orm.table_columns(ps._meta.db_table)
+        if 'parent' in columns:
+            counted = {id_: values for id_, *values in ps.select(
+                ps.page, ps.wordcount, ps.parent).tuples()}
+        else:
+            recount = None
+        stats = {id_: dict(
+            page=id_, rating=0, upvotes=0, downvotes=0, created=None,
+            author=None, revisions=0, comments=0, wordcount=0,
+            category=orm.page_category(url), parent=None)
+            for id_, url in pg.select(pg.id, pg.url).tuples()}
+
+        def _update(query, *keys):
+            for id_, *values in query.tuples():
+                if id_ in stats:
+                    stats[id_].update(zip(keys, values))
+
+        _update(
+            vt.select(vt.page, fn.SUM(vt.value),
+                      fn.SUM(vt.value > 0), fn.SUM(vt.value < 0))
+            .join(us).where(us.name != '(account deleted)')
+            .group_by(vt.page),
+            'rating', 'upvotes', 'downvotes')
+        _update(
+            rv.select(rv.page, rv.time, us.name)
+            .join(us).where(rv.number == 0),
+            'created', 'author')
+        for row in stats.values():
+            if row['created'] is not None:
+                row['created'] = str(row['created'])
+        _update(
+            rv.select(rv.page, fn.COUNT(rv.id)).group_by(rv.page),
+            'revisions')
+        _update(
+            pg.select(pg.id, fn.COUNT(fp.id))
+            .join(fp, on=(fp.thread == pg.thread)).group_by(pg.id),
+            'comments')
+        for id_ in stats:
+            if recount is not None and id_ not in recount:
+                wordcount, parent = counted.get(id_, (0, None))
+                stats[id_].update(wordcount=wordcount, parent=parent)
+        query = pg.select(pg.id, pg.html)
+        if recount is not None:
+            query = query.where(pg.id << (list(recount) or [0]))
+        for id_, html in utils.pbar(
+                query.tuples(), 'COUNTING WORDS'.ljust(19),
+                query.count() or 1):
+            html = orm.decompress(html)
+            stats[id_]['wordcount'] = core.count_words(self.parser.text(html))
+            stats[id_]['parent'] = self.parser.parent(html)
+
+        # recreated rather than emptied, in case it has the old columns
+        orm.queue_execution(fn=ps.drop_table, kw=dict(fail_silently=True))
+        ps.create_table()
+        ps.insert_many(stats.values())
+        orm.flush()
+
+    def build_search_index(self, pages=None):
+        """
+        Index the text of the pages and posts for Wiki.search.
+
+        If `pages` is given, only the rows of the pages with those ids,
+        along with the posts in their discussions, are replaced.
+        Otherwise, the whole index is rebuilt.
+        """
+        orm.queue_execution(fn=orm.create_search_table)
+        if pages is None:
+            orm.queue_execution(
+                fn=orm.db.execute_sql, args=('DELETE FROM search',))
+        else:
+            pages = list(pages)
+            orm.queue_execution(fn=orm.delete_search_rows, args=(pages,))
+        orm.flush()
+        pg, fp = orm.Page, orm.ForumPost
+        query = pg.select(pg.id, pg.url, pg.thread, pg.html)
+        posts = fp.select(fp.id, fp.thread, fp.title, fp.content)
+        if pages is not None:
+            query = query.where(pg.id << (pages or [0]))
+        threads, rows = {}, []
+
+        def _queue(rows, size):
+            if len(rows) >= size:
+                orm.queue_execution(fn=orm.index_search_rows, args=(rows,))
+                return []
+            return rows
+
+        for id_, url, thread, html in utils.pbar(
+                query.tuples(), 'INDEXING PAGES'.ljust(19),
+                query.count() or 1):
+            name = url.split('/')[-1]
+            text = self.parser.text(orm.decompress(html))
+            rows.append((name, text, 'page', id_, id_))
+            if thread:
+                threads[thread] = id_
+            rows = _queue(rows, 500)
+        if pages is not None:
+            posts = posts.where(fp.thread << (list(threads) or [0]))
+        for id_, thread, title, content in posts.tuples():
+            text = self.parser.text(orm.decompress(content), element=None)
+            rows.append((title or '', text, 'post', id_, threads.get(thread)))
+            rows = _queue(rows, 500)
+        _queue(rows, 1)
+        orm.flush()
+
+    def _update_page(self, data):
+        """Replace the saved data of the page with the current one."""
+        if data is None:
+            return
+        old = {self._saved.get(data['url'])}
+        if data.get('id') in self._saved_ids:
+            old.add(data['id'])
+        old.discard(None)
+        self._updated.update(old)
+        if data['html'] is None:
+            if old:
+                orm.queue_execution(fn=orm.delete_pages, args=(old,))
+            return
+        self._updated.add(data['id'])
+        self._save_page(data, replace=old)
+
+    def _crawl(self, items, fetch, parse):
+        """
+        Download and parse the items in a pipeline.
+
+        Yields the parsed items in the calling thread, which writes them.
+        At most a few items per worker are in flight at any time, however
+        large the site, since the downloads can't get ahead of the parsing,
+        nor the parsing ahead of the writing.
+        """
+        yield from utils.pipeline(
+            items, (fetch, self.fetch_workers),
+            (parse, max(self.parse_workers, 1)))
+
     def _save_all_pages(self):
         """Iterate over the site pages, call _save_page for each."""
         orm.create_tables(
             'Page', 'Revision', 'Vote', 'ForumPost',
-            'PageTag', 'ForumThread', 'User', 'Tag')
+            'PageTag', 'ForumThread', 'User', 'Tag', indexes=False)
         count = next(
             self.wiki.list_pages(body='total', limit=1))._body['total']
         bar = utils.ProgressBar('SAVING PAGES'.ljust(20), int(count))
+        bar.value = sum(kind == 'page' for kind, _ in self._done)
         bar.start()
-        for _ in self.pool.map(self._save_page, self.wiki.list_pages()):
+        pages = (
+            p for p in self.wiki.list_pages()
+            if ('page', p.url) not in self._done)
+        for data in self._crawl(pages, self._fetch_page, self._parse_page):
+            self._save_page(data)
             bar.value += 1
         bar.stop()
 
-    @utils.ignore(requests.HTTPError)
-    def _save_page(self, page):
-        """Download contents, revisions, votes and discussion of the page."""
-        orm.Page.create(
-            id=page._id, url=page.url, thread=page._thread._id, html=page.html)
+    def _fetch_page(self, page):
+        """
+        Download the html, revisions, votes and discussion of the page.
 
-        revisions = orm.User.convert_to_id(i._asdict() for i in page.history)
-        votes = orm.User.convert_to_id(i._asdict() for i in page.votes)
-        tags = [{'tag': t} for t in page.tags]
-        tags = orm.Tag.convert_to_id(tags, key='tag')
+        The responses are returned unparsed, apart from the ids needed to
+        request the rest of them. If the page doesn't exist, its html is
+        None; if any other request fails, the page is skipped.
+        """
+        try:
+            html = self.wiki._get(page.url, _fresh=self._fresh)
+        except requests.HTTPError:
+            return dict(url=page.url, html=None)
+        try:
+            page_id, thread_id = self.parser.ids(html)
+            history = self.wiki._pager(
+                'history/PageRevisionListModule', _key='page',
+                _fresh=self._fresh, page=1, perpage=100, page_id=page_id)
+            votes = self.wiki._module(
+                'pagerate/WhoRatedPageModule', _fresh=self._fresh,
+                page_id=page_id)
+            return dict(
+                url=page.url, html=html, id=page_id, thread=thread_id,
+                history=[i['body'] for i in history], votes=votes['body'],
+                posts=self._fetch_posts(thread_id))
+        except requests.HTTPError:
+            return None
+
+    def _fetch_posts(self, thread_id):
+        if thread_id is None:
+            return []
+        pages = self.wiki._pager(
+            'forum/ForumViewThreadPostsModule', _key='pageNo',
+            _fresh=self._fresh, t=thread_id)
+        return [i['body'] for i in pages]
 
-        def _insert(table, data):
-            table.insert_many(dict(i, page=page._id) for i in data)
+    def _parse(self, fn, *args):
+        """Call the parsing function in the process pool, if there is one."""
+        if self.processes is None:
+            return fn(self.parser, *args)
+        return self.processes.submit(fn, self.parser, *args).result()
 
-        _insert(orm.Revision, revisions)
-        _insert(orm.Vote, votes)
-        _insert(orm.PageTag, tags)
+    def _parse_page(self, data):
+        return self._parse(parsers.parse_page, data)
 
-        self._save_thread(page._thread)
+    def _save_page(self, data, replace=()):
+        """Save the contents, revisions, votes and discussion of the page."""
+        if data is None or data['html'] is None:
+            return
+        rows = [(orm.Page, [dict(
+            id=data['id'], url=data['url'], thread=data['thread'],
+            html=data['html'])])]
+
+        revisions = orm.User.convert_to_id(
+            i._asdict() for i in data['history'])
+        votes = orm.User.convert_to_id(i._asdict() for i in data['votes'])
+        tags = [{'tag': t} for t in data['tags']]
+        tags = orm.Tag.convert_to_id(tags, key='tag')
+
+        for table, values in (
+                (orm.Revision, revisions), (orm.Vote, votes),
+                (orm.PageTag, tags)):
+            rows.append((table, [dict(i, page=data['id']) for i in values]))
+
+        if data['thread'] is not None:
+            thread = self.wiki.Thread(self.wiki, data['thread'])
+            rows.extend(self._thread_rows(thread, data['posts']))
+        self._write(rows, ('page', data['url']), replace)
 
     def _save_forums(self):
         """Download and save standalone forum threads."""
         orm.create_tables(
-            'ForumPost', 'ForumThread', 'ForumCategory', 'User')
+            'ForumPost', 'ForumThread', 'ForumCategory', 'User', indexes=False)
         cats = self.wiki.list_categories()
         cats = [i for i in cats if i.title != 'Per page discussions']
-        orm.ForumCategory.insert_many(dict(
-            id=c.id,
-            title=c.title,
-            description=c.description) for c in cats)
+        if ('forums', 'categories') not in self._done:
+            self._write([(orm.ForumCategory, [dict(
+                id=c.id,
+                title=c.title,
+                description=c.description) for c in cats])],
+                ('forums', 'categories'))
         total_size = sum(c.size for c in cats)
         bar = utils.ProgressBar('SAVING FORUM THREADS', total_size)
         bar.start()
-        for cat in cats:
-            threads = set(self.wiki.list_threads(cat.id))
-            c_id = itertools.repeat(cat.id)
-            for _ in self.pool.map(self._save_thread, threads, c_id):
-                bar.value += 1
+
+        def _threads():
+            for cat in cats:
+                for thread in self.wiki.list_threads(cat.id):
+                    if ('thread', str(thread._id)) in self._done:
+                        bar.value += 1
+                    else:
+                        yield thread, cat.id
+
+        for thread, c_id, posts in self._crawl(
+                _threads(), self._fetch_thread, self._parse_thread):
+            self._write(
+                self._thread_rows(thread, posts, c_id),
+                ('thread', str(thread._id)))
+            bar.value += 1
         bar.stop()
 
-    def _save_thread(self, thread, c_id=None):
-        orm.ForumThread.create(
-            category=c_id, id=thread._id,
-            title=thread.title, description=thread.description)
-        posts = orm.User.convert_to_id([i._asdict() for i in thread.posts])
-        orm.ForumPost.insert_many(
-            dict(p, thread=thread._id) for p in posts)
+    def _fetch_thread(self, item):
+        thread, c_id = item
+        return thread, c_id, self._fetch_posts(thread._id)
+
+    def _parse_thread(self, item):
+        thread, c_id, bodies = item
+        return thread, c_id, self._parse(parsers.parse_posts, bodies)
+
+    def _thread_rows(self, thread, posts, c_id=None):
+        posts = orm.User.convert_to_id([i._asdict() for i in posts])
+        return [
+            (orm.ForumThread, [dict(
+                category=c_id, id=thread._id,
+                title=thread.title, description=thread.description)]),
+            (orm.ForumPost, [dict(p, thread=thread._id) for p in posts])]
+
+    def _write(self, rows, done, replace=()):
+        """
+        Queue the rows as a single atomic write.
+
+        When taking a snapshot, the write includes the record of the
+        completed work. The pages with the ids in `replace` are deleted
+        first, in the same transaction.
+        """
+        # the names interned for the rows are written ahead of them, and
+        # outside of the group, since the rows of later groups rely on them
+        self._save_cache()
+        with orm.writer.group():
+            if replace:
+                orm.queue_execution(fn=orm.delete_pages, args=(replace,))
+            for table, data in rows:
+                table.insert_many(data)
+            if self._done is not None:
+                orm.Progress.create(kind=done[0], key=done[1])
 
     def _save_meta(self):
+        if ('meta', 'images') in self._done:
+            return
         orm.create_tables(
-            'Image', 'ImageStatus')
+            'Image', 'ImageStatus', indexes=False)
         licenses = {
             'PERMISSION GRANTED', 'BY-NC-SA CC', 'BY-SA CC', 'PUBLIC DOMAIN'}
         images = [i for i in self.wiki.list_images() if i.status in licenses]
@@ -303,8 +1093,9 @@ class SnapshotCreator:
         self.ibar.stop()
         images = orm.ImageStatus.convert_to_id(
             [i._asdict() for i in images], key='status')
-        orm.Image.insert_many(
-            dict(i, data=d) for i, d in zip(images, data) if d)
+        self._write([(orm.Image, [
+            dict(i, data=d) for i, d in zip(images, data) if d])],
+            ('meta', 'images'))
 
     @utils.ignore(requests.RequestException)
     def _save_image(self, image):
@@ -316,5 +1107,4 @@ class SnapshotCreator:
 
     def _save_cache(self):
         for table in orm.User, orm.Tag, orm.OverrideType, orm.ImageStatus:
-            if hasattr(table, '_id_cache') and table._id_cache:
-                table.write_ids('name')
+            table.ids.flush()
@@ -34,7 +34,8 @@ class Updater:
         ('Average Wordcount', scalars.wordcount_average))
 
     def __init__(self, source, target):
-        self.pages = list(source.list_pages())
+        self.pages = list(
+            source.list_pages(fields=('author', 'created', 'rating')))
         self.target = target
         self.exist = [p.url for p in target.list_pages()]
 
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+
+"""
+Multi-snapshot store.
+
+Snapshots of the same site taken on successive days are almost identical:
+only a handful of pages change between any two of them. Instead of keeping
+a separate file for each snapshot, the store keeps all of them in a single
+sqlite database. Every row is saved once for the whole run of snapshots in
+which it remained unchanged, and every distinct page html or post body is
+saved once, under the hash of its text.
+
+Snapshots are added from the files made by snapshot.SnapshotCreator:
+
+    store = pyscp.store.Store('scp-wiki.store')
+    store.add('scp-wiki-2016-05-01.db')
+
+Any of them can then be opened with snapshot.Wiki:
+
+    wiki = pyscp.snapshot.Wiki(
+        'www.scp-wiki.net', 'scp-wiki.store', snapshot='2016-05-01')
+
+Point-in-time access works through temporary views, named like the tables
+of a regular snapshot, so everything built on top of the orm works the
+same. The full-text search index is not carried over into the store.
+"""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import arrow
+import hashlib
+import logging
+import os
+import pathlib
+import sqlite3
+
+from pyscp import orm
+
+###############################################################################
+# Global Constants And Variables
+###############################################################################
+
+log = logging.getLogger(__name__)
+
+# tables mapping names to ids. They are shared between all the snapshots,
+# and only ever appended to, so that the ids stay the same in all of them.
+LOOKUPS = (orm.User, orm.Tag, orm.OverrideType, orm.ImageStatus)
+
+# tables with ids that come from wikidot. The ids of the other tables are
+# assigned when the snapshot is created, so their rows are compared
+# without them.
+STABLE_IDS = (
+    orm.Page, orm.Revision, orm.ForumPost, orm.ForumThread, orm.ForumCategory)
+
+###############################################################################
+
+
+def content_hash(value):
+    """Return the hash of the text stored in a CompressedTextField."""
+    if value is None:
+        return None
+    return hashlib.sha1(orm.decompress(value).encode('utf-8')).hexdigest()
+
+
+def is_store(path):
+    """Check whether the file is a store, rather than a single snapshot."""
+    if not pathlib.Path(path).exists():
+        return False
+    uri = pathlib.Path(path).absolute().as_uri() + '?mode=ro'
+    conn = sqlite3.connect(uri, uri=True)
+    try:
+        return bool(conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'snapshots'").fetchone())
+    finally:
+        conn.close()
+
+
+class Store:
+    """
+    Content-addressed store of successive snapshots.
+
+    Every versioned table of the orm has a counterpart named
+    '<table>__versions', with two additional columns: the ids of the first
+    and the last snapshot in which the row is present. Html and post
+    contents are replaced by their hashes, which point into the blobs
+    table.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, isolation_level=None)
+        self._conn.create_function('content_hash', 1, content_hash)
+        self._conn.create_function('page_category', 1, orm.page_category)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                id INTEGER PRIMARY KEY,
+                time TEXT UNIQUE,
+                source TEXT);
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                data BLOB);""")
+        for model in LOOKUPS:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS "{}" ('
+                'id INTEGER PRIMARY KEY, name TEXT UNIQUE)'
+                .format(model._meta.db_table))
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, repr(self.path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    ###########################################################################
+    # Public Methods
+    ###########################################################################
+
+    def close(self):
+        self._conn.close()
+
+    def snapshots(self):
+        """Return the list of (id, time) of the stored snapshots."""
+        return self._conn.execute(
+            'SELECT id, time FROM snapshots ORDER BY id').fetchall()
+
+    def resolve(self, snapshot=None):
+        """
+        Return the id of the snapshot.
+
+        The snapshot can be given by its id, or by time, in which case the
+        newest snapshot taken no later than that is used. Partial times
+        such as '2016-05' are accepted. By default, the newest snapshot.
+        """
+        if snapshot is None:
+            row = self._conn.execute('SELECT MAX(id) FROM snapshots')
+        elif isinstance(snapshot, int):
+            row = self._conn.execute(
+                'SELECT id FROM snapshots WHERE id = ?', (snapshot,))
+        else:
+            row = self._conn.execute(
+                'SELECT MAX(id) FROM snapshots WHERE time < ?',
+                (snapshot + '~',))
+        row = row.fetchone()
+        if not row or row[0] is None:
+            raise LookupError('No such snapshot: {}'.format(snapshot))
+        return row[0]
+
+    def add(self, dbpath, time=None):
+        """
+        Add the snapshot file to the store.
+
+        The time of the snapshot defaults to the modification time of the
+        file, and must be later than that of every snapshot already in the
+        store. Returns the id of the new snapshot.
+        """
+        if not pathlib.Path(dbpath).exists():
+            raise FileNotFoundError(dbpath)
+        if time is None:
+            time = arrow.get(os.path.getmtime(dbpath))
+            time = time.format('YYYY-MM-DD HH:mm:ss')
+        latest = self._conn.execute(
+            'SELECT MAX(id), MAX(time) FROM snapshots').fetchone()
+        if latest[1] is not None and time <= latest[1]:
+            raise ValueError(
+                'Snapshot time {} is not after {}.'.format(time, latest[1]))
+        self._conn.execute('ATTACH DATABASE ? AS src', (dbpath,))
+        try:
+            tables = {r[0] for r in self._conn.execute(
+                "SELECT name FROM src.sqlite_master WHERE type = 'table'")}
+            self._conn.execute('BEGIN')
+            new = self._conn.execute(
+                'INSERT INTO snapshots (time, source) VALUES (?, ?)',
+                (time, str(dbpath))).lastrowid
+            for model in LOOKUPS:
+                if model._meta.db_table in tables:
+                    self._add_lookup(model)
+            for model in self._versioned():
+                if model._meta.db_table in tables:
+                    log.info('Adding %s.', model._meta.db_table)
+                    self._add_versions(model, latest[0], new)
+            self._conn.execute('COMMIT')
+        except:
+            self._conn.execute('ROLLBACK')
+            raise
+        finally:
+            self._conn.execute('DETACH DATABASE src')
+        return new
+
+    def views(self, snapshot=None):
+        """Return the statements creating the views of the snapshot."""
+        snapshot = self.resolve(snapshot)
+        existing = {r[0] for r in self._conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")}
+        statements = []
+        for model in self._versioned():
+            table = model._meta.db_table
+            if table + '__versions' not in existing:
+                continue
+            stored = self._columns(table + '__versions')
+            columns = []
+            for field in model._meta.sorted_fields:
+                if field.db_column not in stored:
+                    continue
+                expr = 'v."{}"'.format(field.db_column)
+                if field.primary_key and model not in STABLE_IDS:
+                    expr = 'v.vid'
+                elif isinstance(field, orm.CompressedTextField):
+                    expr = '(SELECT data FROM blobs WHERE hash = {})'.format(
+                        expr)
+                columns.append('{} AS "{}"'.format(expr, field.db_column))
+            statements.append(
+                'CREATE TEMP VIEW IF NOT EXISTS "{0}" AS SELECT {1} '
+                'FROM "{0}__versions" v WHERE v.first <= {2} AND v.last >= {2}'
+                .format(table, ', '.join(columns), snapshot))
+        return statements
+
+    ###########################################################################
+    # Internal Methods
+    ###########################################################################
+
+    @staticmethod
+    def _versioned():
+        return [
+            m for m in orm.BaseModel.__subclasses__()
+            if m not in LOOKUPS and m is not orm.Progress]
+
+    def _add_lookup(self, model):
+        """Append the new names, and map the snapshot's ids to the store's."""
+        table = model._meta.db_table
+        self._conn.execute(
+            'INSERT INTO "{0}" (name) SELECT DISTINCT name FROM src."{0}" '
+            'WHERE name NOT IN (SELECT name FROM "{0}")'.format(table))
+        self._conn.execute('DROP TABLE IF EXISTS temp."map_{}"'.format(table))
+        self._conn.execute(
+            'CREATE TEMP TABLE "map_{}" (src INTEGER PRIMARY KEY, dst INTEGER)'
+            .format(table))
+        self._conn.execute(
+            'INSERT INTO temp."map_{0}" SELECT s.id, m.id '
+            'FROM src."{0}" s JOIN "{0}" m ON m.name = s.name'.format(table))
+
+    def _columns(self, table, schema='main'):
+        return [r[1] for r in self._conn.execute(
+            'PRAGMA {}.table_info("{}")'.format(schema, table))]
+
+    def _create_versions(self, model, key):
+        table = model._meta.db_table + '__versions'
+        columns = [f.db_column for f in model._meta.sorted_fields]
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS "{}" (vid INTEGER PRIMARY KEY, {}, '
+            'first INTEGER, last INTEGER)'.format(
+                table, ', '.join('"{}"'.format(c) for c in columns)))
+        # columns added to the orm after the table was created
+        for column in columns:
+            if column not in self._columns(table):
+                self._conn.execute('ALTER TABLE "{}" ADD COLUMN "{}"'.format(
+                    table, column))
+                if model is orm.PageStats and column == 'category':
+                    self._fill_categories(table)
+        indexes = [(key, 'last'), ('last', 'first')] + [
+            (f.db_column,) for f in model._fields_to_index()]
+        for index in indexes:
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS "{0}_{1}" ON "{0}" ({2})'.format(
+                    table, '_'.join(index),
+                    ', '.join('"{}"'.format(c) for c in index)))
+
+    def _fill_categories(self, table):
+        """Derive the categories of the stored rows from the page urls."""
+        self._conn.execute(
+            'UPDATE "{0}" SET category = (SELECT page_category(p.url) '
+            'FROM "{1}__versions" p WHERE p.id = "{0}".page_id '
+            'AND p.first <= "{0}".last AND p.last >= "{0}".first)'.format(
+                table, orm.Page._meta.db_table))
+
+    def _add_versions(self, model, previous, new):
+        """
+        Add the rows of the table from the attached snapshot.
+
+        Rows identical to the ones present in the previous snapshot have
+        their last snapshot id extended; the rest are inserted as new.
+        Columns missing from snapshots made by older versions are stored
+        as nulls, apart from the page categories, which are derived from
+        the urls.
+        """
+        table = model._meta.db_table
+        fields = model._meta.sorted_fields
+        columns = [f.db_column for f in fields]
+        compared = [
+            f.db_column for f in fields
+            if model in STABLE_IDS or not f.primary_key]
+        key = compared[0]
+        self._create_versions(model, key)
+        present = self._columns(table, 'src')
+
+        expressions = []
+        for field in fields:
+            expr = 's."{}"'.format(field.db_column)
+            if field.db_column not in present:
+                expr = 'NULL'
+                if field is orm.PageStats.category:
+                    expr = (
+                        '(SELECT page_category(url) FROM src."{}" '
+                        'WHERE id = s."page_id")'.format(
+                            orm.Page._meta.db_table))
+            elif getattr(field, 'rel_model', None) in LOOKUPS:
+                expr = '(SELECT dst FROM temp."map_{}" WHERE src = {})'.format(
+                    field.rel_model._meta.db_table, expr)
+            elif isinstance(field, orm.CompressedTextField):
+                self._conn.execute(
+                    'INSERT OR IGNORE INTO blobs (hash, data) '
+                    'SELECT content_hash({0}), {0} FROM src."{1}" s '
+                    'WHERE {0} IS NOT NULL'.format(expr, table))
+                expr = 'content_hash({})'.format(expr)
+            expressions.append(expr)
+        self._conn.execute('DROP TABLE IF EXISTS temp.stage')
+        self._conn.execute(
+            'CREATE TEMP TABLE stage AS SELECT {} FROM src."{}" s'.format(
+                ', '.join('{} AS "{}"'.format(e, c)
+                          for e, c in zip(expressions, columns)),
+                table))
+        self._conn.execute(
+            'CREATE INDEX temp.stage_key ON stage ("{}")'.format(key))
+
+        versions = '"{}__versions"'.format(table)
+        match = ' AND '.join(
+            '{0}."{1}" IS s."{1}"'.format(versions, c) for c in compared)
+        if previous is not None:
+            self._conn.execute(
+                'UPDATE {0} SET last = ? WHERE last = ? AND EXISTS '
+                '(SELECT 1 FROM temp.stage s WHERE {1})'.format(
+                    versions, match),
+                (new, previous))
+        quoted = ', '.join('"{}"'.format(c) for c in columns)
+        self._conn.execute(
+            'INSERT INTO {0} ({1}, first, last) SELECT {1}, ?, ? '
+            'FROM temp.stage s WHERE NOT EXISTS '
+            '(SELECT 1 FROM {0} WHERE last = ? AND {2})'.format(
+                versions, quoted, match),
+            (new, new, new))
+        self._conn.execute('DROP TABLE temp.stage')
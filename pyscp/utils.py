@@ -4,7 +4,11 @@
 # Module Imports
 ###############################################################################
 
+import collections
+import concurrent.futures
+import itertools
 import logging
+import queue
 import re
 import time
 import threading
@@ -108,6 +112,137 @@ class cached_property:
 ###############################################################################
 
 
+def bounded_map(func, iterable, workers, ordered=True, window=None):
+    """
+    Lazy concurrent version of the builtin map.
+
+    Unlike Executor.map, the input is consumed gradually, and no more than
+    `window` calls (twice the number of workers by default) are pending or
+    waiting to be yielded at any given time. If ordered is False, results
+    are yielded as soon as they become available.
+    """
+    window = window or 2 * workers
+    items = iter(iterable)
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    pending = collections.deque(
+        pool.submit(func, i) for i in itertools.islice(items, window))
+    try:
+        while pending:
+            if ordered:
+                future = pending.popleft()
+            else:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                future = done.pop()
+                pending.remove(future)
+            result = future.result()
+            pending.extend(
+                pool.submit(func, i) for i in itertools.islice(items, 1))
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=False)
+
+
+def pipeline(iterable, *stages, size=None):
+    """
+    Pass the items through a chain of concurrent stages.
+
+    Every stage is a (func, workers) pair, and runs in its own threads.
+    The stages are connected by queues holding at most `size` items (twice
+    the number of workers of the receiving stage by default), so a slow
+    stage holds back the ones before it, instead of letting their results
+    pile up in memory. The input is consumed by a separate thread, and the
+    results of the last stage are yielded in no particular order.
+
+    If any call raises, no more input is consumed, and the exception is
+    re-raised once the items already in the pipeline are drained. If the
+    consumer stops early, all the threads give up and exit.
+    """
+    done = object()
+    failed = threading.Event()
+    closed = threading.Event()
+    errors = []
+    queues = [
+        queue.Queue(size or 2 * workers) for _, workers in stages]
+    queues.append(queue.Queue(size or 2 * stages[-1][1]))
+
+    def _fail(error):
+        errors.append(error)
+        failed.set()
+
+    # the queues are polled, so that no thread stays blocked on them
+    # after the consumer is gone
+    def _put(target, item):
+        while not closed.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(source):
+        while not closed.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return done
+
+    def _feed():
+        try:
+            for item in iterable:
+                if failed.is_set() or not _put(queues[0], item):
+                    break
+        except BaseException as error:
+            _fail(error)
+        for _ in range(stages[0][1]):
+            _put(queues[0], done)
+
+    def _work(idx, func, remaining):
+        source, target = queues[idx], queues[idx + 1]
+        while True:
+            item = _get(source)
+            if item is done:
+                break
+            if failed.is_set():
+                continue
+            try:
+                result = func(item)
+            except BaseException as error:
+                _fail(error)
+                continue
+            if not _put(target, result):
+                break
+        with remaining[1]:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        following = stages[idx + 1][1] if idx + 1 < len(stages) else 1
+        for _ in range(following):
+            _put(target, done)
+
+    threading.Thread(target=_feed, daemon=True).start()
+    for idx, (func, workers) in enumerate(stages):
+        remaining = [workers, threading.Lock()]
+        for _ in range(workers):
+            threading.Thread(
+                target=_work, args=(idx, func, remaining), daemon=True).start()
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is done:
+                break
+            yield item
+    finally:
+        failed.set()
+        closed.set()
+    if errors:
+        raise errors[0]
+
+
 def split(text, delimeters):
     pattern = '|'.join(map(re.escape, delimeters))
     return re.split(pattern, text)
@@ -124,7 +259,7 @@ class ProgressBar:
     def start(self):
         self.finished = False
         self.time_started = time.time()
-        threading.Thread(target=self.run).start()
+        threading.Thread(target=self.run, daemon=True).start()
 
     def update(self):
         print(self.line() + '\r', end='')
@@ -13,12 +13,18 @@ and communication with the Wikidot-hosted sites.
 
 import arrow
 import bs4
+import collections
+import concurrent.futures
 import functools
 import itertools
 import logging
 import pyscp
-import re
+import pyscp.parsers
+import random
 import requests
+import threading
+import time
+import urllib.parse
 
 ###############################################################################
 # Global Constants And Variables
@@ -26,22 +32,131 @@ import requests
 
 log = logging.getLogger(__name__)
 
+# parsing helpers, kept here for backwards compatibility
+parse_element_id = pyscp.parsers.parse_element_id
+parse_element_time = pyscp.parsers.parse_element_time
+crawl_posts = pyscp.parsers.crawl_posts
+
+# Page properties that can be filled from the ListPages results, and the
+# ListPages fields providing them.
+LIST_PAGES_FIELDS = {
+    'title': 'title',
+    'author': 'created_by',
+    'created': 'created_at',
+    'rating': 'rating',
+    'tags': 'tags'}
+
 
 ###############################################################################
 # Utility Classes
 ###############################################################################
 
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+
+    Allows up to `rate` operations per second on average, with bursts of up
+    to `burst` operations.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return the delay before it may be used."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0, -self.tokens / self.rate)
+
+    def acquire(self):
+        time.sleep(self.reserve())
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD concurrency limiter.
+
+    Works as a semaphore with a variable number of slots. The limit grows
+    additively (by one per limit's worth of successes) and is halved after
+    every failure, staying between 1 and `maximum`.
+    """
+
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self.active = 0
+        self.cond = threading.Condition()
+
+    def __enter__(self):
+        with self.cond:
+            self.cond.wait_for(lambda: self.active < int(self.limit))
+            self.active += 1
+
+    def __exit__(self, *exc_info):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+    def success(self):
+        with self.cond:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+    def failure(self):
+        with self.cond:
+            self.limit = max(1, self.limit / 2)
+        log.debug('Concurrency limit lowered to %d.', self.limit)
+
+
 class InsistentRequest(requests.Session):
-    """Make an auto-retrying request that handles connection loss."""
+    """
+    Make an auto-retrying request that handles connection loss.
+
+    The requests to each host are throttled by a TokenBucket allowing `rate`
+    requests per second, and an AdaptiveConcurrency limiter which shrinks
+    on timeouts and server errors and grows back on success. Both are shared
+    by all threads using the session. Retries are delayed by an exponential
+    backoff with full jitter.
+    """
 
-    def __init__(self, max_attempts=10):
+    def __init__(
+            self, max_attempts=10, rate=25, max_concurrency=20,
+            backoff=0.5, max_backoff=60):
         super().__init__()
         self.max_attempts = max_attempts
+        self.rate = rate
+        self.max_concurrency = max_concurrency
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._limiters = {}
+        self._limiters_lock = threading.Lock()
 
     def __repr__(self):
         return '{}(max_attempts={})'.format(
             self.__class__.__name__, self.max_attempts)
 
+    def _limiter(self, url):
+        """Return the rate and concurrency limiters for the url's host."""
+        host = urllib.parse.urlparse(url).netloc
+        with self._limiters_lock:
+            if host not in self._limiters:
+                self._limiters[host] = (
+                    TokenBucket(self.rate),
+                    AdaptiveConcurrency(self.max_concurrency))
+            return self._limiters[host]
+
+    def _sleep(self, attempt):
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        time.sleep(random.uniform(0, delay))
+
     def request(self, method, url, **kwargs):
         logged_kwargs = hide_pass(kwargs)
         logged_kwargs = repr(logged_kwargs) if logged_kwargs else ''
@@ -49,21 +164,31 @@ class InsistentRequest(requests.Session):
 
         kwargs.setdefault('timeout', 60)
         kwargs.setdefault('allow_redirects', False)
-        for _ in range(self.max_attempts):
-            try:
-                resp = super().request(method=method, url=url, **kwargs)
-            except (
-                    requests.ConnectionError,
-                    requests.Timeout,
-                    requests.exceptions.ChunkedEncodingError):
-                continue
+        bucket, concurrency = self._limiter(url)
+        for attempt in range(self.max_attempts):
+            if attempt:
+                self._sleep(attempt)
+            with concurrency:
+                bucket.acquire()
+                try:
+                    resp = super().request(method=method, url=url, **kwargs)
+                except (
+                        requests.ConnectionError,
+                        requests.Timeout,
+                        requests.exceptions.ChunkedEncodingError):
+                    concurrency.failure()
+                    continue
             if 200 <= resp.status_code < 300:
+                concurrency.success()
                 return resp
             elif 300 <= resp.status_code < 400:
                 raise requests.HTTPError(
                     'Redirect attempted with url: {}'.format(url))
-            elif 400 <= resp.status_code < 600:
-                continue
+            elif resp.status_code == 404:
+                raise requests.HTTPError(
+                    'Page not found: {}'.format(url), response=resp)
+            elif resp.status_code == 429 or resp.status_code >= 500:
+                concurrency.failure()
         raise requests.ConnectionError(
             'Max retries exceeded with url: {}'.format(url))
 
@@ -106,8 +231,11 @@ class Page(pyscp.core.Page):
 
     def _action(self, event, **kwargs):
         """Execute WikiPageAction."""
-        return self._module(
+        response = self._module(
             'Empty', action='WikiPageAction', event=event, **kwargs)
+        if self._wiki.cache is not None:
+            self._wiki.cache.discard(self.url)
+        return response
 
     def _vote(self, value):
         """Vote on the page."""
@@ -117,6 +245,19 @@ class Page(pyscp.core.Page):
             points=value,
             force=True)
 
+    def _listed(self, field):
+        """
+        Check whether the ListPages data for the property is available.
+
+        If the page came from list_pages but the field wasn't requested,
+        the fallback to a per-page request is recorded by the wiki.
+        """
+        if LIST_PAGES_FIELDS[field] in self._body:
+            return True
+        if self._body:
+            self._wiki._fallback(field)
+        return False
+
     def _flush(self, *names):
         if not hasattr(self, '_cache'):
             return
@@ -124,22 +265,17 @@ class Page(pyscp.core.Page):
 
     @pyscp.utils.cached_property
     def _pdata(self):
-        data = self._wiki.req.get(self.url).text
-        soup = bs4.BeautifulSoup(data, 'lxml')
-        return (int(re.search('pageId = ([0-9]+);', data).group(1)),
-                parse_element_id(soup.find(id='discuss-button')),
-                str(soup.find(id='main-content')),
-                {e.text for e in soup.select('.page-tags a')})
+        return self._wiki.parser.pdata(self._wiki._get(self.url))
 
     @property
     def _raw_title(self):
-        if 'title' in self._body:
+        if self._listed('title'):
             return self._body['title']
         return super()._raw_title
 
     @property
     def _raw_author(self):
-        if 'created_by' in self._body:
+        if self._listed('author'):
             return self._body['created_by']
         return super()._raw_author
 
@@ -152,52 +288,62 @@ class Page(pyscp.core.Page):
         return self._pdata[2]
 
     @pyscp.utils.cached_property
-    @pyscp.utils.listify()
     def history(self):
         """Return the revision history of the page."""
-        data = self._module(
-            'history/PageRevisionListModule', page=1, perpage=99999)['body']
-        soup = bs4.BeautifulSoup(data, 'lxml')
-        for row in reversed(soup('tr')[1:]):
-            rev_id = int(row['id'].split('-')[-1])
-            cells = row('td')
-            number = int(cells[0].text.strip('.'))
-            user = cells[4].text
-            time = parse_element_time(cells[5])
-            comment = cells[6].text if cells[6].text else None
-            yield pyscp.core.Revision(rev_id, number, user, time, comment)
+        return list(reversed(list(self.iter_history())))
+
+    def iter_history(self, perpage=100, workers=None):
+        """
+        Iterate over the revisions of the page, newest first.
+
+        The history is downloaded in pages of `perpage` revisions, either
+        one page at a time, or by up to `workers` threads at once (defaults
+        to Wiki.pager_workers).
+        """
+        pages = self._wiki._pager(
+            'history/PageRevisionListModule', _key='page', _workers=workers,
+            page=1, perpage=perpage, page_id=self._id)
+        for page in pages:
+            yield from reversed(self._wiki.parser.history(page['body']))
+
+    def history_since(self, number):
+        """
+        Return the revisions made after the given revision number.
+
+        Stops downloading the history as soon as the given revision is
+        reached. The revisions are sorted same as in Page.history.
+        """
+        revisions = self.iter_history()
+        revisions = itertools.takewhile(lambda x: x.number > number, revisions)
+        return list(reversed(list(revisions)))
 
     @pyscp.utils.cached_property
     def votes(self):
         """Return all votes made on the page."""
         data = self._module('pagerate/WhoRatedPageModule')['body']
-        soup = bs4.BeautifulSoup(data, 'lxml')
-        spans = [i.text.strip() for i in soup('span')]
-        pairs = zip(spans[::2], spans[1::2])
-        return [pyscp.core.Vote(u, 1 if v == '+' else -1) for u, v in pairs]
+        return self._wiki.parser.votes(data)
 
     @property
     def tags(self):
-        if 'tags' in self._body:
+        if self._listed('tags'):
             return set(self._body['tags'].split())
         return self._pdata[3]
 
     @property
     def source(self):
         data = self._module('viewsource/ViewSourceModule')['body']
-        soup = bs4.BeautifulSoup(data, 'lxml')
-        return soup.text[11:].strip().replace(chr(160), ' ')
+        return self._wiki.parser.source(data)
 
     @property
     def created(self):
-        if 'created_at' in self._body:
+        if self._listed('created'):
             time = arrow.get(self._body['created_at'], 'DD MMM YYYY HH:mm')
             return time.format('YYYY-MM-DD HH:mm:ss')
         return super().created
 
     @property
     def rating(self):
-        if 'rating' in self._body:
+        if self._listed('rating'):
             return int(self._body['rating'])
         return super().rating
 
@@ -205,18 +351,8 @@ class Page(pyscp.core.Page):
     def files(self):
         """List all files attached to the page."""
         data = self._module('files/PageFilesModule')['body']
-        soup = bs4.BeautifulSoup(data, 'lxml')
-        if not soup.select('table.page-files'):
-            return []
-        files = soup.select('table.page-files')[0]('tr')[1:]
-        parsed = []
-        for file in files:
-            url = self._wiki.site + file.find('a')['href']
-            name = file.find('a').text.strip()
-            filetype = file('td')[1].text.strip()
-            size = file('td')[2].text.strip()
-            parsed.append(pyscp.core.File(url, name, filetype, size))
-        return parsed
+        return [f._replace(url=self._wiki.site + f.url)
+                for f in self._wiki.parser.files(data)]
 
     ###########################################################################
     # Page-Modifying Methods
@@ -226,14 +362,13 @@ class Page(pyscp.core.Page):
         """Overwrite the page with the new source and title."""
         if title is None:
             title = self._raw_title
-        self._flush('html', 'history', 'source')
         wiki_page = self.url.split('/')[-1]
         lock = self._module(
             'edit/PageEditModule',
             mode='page',
             wiki_page=wiki_page,
             force_lock=True)
-        return self._action(
+        response = self._action(
             'savePage',
             source=source,
             title=title,
@@ -242,19 +377,23 @@ class Page(pyscp.core.Page):
             lock_id=lock['lock_id'],
             lock_secret=lock['lock_secret'],
             revision_id=lock.get('page_revision_id', None))
+        self._flush('_pdata', '_soup', '_analysis', 'history', 'source')
+        return response
 
     def create(self, source, title, comment=None):
         if not hasattr(self, '_cache'):
             self._cache = {}
         self._cache['_pdata'] = (None, None, None)
         response = self.edit(source, title, comment)
-        del self._cache['_pdata']
+        self._flush('_pdata')
         return response
 
     def revert(self, rev_n):
         """Revert the page to a previous revision."""
-        self._flush('html', 'history', 'source', 'tags')
-        return self._action('revert', revisionId=self.history[rev_n].id)
+        response = self._action('revert', revisionId=self.history[rev_n].id)
+        self._flush(
+            '_pdata', '_soup', '_analysis', 'history', 'source', 'tags')
+        return response
 
     def set_tags(self, tags):
         """Replace the tags of the page."""
@@ -302,26 +441,25 @@ class Page(pyscp.core.Page):
 class Thread(pyscp.core.Thread):
 
     @pyscp.utils.cached_property
-    @pyscp.utils.listify()
     def posts(self):
+        return list(self.iter_posts())
+
+    def iter_posts(self, prefetch=None):
+        """
+        Iterate over the posts of the thread, one page at a time.
+
+        Up to `prefetch` pages of the thread (defaults to
+        Wiki.pager_workers) are downloaded concurrently ahead of the one
+        being consumed. The posts are not retained, so the memory usage
+        doesn't grow with the length of the thread.
+        """
         if self._id is None:
             return
         pages = self._wiki._pager(
-            'forum/ForumViewThreadPostsModule', _key='pageNo', t=self._id)
-        pages = (bs4.BeautifulSoup(p['body'], 'lxml').body for p in pages)
-        pages = (p for p in pages if p)
-        posts = (p(class_='post-container', recursive=False) for p in pages)
-        posts = itertools.chain.from_iterable(posts)
-        for post, parent in crawl_posts(posts):
-            post_id = int(post['id'].split('-')[1])
-            title = post.find(class_='title').text.strip()
-            title = title if title else None
-            content = post.find(class_='content')
-            content.attrs.clear()
-            content = str(content)
-            user = post.find(class_='printuser').text
-            time = parse_element_time(post)
-            yield pyscp.core.Post(post_id, title, content, user, time, parent)
+            'forum/ForumViewThreadPostsModule', _key='pageNo',
+            _workers=prefetch, t=self._id)
+        for page in pages:
+            yield from self._wiki.parser.posts(page['body'])
 
     def new_post(self, source, title=None, parent_id=None):
         return self._wiki._module(
@@ -347,13 +485,19 @@ class Wiki(pyscp.core.Wiki):
     Thread = Thread
     # Tautology = Tautology
 
+    # html parsing backend, see pyscp.parsers
+    parser = pyscp.parsers.LxmlParser()
+
     ###########################################################################
     # Special Methods
     ###########################################################################
 
-    def __init__(self, site):
+    def __init__(self, site, pager_workers=1, cache=None):
         super().__init__(site)
         self.req = InsistentRequest()
+        self.pager_workers = pager_workers
+        self.cache = cache
+        self.fallbacks = collections.Counter()
 
     def __repr__(self):
         return '{}.{}({})'.format(
@@ -366,14 +510,27 @@ class Wiki(pyscp.core.Wiki):
     ###########################################################################
 
     @pyscp.utils.log_errors(log.warning)
-    def _module(self, _name, **kwargs):
+    def _module(self, _name, _fresh=False, **kwargs):
         """
         Call a Wikidot module.
 
         This method is responsible for most of the class' functionality.
         Almost all other methods of the class are using _module in one way
         or another.
+
+        If the wiki has a cache, the responses are looked up in it first,
+        unless _fresh is True, in which case the cached response is only
+        replaced. Write actions always bypass the cache, and discard the
+        cached responses related to the page or forum thread they modify.
         """
+        write = 'action' in kwargs or _name.startswith('edit/')
+        if self.cache is not None and not write:
+            key = self.cache.key(_name, **kwargs)
+            response = None
+            if not _fresh and self.cache.caches(_name):
+                response = self.cache.get(key)
+            if response is not None:
+                return response
         response = self.req.post(
             self.site + '/ajax-module-connector.php',
             data=dict(
@@ -388,19 +545,69 @@ class Wiki(pyscp.core.Wiki):
         if response['status'] != 'ok':
             log.error(response)
             raise RuntimeError(response.get('message') or response['status'])
+        if self.cache is not None:
+            tag = self._cache_tag(kwargs)
+            if not write:
+                self.cache.set(key, response, _name, tag)
+            elif tag is not None:
+                self.cache.discard(tag)
         return response
 
-    def _pager(self, _name, _key, _update=None, **kwargs):
-        """Iterate over multi-page module results."""
-        first_page = self._module(_name, **kwargs)
+    @staticmethod
+    def _cache_tag(kwargs):
+        """Tag the cached responses with the page or thread they belong to."""
+        if kwargs.get('page_id') is not None:
+            return kwargs['page_id']
+        thread = kwargs.get('t', kwargs.get('threadId'))
+        if thread is not None:
+            return 'thread-{}'.format(thread)
+
+    def _fallback(self, field):
+        """Count properties that had to be fetched page by page."""
+        self.fallbacks[field] += 1
+        if self.fallbacks[field] == 1:
+            log.warning(
+                'Page.%s was not requested from ListPages, falling back to '
+                'per-page requests. Use list_pages(fields=[%r]) instead.',
+                field, field)
+
+    def _get(self, url, _fresh=False):
+        """Download the page at the url, using the cache if present."""
+        if self.cache is None:
+            return self.req.get(url).text
+        key = self.cache.key('GET', url=url)
+        text = None if _fresh else self.cache.get(key)
+        if text is None:
+            text = self.req.get(url).text
+            self.cache.set(key, text, 'GET', url)
+        return text
+
+    def _pager(
+            self, _name, _key, _update=None, _workers=None, _ordered=True,
+            _fresh=False, **kwargs):
+        """
+        Iterate over multi-page module results.
+
+        Once the first page reveals the total number of pages, the rest of
+        them are fetched by up to _workers threads at once (defaults to
+        Wiki.pager_workers). The pages are yielded in order, unless _ordered
+        is False, in which case they're yielded as soon as they arrive.
+        With _fresh=True, none of the pages are read from the cache.
+        """
+        first_page = self._module(_name, _fresh=_fresh, **kwargs)
         yield first_page
-        counter = bs4.BeautifulSoup(
-            first_page['body'], 'lxml').find(class_='pager-no')
-        if not counter:
-            return
-        for idx in range(2, int(counter.text.split(' ')[-1]) + 1):
-            kwargs.update({_key: idx if _update is None else _update(idx)})
-            yield self._module(_name, **kwargs)
+        size = self.parser.pager_size(first_page['body'])
+        pages = (
+            dict(kwargs, **{_key: idx if _update is None else _update(idx)})
+            for idx in range(2, size + 1))
+        workers = self.pager_workers if _workers is None else _workers
+        # no threads are needed for a single remaining page
+        if workers > 1 and size > 2:
+            yield from pyscp.utils.bounded_map(
+                lambda x: self._module(_name, _fresh=_fresh, **x),
+                pages, workers, _ordered)
+        else:
+            yield from (self._module(_name, _fresh=_fresh, **x) for x in pages)
 
     def _list_pages_raw(self, **kwargs):
         """
@@ -424,18 +631,16 @@ class Wiki(pyscp.core.Wiki):
 
         Sets default arguments, parses ListPages body into a namedtuple.
         Returns Page instances with a _body grafted in.
+
+        The `fields` argument lists the Page properties (as named in
+        LIST_PAGES_FIELDS) that should be read from the ListPages results
+        instead of being downloaded separately for each page. Raw ListPages
+        fields can still be requested directly via the `body` argument.
         """
-        keys = set(kwargs.pop('body', '').split() + ['fullname'])
-        kwargs['module_body'] = '\n'.join(
-            map('||{0}||%%{0}%% ||'.format, keys))
-        kwargs['created_by'] = kwargs.pop('author', None)
-        lists = self._list_pages_raw(**kwargs)
-        soups = (bs4.BeautifulSoup(p['body'], 'lxml') for p in lists)
-        pages = (s.select('div.list-pages-item') for s in soups)
-        pages = itertools.chain.from_iterable(pages)
-        for page in pages:
-            data = {
-                r('td')[0].text: r('td')[1].text.strip() for r in page('tr')}
+        kwargs = list_pages_kwargs(**kwargs)
+        for data in itertools.chain.from_iterable(
+                self.parser.list_pages(p['body'])
+                for p in self._list_pages_raw(**kwargs)):
             page = self(data['fullname'])
             page._body = data
             yield page
@@ -454,30 +659,73 @@ class Wiki(pyscp.core.Wiki):
                 action='Login2Action',
                 event='login'))
 
+    def list_changes(self, since=None):
+        """
+        Iterate over the recent changes made on the site, newest first.
+
+        If `since` is given ('YYYY-MM-DD HH:mm:ss'), stops at the first
+        change made at or before that time.
+        """
+        pages = self._pager(
+            'changes/SiteChangesListModule', _key='page', _fresh=True,
+            page=1, perpage=100, options='{"all": true}')
+        for page in pages:
+            for change in self.parser.changes(page['body']):
+                if since and change.time <= since:
+                    return
+                yield change._replace(url=self.site + change.url)
+
+    def prefetch(
+            self, pages, fields=('pdata', 'history', 'votes', 'posts'),
+            workers=20, progress=False):
+        """
+        Download the data of many pages at once.
+
+        Fills the caches of the given pages using up to `workers` threads,
+        so that accessing the respective properties later doesn't require
+        any further requests. Fields are processed one at a time, in the
+        order given; if progress is True, a progress bar is displayed for
+        each field. Pages that fail to download are logged and skipped.
+        Returns the list of the pages.
+        """
+        getters = {
+            'pdata': lambda p: p._pdata,
+            'history': lambda p: p.history,
+            'votes': lambda p: p.votes,
+            'files': lambda p: p.files,
+            'posts': lambda p: p._thread.posts}
+        pages = list(pages)
+
+        def fetch(page, field):
+            try:
+                getters[field](page)
+            except Exception as error:
+                log.warning('Failed to prefetch %s of %s: %s',
+                            field, page.url, error)
+
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            for field in fields:
+                jobs = pool.map(fetch, pages, [field] * len(pages))
+                if progress:
+                    jobs = pyscp.utils.pbar(
+                        jobs, 'PREFETCHING {}'.format(field.upper()),
+                        len(pages))
+                for _ in jobs:
+                    pass
+        return pages
+
     def list_categories(self):
         """Return forum categories."""
         data = self._module('forum/ForumStartModule')['body']
-        soup = bs4.BeautifulSoup(data, 'lxml')
-        for elem in [e.parent for e in soup(class_='name')]:
-            cat_id = parse_element_id(elem.select('.title a')[0])
-            title, description, size = [
-                elem.find(class_=i).text.strip()
-                for i in ('title', 'description', 'threads')]
-            yield pyscp.core.Category(
-                cat_id, title, description, int(size))
+        yield from self.parser.categories(data)
 
     def list_threads(self, category_id):
         """Return threads in the given category."""
         pages = self._pager(
             'forum/ForumViewCategoryModule', _key='p', c=category_id)
-        soups = (bs4.BeautifulSoup(p['body'], 'lxml') for p in pages)
-        elems = (s(class_='name') for s in soups)
-        for elem in itertools.chain(*elems):
-            thread_id = parse_element_id(elem.select('.title a')[0])
-            title, description = [
-                elem.find(class_=i).text.strip()
-                for i in ('title', 'description')]
-            yield self.Thread(self, thread_id, title, description)
+        for page in pages:
+            for thread in self.parser.threads(page['body']):
+                yield self.Thread(self, *thread)
 
     def send_pm(self, username, text, title=None):
         lookup = self.req.get(
@@ -510,44 +758,19 @@ class Wiki(pyscp.core.Wiki):
             return
         base = 'http://scpsandbox2.wikidot.com/image-review-{}'
         urls = [base.format(i) for i in range(1, 36)]
-        pages = [self.req.get(u).text for u in urls]
-        soups = [bs4.BeautifulSoup(p, 'lxml') for p in pages]
-        elems = [s('tr') for s in soups]
-        elems = itertools.chain(*elems)
-        elems = [e('td') for e in elems]
-        elems = [e for e in elems if e]
-        for elem in elems:
-            url = elem[0].find('img')['src']
-            source = elem[2].a['href'] if elem[2]('a') else None
-            status, notes = [elem[i].text for i in (3, 4)]
-            status, notes = [i if i else None for i in (status, notes)]
-            yield pyscp.core.Image(url, source, status, notes, None)
+        for url in urls:
+            yield from self.parser.images(self._get(url))
 
 ###############################################################################
 
 
-@pyscp.utils.ignore((IndexError, TypeError))
-def parse_element_id(element):
-    """Extract the id number from the link."""
-    return int(element['href'].split('/')[2].split('-')[1])
-
-
-def parse_element_time(element):
-    """Extract and format time from an html element."""
-    unixtime = element.find(class_='odate')['class'][1].split('_')[1]
-    return arrow.get(unixtime).format('YYYY-MM-DD HH:mm:ss')
-
-
-def crawl_posts(post_containers, parent=None):
-    """
-    Retrieve posts from the comment tree.
-
-    For each post-container in the given list, returns a tuple of
-    (post, parent). Then recurses onto all the post-container children
-    of the current post-container.
-    """
-    for container in post_containers:
-        yield container.find(class_='post'), parent
-        yield from crawl_posts(
-            container(class_='post-container', recursive=False),
-            int(container['id'].split('-')[1]))
+def list_pages_kwargs(**kwargs):
+    """Translate list_pages arguments into ListPagesModule arguments."""
+    keys = set(kwargs.pop('body', '').split() + ['fullname'])
+    for field in kwargs.pop('fields', ()):
+        if field not in LIST_PAGES_FIELDS:
+            raise ValueError('Unknown ListPages field: {}'.format(field))
+        keys.add(LIST_PAGES_FIELDS[field])
+    kwargs['module_body'] = '\n'.join(map('||{0}||%%{0}%% ||'.format, keys))
+    kwargs['created_by'] = kwargs.pop('author', None)
+    return kwargs
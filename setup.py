@@ -26,4 +26,6 @@ setuptools.setup(
         'lxml==3.3.3',
         'requests',
         'peewee==2.8.0'],
+    extras_require={
+        'async': ['aiohttp']},
 )
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+"""Shared fixtures of the offline tests."""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import pytest
+
+from pyscp import orm
+
+from fakewiki import FakeWiki, make_site
+
+###############################################################################
+# Fixtures
+###############################################################################
+
+
+@pytest.fixture(scope='session', autouse=True)
+def fast_writer():
+    """Don't let the writer wait for full batches, which slows down tests."""
+    interval = orm.writer.flush_interval
+    orm.writer.flush_interval = 0.01
+    yield
+    orm.writer.flush_interval = interval
+
+
+@pytest.fixture
+def database(tmp_path):
+    """Connect the orm to an empty database in a temporary directory."""
+    path = tmp_path / 'test.db'
+    orm.connect(str(path))
+    yield path
+    orm.close()
+
+
+@pytest.fixture
+def fake_wiki():
+    return FakeWiki(make_site())
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+"""
+Fake Wikidot site.
+
+FakeWiki serves a small site made of responses in the same format as those
+of Wikidot, so that snapshots can be taken without network access.
+"""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import re
+import requests
+import threading
+import time
+
+from pyscp import snapshot, wikidot
+
+###############################################################################
+
+# 2014-01-01 00:00:00
+EPOCH = 1388534400
+
+
+def odate(time):
+    return '<span class="odate time_{} format_x">x</span>'.format(time)
+
+
+def printuser(user):
+    return (
+        '<span class="printuser avatarhover"><a href="http://www.wikidot.com/'
+        'user:info/{0}">{0}</a></span>'.format(user))
+
+
+class FakeResponse:
+
+    def __init__(self, text=None, data=None):
+        self.text = text
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class FakeSession:
+    """Session answering the requests made by a FakeWiki itself."""
+
+    def __init__(self, wiki):
+        self.wiki = wiki
+
+    def get(self, url, **kwargs):
+        return FakeResponse(text=self.wiki._serve_page(url))
+
+    def post(self, url, data, **kwargs):
+        data = dict(data)
+        name = data.pop('moduleName')
+        del data['pageId'], data['wikidot_token7']
+        return FakeResponse(data=self.wiki._serve_module(name, **data))
+
+
+class FakeWiki(wikidot.Wiki):
+    """
+    Wiki serving the pages of the `pages` dict instead of downloading them.
+
+    Each page is a dict of its id, thread id, title, text, tags, parent,
+    revisions (list of (user, time, comment)), votes (list of (user, '+' or
+    '-')), and posts (list of (user, time, text)). The paginated modules
+    return `perpage` items per page. Only the http session is replaced, so
+    the requests still go through the cache, if there is one; all requests
+    that reach the session are counted.
+    """
+
+    perpage = 2
+
+    def __init__(self, pages, cache=None):
+        super().__init__('www.test-wiki.net', cache=cache)
+        self.req = FakeSession(self)
+        self.pages = pages
+        self.changes = []
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def _log(self, request):
+        with self._lock:
+            self.requests.append(request)
+
+    def _by_id(self, page_id):
+        return next(p for p in self.pages.values() if p['id'] == page_id)
+
+    def _pager_html(self, items, page):
+        chunk = items[(page - 1) * self.perpage:page * self.perpage]
+        size = (len(items) - 1) // self.perpage + 1
+        if size < 2:
+            return chunk, ''
+        return chunk, '<span class="pager-no">page {} of {}</span>'.format(
+            page, size)
+
+    def _serve_page(self, url):
+        name = url.split('/')[-1]
+        self._log(('get', name))
+        if name not in self.pages:
+            raise requests.HTTPError('404 Client Error: ' + url)
+        page = self.pages[name]
+        crumbs = ''
+        if page['parent']:
+            crumbs = (
+                '<div id="breadcrumbs"><a href="/{}">Parent</a> &raquo; {}'
+                '</div>'.format(page['parent'], page['title']))
+        discuss = ''
+        if page['thread']:
+            discuss = (
+                '<a href="/forum/t-{}/{}" id="discuss-button">discuss</a>'
+                .format(page['thread'], name))
+        tags = ''.join(
+            '<a href="/system:page-tags/tag/{0}#pages">{0}</a>'.format(t)
+            for t in sorted(page['tags']))
+        return (
+            '<script>var pageId = {id};</script>\n'
+            '<div id="main-content">\n{crumbs}'
+            '<div id="page-title">{title}</div>\n'
+            '<div id="page-content"><p>{text}</p></div>\n'
+            '<div class="page-tags"><span>{tags}</span></div>\n</div>\n'
+            '{discuss}'.format(
+                id=page['id'], title=page['title'], text=page['text'],
+                crumbs=crumbs, tags=tags, discuss=discuss))
+
+    def _serve_module(self, _name, **kwargs):
+        self._log((_name, kwargs))
+        handler = getattr(self, '_' + _name.split('/')[-1])
+        return {'status': 'ok', 'body': handler(**kwargs)}
+
+    def _Empty(self, **kwargs):
+        # write actions, which change nothing here
+        return ''
+
+    _PageEditModule = _Empty
+
+    def _ListPagesModule(self, module_body, offset=0, **kwargs):
+        names = sorted(self.pages)
+        if '%%total%%' in module_body:
+            return (
+                '<div class="list-pages-item"><table>'
+                '<tr><td>fullname</td><td>{}</td></tr>'
+                '<tr><td>total</td><td>{}</td></tr></table></div>'
+                .format(names[0], len(names)))
+        keys = re.findall(r'%%(\w+)%%', module_body)
+        # always 250 per page, which is what wikidot.Wiki asks for
+        return ''.join(
+            '<div class="list-pages-item"><table>{}</table></div>'.format(
+                ''.join('<tr><td>{}</td><td>{}</td></tr>'.format(
+                    k, self._list_field(n, k)) for k in keys))
+            for n in names[offset:offset + 250])
+
+    def _list_field(self, name, key):
+        page = self.pages[name]
+        author, created, _ = page['revisions'][0]
+        rating = sum(
+            1 if value == '+' else -1 for user, value in page['votes']
+            if user != '(account deleted)')
+        return dict(
+            fullname=name, title=page['title'], created_by=author,
+            created_at=time.strftime('%d %b %Y %H:%M', time.gmtime(created)),
+            rating=rating, tags=' '.join(sorted(page['tags'])))[key]
+
+    def _PageRevisionListModule(self, page_id, page=1, **kwargs):
+        revisions = self._by_id(page_id)['revisions']
+        # newest first, same as on wikidot
+        items = list(reversed(list(enumerate(revisions))))
+        chunk, pager = self._pager_html(items, page)
+        rows = ''.join(
+            '<tr id="revision-row-{}"><td>{}.</td><td></td><td></td><td></td>'
+            '<td>{}</td><td>{}</td><td>{}</td></tr>'.format(
+                page_id * 100 + number, number, printuser(user),
+                odate(time), comment or '')
+            for number, (user, time, comment) in chunk)
+        return pager + '<table><tr><td>rev.</td></tr>' + rows + '</table>'
+
+    def _WhoRatedPageModule(self, page_id, **kwargs):
+        return ''.join(
+            '{}&nbsp;<span>{}</span><br/>'.format(printuser(user), value)
+            for user, value in self._by_id(page_id)['votes'])
+
+    def _ForumViewThreadPostsModule(self, t, pageNo=1, **kwargs):
+        page = next(p for p in self.pages.values() if p['thread'] == t)
+        items = [
+            (t * 10 + idx, post) for idx, post in enumerate(page['posts'])]
+        chunk, pager = self._pager_html(items, pageNo)
+        posts = ''.join(
+            '<div class="post-container" id="fpc-{0}">'
+            '<div class="post" id="post-{0}"><div class="head">'
+            '<div class="title"></div><div class="info">{1} {2}</div></div>'
+            '<div class="content"><p>{3}</p></div></div></div>'.format(
+                post_id, printuser(user), odate(time), text)
+            for post_id, (user, time, text) in chunk)
+        return posts + pager
+
+    def _SiteChangesListModule(self, page=1, **kwargs):
+        # newest first
+        items = sorted(self.changes, key=lambda x: x[1], reverse=True)
+        chunk, pager = self._pager_html(items, page)
+        return ''.join(
+            '<div class="changes-list-item"><table><tr>'
+            '<td class="title"><a href="/{}">x</a></td>'
+            '<td class="mod-date">{}</td><td class="mod-by">{}</td>'
+            '</tr></table></div>'.format(name, odate(time), printuser(user))
+            for name, time, user in chunk) + pager
+
+    def _now(self):
+        return max(
+            r[1] for p in self.pages.values() for r in p['revisions']) + 60
+
+    def edit(self, name, user='dave', **values):
+        """Change the page, creating it if needed, and list the change."""
+        time = self._now()
+        if name not in self.pages:
+            self.pages[name] = make_page(
+                name, len(self.pages), [user], created=time)
+        else:
+            self.pages[name]['revisions'].append((user, time, 'edited'))
+        self.pages[name].update(values)
+        self.changes.append((name, time, user))
+
+    def delete(self, name, user='dave'):
+        self.changes.append((name, self._now(), user))
+        del self.pages[name]
+
+
+def make_page(
+        name, idx, authors, tags='', parent=None, votes='', posts=0,
+        created=None):
+    """
+    Make a page of FakeWiki.
+
+    By default, the page is created 40 days after the previous one, and
+    each of the following revisions an hour after the one before it. The
+    votes are made by 'voter0', 'voter1', etc. Pages without posts have no
+    thread.
+    """
+    if created is None:
+        created = EPOCH + idx * 40 * 86400
+    return dict(
+        id=1000 + idx,
+        thread=5000 + idx if posts else None,
+        title=name.split(':')[-1].upper(),
+        text=' '.join([name.replace(':', ' ')] * (idx + 1)),
+        tags=set(tags.split()),
+        parent=parent,
+        revisions=[
+            (user, created + number * 3600, 'rev {}'.format(number))
+            for number, user in enumerate(authors)],
+        votes=[('voter{}'.format(i), v) for i, v in enumerate(votes)],
+        posts=[
+            ('voter{}'.format(i), created + 7200 + i * 60,
+             'comment {} on {}'.format(i, name))
+            for i in range(posts)])
+
+
+def make_site():
+    """
+    Return the pages of the fake site.
+
+    Ratings: scp-001 3, scp-002 2, scp-003 5, scp-series 1, tale-one -2,
+    fragment:tale-two 0, component:theme 3.
+    """
+    specs = [
+        ('scp-001', ['alice', 'bob', 'alice'], 'scp keter', None,
+         '++++-', 3),
+        ('scp-002', ['bob'], 'scp euclid', 'scp-series', '++', 1),
+        ('scp-003', ['alice', 'carol'], 'scp safe', 'scp-series',
+         '+-+++++', 5),
+        ('scp-series', ['carol'], 'hub', None, '+', 0),
+        ('tale-one', ['bob', 'bob'], 'tale', None, '--', 2),
+        ('fragment:tale-two', ['carol'], 'tale', 'tale-one', '', 0),
+        ('component:theme', ['alice'], '', None, '+++', 0)]
+    pages = {
+        name: make_page(name, idx, authors, tags, parent, votes, posts)
+        for idx, (name, authors, tags, parent, votes, posts)
+        in enumerate(specs)}
+    # votes of deleted accounts don't count towards the rating
+    pages['scp-001']['votes'].append(('(account deleted)', '+'))
+    return pages
+
+
+def take_snapshot(wiki, path, **kwargs):
+    """Save a snapshot of the wiki to the path, parsing pages in threads."""
+    creator = snapshot.SnapshotCreator(
+        str(path), fetch_workers=4, parse_workers=0)
+    creator.take_snapshot(wiki, **kwargs)
+    return path
+
+
+def dump(path, **kwargs):
+    """Read everything there is about the pages of the snapshot."""
+    wiki = snapshot.Wiki('www.test-wiki.net', str(path), **kwargs)
+    return [(
+        p.url, p._row, p.html, sorted(p.tags), p.history, p.votes,
+        p.comments, p.text, p.wordcount)
+        for p in wiki.list_pages(fields=['rating', 'created', 'author'])]
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import asyncio
+import json
+import pytest
+import requests
+
+from pyscp import aio
+
+from fakewiki import FakeWiki, make_site
+
+aiohttp = pytest.importorskip('aiohttp')
+
+###############################################################################
+
+
+class FakeResponse:
+
+    def __init__(self, status, text):
+        self.status = status
+        self._text = text
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def text(self):
+        return self._text
+
+
+class FakeSession:
+    """
+    Session answering from a list of scripted responses.
+
+    Each response is either a status code, or an exception to raise. Once
+    the script runs out, the requests are served by the FakeWiki.
+    """
+
+    def __init__(self, script=(), wiki=None):
+        self.script = list(script)
+        self.wiki = wiki
+        self.calls = []
+
+    def request(self, method, url, allow_redirects=True, data=None, **kw):
+        self.calls.append((method, url))
+        if self.script:
+            status = self.script.pop(0)
+            if isinstance(status, Exception):
+                raise status
+            return FakeResponse(status, 'status {}'.format(status))
+        if method == 'GET':
+            return FakeResponse(200, self.wiki._serve_page(url))
+        # aiohttp sends everything as strings
+        data = {k: int(v) if v.isdigit() else v for k, v in data.items()}
+        name = data.pop('moduleName')
+        data.pop('pageId', None)
+        del data['wikidot_token7']
+        return FakeResponse(
+            200, json.dumps(self.wiki._serve_module(name, **data)))
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """Record the backoff delays instead of sleeping."""
+    delays = []
+    sleep = asyncio.sleep
+
+    async def _sleep(delay):
+        delays.append(delay)
+        await sleep(0)
+
+    monkeypatch.setattr(aio.asyncio, 'sleep', _sleep)
+    monkeypatch.setattr(aio.random, 'uniform', lambda a, b: b)
+    return delays
+
+
+def make_wiki(*script, **kwargs):
+    wiki = aio.AsyncWiki('test-wiki', **kwargs)
+    wiki._session = FakeSession(script, FakeWiki(make_site()))
+    return wiki
+
+
+class TestRequest:
+
+    def test_ok(self, delays):
+        wiki = make_wiki(200)
+        assert asyncio.run(wiki._get('http://x/a')) == 'status 200'
+        assert delays == []
+
+    def test_not_found(self, delays):
+        wiki = make_wiki(404, 200)
+        with pytest.raises(requests.HTTPError):
+            asyncio.run(wiki._get('http://x/a'))
+        assert len(wiki._session.calls) == 1
+        assert delays == []
+
+    def test_redirect(self, delays):
+        wiki = make_wiki(301)
+        with pytest.raises(requests.HTTPError):
+            asyncio.run(wiki._get('http://x/a'))
+
+    def test_backoff(self, delays):
+        wiki = make_wiki(
+            500, 429, aiohttp.ClientError(), asyncio.TimeoutError(), 503,
+            200, max_backoff=5)
+        assert asyncio.run(wiki._get('http://x/a')) == 'status 200'
+        assert len(wiki._session.calls) == 6
+        # full jitter up to the exponential delay, capped at max_backoff
+        assert delays == [1, 2, 4, 5, 5]
+
+    def test_max_attempts(self, delays):
+        wiki = make_wiki(*[500] * 5, max_attempts=3)
+        with pytest.raises(requests.ConnectionError):
+            asyncio.run(wiki._get('http://x/a'))
+        assert len(wiki._session.calls) == 3
+        assert len(delays) == 2
+
+
+class TestAsyncWiki:
+
+    def test_list_pages(self):
+        wiki = make_wiki()
+
+        async def _names():
+            async with wiki:
+                return [p.name async for p in wiki.list_pages()]
+
+        assert asyncio.run(_names()) == sorted(make_site())
+
+    def test_page(self):
+        wiki = make_wiki()
+        fake = wiki._session.wiki
+
+        async def _page():
+            page = wiki('scp-001')
+            return (
+                await page.tags, await page.rating, await page.history,
+                await page.votes, await page.posts)
+
+        tags, rating, history, votes, posts = asyncio.run(_page())
+        page = fake('scp-001')
+        assert tags == page.tags
+        assert rating == 3
+        assert history == page.history
+        assert votes == page.votes
+        assert posts == page._thread.posts
+        # the history and the posts span several pages
+        assert len(history) > fake.perpage
+        assert len(posts) > fake.perpage
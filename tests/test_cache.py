@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import pytest
+import sqlite3
+
+from pyscp import cache
+
+from fakewiki import FakeWiki, make_site
+
+###############################################################################
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def rcache(tmp_path):
+    rcache = cache.ResponseCache(str(tmp_path / 'cache.db'))
+    yield rcache
+    rcache.close()
+
+
+def accessed(path):
+    conn = sqlite3.connect(str(path))
+    try:
+        return dict(conn.execute('SELECT key, accessed FROM cache'))
+    finally:
+        conn.close()
+
+
+class TestResponseCache:
+
+    def test_roundtrip(self, rcache):
+        value = {'status': 'ok', 'body': 'ünïcödé'}
+        key = rcache.key('GET', url='http://x/a')
+        assert rcache.get(key) is None
+        rcache.set(key, value, 'GET')
+        assert rcache.get(key) == value
+        assert (rcache.hits, rcache.misses) == (1, 1)
+        assert rcache.key('x', a=1, b=2) == rcache.key('x', b=2, a=1)
+
+    def test_ttl(self, rcache, clock):
+        rcache.ttl['short'] = 10
+        rcache.set('a', 1, 'short')
+        rcache.set('b', 2)
+        clock.now += 9
+        assert rcache.get('a') == 1
+        clock.now += 2
+        assert rcache.get('a') is None
+        # names without their own ttl expire after default_ttl
+        assert rcache.get('b') == 2
+        clock.now += rcache.default_ttl
+        assert rcache.get('b') is None
+        assert rcache._size == 0
+
+    def test_zero_ttl(self, rcache):
+        assert not rcache.caches('changes/SiteChangesListModule')
+        assert rcache.caches('GET')
+        rcache.set('a', 1, 'changes/SiteChangesListModule')
+        assert rcache.get('a') is None
+        assert rcache._size == 0
+
+    def test_lru(self, rcache, clock):
+        for key in 'abc':
+            rcache.set(key, key * 100)
+            clock.now += 1
+        rcache.max_size = rcache._size
+        # reading 'a' makes 'b' the least recently used entry
+        assert rcache.get('a') == 'a' * 100
+        clock.now += 1
+        rcache.set('d', 'd' * 100)
+        assert rcache.get('b') is None
+        assert [rcache.get(k) for k in 'acd'] == [
+            'a' * 100, 'c' * 100, 'd' * 100]
+        assert rcache._size <= rcache.max_size
+
+    def test_expired_evicted_first(self, rcache, clock):
+        rcache.ttl['short'] = 10
+        rcache.set('a', 'a' * 100)
+        rcache.set('b', 'b' * 100, 'short')
+        rcache.max_size = rcache._size
+        clock.now += 11
+        rcache.set('c', 'c' * 100)
+        assert rcache.get('a') == 'a' * 100
+        assert rcache.get('c') == 'c' * 100
+
+    def test_discard(self, rcache):
+        rcache.set('a', 1, tag=1000)
+        rcache.set('b', 2, tag=1000)
+        rcache.set('c', 3, tag='thread-5000')
+        rcache.discard(1000)
+        assert [rcache.get(k) for k in 'abc'] == [None, None, 3]
+        rcache.discard('thread-5000')
+        assert rcache.get('c') is None
+        assert rcache._size == 0
+
+    def test_clear(self, rcache):
+        rcache.set('a', 1)
+        rcache.clear()
+        assert rcache.get('a') is None
+        assert rcache._size == 0
+
+    def test_accessed_batched(self, tmp_path, clock):
+        path = tmp_path / 'cache.db'
+        rcache = cache.ResponseCache(str(path))
+        rcache.set('a', 1)
+        clock.now += 5
+        changes = rcache._conn.total_changes
+        for _ in range(10):
+            assert rcache.get('a') == 1
+        # the hits write nothing until the next write
+        assert rcache._conn.total_changes == changes
+        assert accessed(path) == {'a': 1000.0}
+        rcache.discard('nothing')
+        assert accessed(path) == {'a': 1005.0}
+        clock.now += 5
+        rcache.get('a')
+        rcache.close()
+        assert accessed(path) == {'a': 1010.0}
+
+    def test_persistent(self, tmp_path):
+        path = str(tmp_path / 'cache.db')
+        rcache = cache.ResponseCache(path)
+        rcache.set('a', [1, 2])
+        rcache.close()
+        rcache = cache.ResponseCache(path)
+        assert rcache.get('a') == [1, 2]
+        assert rcache._size > 0
+        rcache.close()
+
+
+class TestWikiCache:
+
+    @pytest.fixture
+    def wiki(self, rcache):
+        return FakeWiki(make_site(), cache=rcache)
+
+    def test_cached(self, wiki):
+        page = wiki('scp-001')
+        first = page.html, page.votes
+        page = wiki('scp-001')
+        assert (page.html, page.votes) == first
+        assert [r[0] for r in wiki.requests] == [
+            'get', 'pagerate/WhoRatedPageModule']
+
+    def test_writes_skip_cache(self, wiki):
+        for _ in range(2):
+            wiki._module(
+                'Empty', action='WikiPageAction', event='x', page_id=1000)
+        for _ in range(2):
+            wiki._module('edit/PageEditModule', mode='page', page_id=1000)
+        assert [r[0] for r in wiki.requests] == [
+            'Empty', 'Empty', 'edit/PageEditModule', 'edit/PageEditModule']
+        assert wiki.cache._size == 0
+
+    def test_write_discards_tag(self, wiki):
+        wiki('scp-001').votes
+        wiki('scp-002').votes
+        wiki('scp-001').set_tags(['scp'])
+        wiki.requests = []
+        wiki('scp-001').votes
+        wiki('scp-002').votes
+        # the page itself is discarded too, and nothing of the other page
+        assert wiki.requests[0] == ('get', 'scp-001')
+        assert [r[1]['page_id'] for r in wiki.requests[1:]] == [1000]
+
+    def test_changes_not_cached(self, wiki):
+        wiki.edit('scp-001')
+        list(wiki.list_changes())
+        wiki.edit('scp-002')
+        assert [c.url for c in wiki.list_changes()] == [
+            'http://www.test-wiki.net/scp-002',
+            'http://www.test-wiki.net/scp-001']
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import pytest
+import random
+import sqlite3
+import threading
+
+from pyscp import orm
+
+###############################################################################
+
+
+def recording_writer(monkeypatch, **kwargs):
+    """Make a writer that records its batches instead of writing them."""
+    writer = orm.Writer(**kwargs)
+    writer.batches = []
+    monkeypatch.setattr(writer, '_write', writer.batches.append)
+    return writer
+
+
+class TestWriter:
+
+    def test_batch_size(self, monkeypatch):
+        writer = recording_writer(monkeypatch, batch_size=10, flush_interval=5)
+        for _ in range(25):
+            writer.execute(int)
+        writer.close()
+        assert [len(b) for b in writer.batches] == [10, 10, 5]
+
+    def test_batch_size_counts_rows(self, monkeypatch):
+        writer = recording_writer(monkeypatch, batch_size=10, flush_interval=5)
+        for idx in range(4):
+            writer.insert(orm.Page, [dict(id=idx * 4 + i) for i in range(4)])
+        writer.close()
+        assert [len(b) for b in writer.batches] == [3, 1]
+
+    def test_empty_insert(self, monkeypatch):
+        writer = recording_writer(monkeypatch)
+        writer.insert(orm.Page, [])
+        writer.close()
+        assert writer.batches == []
+
+    def test_flush_interval(self, monkeypatch):
+        writer = recording_writer(
+            monkeypatch, batch_size=1000, flush_interval=0.01)
+        writer.execute(int)
+        writer.flush()
+        assert len(writer.batches) == 1
+        writer.execute(int)
+        writer.flush()
+        assert len(writer.batches) == 2
+        writer.close()
+
+    def test_backpressure(self, monkeypatch):
+        release = threading.Event()
+        writer = orm.Writer(batch_size=1, maxsize=2)
+        monkeypatch.setattr(writer, '_write', lambda batch: release.wait())
+        thread = threading.Thread(
+            target=lambda: [writer.execute(int) for _ in range(5)])
+        thread.start()
+        # one item is being written, and two wait in the queue
+        thread.join(0.2)
+        assert thread.is_alive()
+        release.set()
+        thread.join(5)
+        assert not thread.is_alive()
+        writer.close()
+
+    def test_restart(self, monkeypatch):
+        writer = recording_writer(monkeypatch)
+        writer.execute(int)
+        writer.close()
+        writer.execute(int)
+        writer.close()
+        assert len(writer.batches) == 2
+
+    def test_write(self, database):
+        orm.create_tables('User')
+        orm.flush()
+        writer = orm.Writer(flush_interval=0.01)
+        writer.insert(orm.User, [dict(id=1, name='a'), dict(id=2, name='b')])
+        writer.insert(orm.User, [dict(id=3, name='c')])
+        writer.execute(
+            orm.db.execute_sql, ("UPDATE user SET name = name || '!'",))
+        writer.close()
+        assert writer.rows == 3
+        assert list(orm.User.select(orm.User.id, orm.User.name).tuples()) == [
+            (1, 'a!'), (2, 'b!'), (3, 'c!')]
+
+    def test_failed_rows(self, database):
+        orm.create_tables('User')
+        orm.flush()
+        writer = orm.Writer(flush_interval=0.01)
+        writer.insert(orm.User, [dict(id=1, name='a'), dict(id=2, name='b')])
+        # only the duplicate is lost
+        writer.insert(orm.User, [dict(id=2, name='x'), dict(id=3, name='c')])
+        writer.execute(orm.db.execute_sql, ('INVALID SQL',))
+        writer.insert(orm.User, [dict(id=4, name='d')])
+        writer.close()
+        assert writer.rows == 4
+        assert list(orm.User.select(orm.User.name).tuples()) == [
+            ('a',), ('b',), ('c',), ('d',)]
+
+
+class TestWriterGroup:
+
+    def test_single_item(self, monkeypatch):
+        writer = recording_writer(monkeypatch)
+        with writer.group():
+            writer.execute(int)
+            assert writer.depth == 0
+            with writer.group():
+                writer.insert(orm.User, [dict(id=1, name='a')])
+            writer.execute(str)
+        writer.close()
+        (batch,) = writer.batches
+        (item,) = batch
+        assert item[0] == 'group'
+        assert [i[0] for i in item[1]] == ['call', 'insert', 'call']
+
+    def test_raised(self, monkeypatch):
+        writer = recording_writer(monkeypatch)
+        with pytest.raises(KeyError):
+            with writer.group():
+                writer.execute(int)
+                raise KeyError
+        writer.execute(str)
+        writer.close()
+        assert [[i[1] for i in b] for b in writer.batches] == [[str]]
+
+    def test_other_threads(self, monkeypatch):
+        writer = recording_writer(monkeypatch, flush_interval=0.01)
+        with writer.group():
+            writer.execute(int)
+            thread = threading.Thread(target=writer.execute, args=(str,))
+            thread.start()
+            thread.join()
+            writer.flush()
+            assert [[i[1] for i in b] for b in writer.batches] == [[str]]
+        writer.close()
+
+    def test_atomic(self, database):
+        orm.create_tables('User')
+
+        def _fail():
+            raise ValueError
+
+        orm.User.create(id=1, name='a')
+        with orm.writer.group():
+            orm.User.create(id=2, name='b')
+            orm.queue_execution(fn=_fail)
+        with orm.writer.group():
+            orm.User.create(id=3, name='c')
+        with orm.writer.group():
+            orm.User.create(id=4, name='d')
+            # a duplicate row fails the whole group, too
+            orm.User.create(id=1, name='e')
+        orm.flush()
+        query = orm.User.select(orm.User.name).tuples()
+        assert list(query) == [('a',), ('c',)]
+
+
+class TestIdTable:
+
+    def test_ids(self):
+        ids = orm.IdTable(orm.User)
+        assert [ids[n] for n in ('a', 'b', 'a', 'c')] == [1, 2, 1, 3]
+        assert len(ids) == 3
+        assert 'b' in ids
+        assert 'd' not in ids
+
+    def test_threads(self):
+        ids = orm.IdTable(orm.User)
+        names = ['user{}'.format(i) for i in range(1000)]
+        results = []
+
+        def _intern():
+            shuffled = random.sample(names, len(names))
+            results.append({n: ids[n] for n in shuffled})
+
+        threads = [threading.Thread(target=_intern) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert all(r == results[0] for r in results)
+        assert sorted(results[0].values()) == list(range(1, 1001))
+
+    def test_flush_and_load(self, database):
+        orm.create_tables('User')
+        ids = orm.IdTable(orm.User)
+        ids['a'], ids['b']
+        ids.flush()
+        ids['c']
+        ids.flush()
+        ids.flush()
+        orm.flush()
+        query = orm.User.select(orm.User.id, orm.User.name).tuples()
+        assert list(query) == [(1, 'a'), (2, 'b'), (3, 'c')]
+        loaded = orm.IdTable(orm.User)
+        loaded.load()
+        assert len(loaded) == 3
+        assert loaded['b'] == 2
+        assert loaded['d'] == 4
+
+    def test_clear(self):
+        ids = orm.IdTable(orm.User)
+        ids['a']
+        ids.clear()
+        assert len(ids) == 0
+        assert ids['b'] == 1
+
+
+class TestCompress:
+
+    TEXT = (
+        '<div id="page-content"><p>Item #: SCP-1511</p>'
+        '<span class="printuser">anqxyr</span> ünïcödé</div>')
+
+    def test_roundtrip(self):
+        assert orm.decompress(orm.compress(self.TEXT)) == self.TEXT
+        assert orm.decompress(orm.compress('')) == ''
+
+    def test_version(self):
+        data = orm.compress(self.TEXT)
+        assert isinstance(data, bytes)
+        assert data[0] == max(orm.ZDICTS)
+        for version in orm.ZDICTS:
+            data = orm.compress(self.TEXT, version)
+            assert data[0] == version
+            assert orm.decompress(data) == self.TEXT
+
+    def test_smaller(self):
+        html = self.TEXT * 20
+        assert len(orm.compress(html)) < len(html) / 5
+
+    def test_uncompressed(self):
+        # text and nulls of older snapshots are passed through
+        assert orm.decompress(self.TEXT) is self.TEXT
+        assert orm.decompress(None) is None
+
+    def test_field(self, database):
+        orm.create_tables('Page')
+        orm.Page.create(id=1, url='scp-1', thread=None, html=self.TEXT)
+        orm.flush()
+        stored = orm.Page.get(orm.Page.id == 1).html
+        assert isinstance(stored, bytes)
+        assert orm.decompress(stored) == self.TEXT
+        raw = orm.db.execute_sql('SELECT typeof(html) FROM page').fetchone()
+        assert raw == ('blob',)
+
+    def test_compress_column(self, database):
+        orm.create_tables('Page')
+        orm.flush()
+        for id_ in (1, 2):
+            orm.db.execute_sql(
+                'INSERT INTO page (id, url, html) VALUES (?, ?, ?)',
+                (id_, 'page-{}'.format(id_), self.TEXT))
+        orm.compress_column(orm.Page.html)
+        orm.flush()
+        types = orm.db.execute_sql('SELECT typeof(html) FROM page')
+        assert [i for i, in types] == ['blob', 'blob']
+        assert [orm.decompress(p.html) for p in orm.Page.select()] == [
+            self.TEXT, self.TEXT]
+
+
+def pragmas(*names):
+    return [orm.db.execute_sql('PRAGMA ' + n).fetchone()[0] for n in names]
+
+
+class TestConnection:
+
+    NAMES = 'journal_mode', 'synchronous', 'cache_size', 'temp_store'
+
+    @pytest.mark.parametrize('mode, expected', [
+        ('default', None),
+        ('bulk', ['wal', 0, -512 * 1024, 2]),
+        ('read', ['delete', 2, -64 * 1024, 2])])
+    def test_modes(self, tmp_path, mode, expected):
+        if expected is None:
+            # sqlite's own defaults
+            conn = sqlite3.connect(str(tmp_path / 'plain.db'))
+            expected = [
+                conn.execute('PRAGMA ' + n).fetchone()[0] for n in self.NAMES]
+            conn.close()
+        orm.connect(str(tmp_path / 'test.db'), mode)
+        try:
+            assert pragmas(*self.NAMES) == expected
+            if mode == 'read':
+                assert pragmas('mmap_size') == [2 ** 30]
+        finally:
+            orm.close()
+
+    def test_unknown_mode(self, tmp_path):
+        with pytest.raises(ValueError):
+            orm.open_database(str(tmp_path / 'test.db'), mode='fast')
+
+    def test_readonly(self, database):
+        orm.create_tables('User')
+        orm.User.create(id=1, name='a')
+        orm.flush()
+        db = orm.open_database(str(database), mode='read', readonly=True)
+        with orm.db.using(db):
+            assert [u.name for u in orm.User.select()] == ['a']
+            with pytest.raises(orm.peewee.OperationalError):
+                orm.db.execute_sql("INSERT INTO user VALUES (2, 'b')")
+
+    def test_finish_bulk_load(self, tmp_path):
+        path = tmp_path / 'test.db'
+        orm.connect(str(path), 'bulk')
+        orm.create_tables('Page', 'User', indexes=False)
+        orm.User.create(id=1, name='a')
+        orm.flush()
+
+        def _indexes():
+            return {name for name, in orm.db.execute_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'index' "
+                "AND sql IS NOT NULL")}
+
+        # only the unique indexes are made along with the tables
+        assert _indexes() == {'page_url', 'user_name'}
+        orm.finish_bulk_load(vacuum=True)
+        assert orm.writer._thread is None or not orm.writer._thread.is_alive()
+        assert _indexes() == {'page_url', 'user_name', 'page_thread_id'}
+        assert orm.has_table('sqlite_stat1')
+        assert pragmas(*self.NAMES) == ['delete', 0, -512 * 1024, 2]
+        assert not (tmp_path / 'test.db-wal').exists()
+        # the file is left in rollback journal mode for the readers
+        db = orm.open_database(str(path), mode='read', readonly=True)
+        with orm.db.using(db):
+            assert pragmas('journal_mode') == ['delete']
+            assert [u.name for u in orm.User.select()] == ['a']
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import pathlib
+import pytest
+
+from pyscp import core, parsers
+
+###############################################################################
+
+# Responses of the Wikidot modules, cut down to a few items each.
+FIXTURES = pathlib.Path(__file__).parent / 'fixtures'
+
+
+def load(name):
+    return (FIXTURES / (name + '.html')).read_text(encoding='utf-8')
+
+
+@pytest.fixture(params=[parsers.SoupParser, parsers.LxmlParser])
+def parser(request):
+    return request.param()
+
+
+class TestParsers:
+
+    def test_pdata(self, parser):
+        page_id, thread_id, html, tags = parser.pdata(load('page'))
+        assert page_id == 18578010
+        assert thread_id == 666715
+        assert html.startswith('<div id="main-content">')
+        assert 'Item #:' in html
+        assert 'edit-button' not in html
+        assert tags == {'crystalline', 'euclid', 'scp'}
+
+    def test_ids(self, parser):
+        assert parser.ids(load('page')) == (18578010, 666715)
+
+    def test_ids_without_thread(self, parser):
+        html = load('page').replace('id="discuss-button"', '')
+        assert parser.ids(html) == (18578010, None)
+
+    def test_parent(self, parser):
+        assert parser.parent(load('page')) == 'scp-series-2'
+        assert parser.parent('<div id="page-content"></div>') is None
+
+    def test_text(self, parser):
+        text = parser.text(load('page'))
+        assert text.split() == (
+            'SCP-1511 Item #: SCP-1511 Object Class: Euclid Description: '
+            'SCP-1511 is a mechanical heaven, see the log and elsewhere.'
+            .split())
+        assert parser.text('<p>no content</p>') == ''
+        assert parser.text('<p>all of it</p>', element=None) == 'all of it'
+
+    def test_pager_size(self, parser):
+        assert parser.pager_size(load('history')) == 2
+        assert parser.pager_size(load('list_pages')) == 12
+        assert parser.pager_size('<div></div>') == 1
+
+    def test_history(self, parser):
+        assert parser.history(load('history')) == [
+            core.Revision(
+                39172530, 1, 'anqxyr', '2013-06-30 16:55:21', 'fixed a typo'),
+            core.Revision(
+                39200511, 2, 'TheDeadlyMoose', '2013-07-01 15:15:00', None)]
+
+    def test_votes(self, parser):
+        assert parser.votes(load('votes')) == [
+            core.Vote('anqxyr', 1),
+            core.Vote('FlameShirt', -1),
+            core.Vote('(account deleted)', 1)]
+
+    def test_posts(self, parser):
+        posts = list(parser.posts(load('posts')))
+        assert [(p.id, p.title, p.user, p.time, p.parent) for p in posts] == [
+            (1806664, None, 'FlameShirt', '2013-06-30 16:47:22', None),
+            (1806700, 'Re: robots', 'anqxyr', '2013-06-30 16:50:00',
+             1806664),
+            (1806800, None, 'TheDeadlyMoose', '2013-07-01 17:33:20', None)]
+        assert posts[1].content.split() == [
+            '<div>', '<p>Thanks!</p>', '</div>']
+
+    def test_posts_empty(self, parser):
+        assert list(parser.posts('')) == []
+
+    def test_list_pages(self, parser):
+        first, second = parser.list_pages(load('list_pages'))
+        assert first == dict(
+            fullname='scp-1511', title='SCP-1511', created_by='anqxyr',
+            created_at='30 Jun 2013 16:55', rating='94',
+            tags='crystalline euclid scp')
+        assert second['fullname'] == 'system:page-tags'
+        assert second['tags'] == ''
+
+    def test_changes(self, parser):
+        assert parser.changes(load('changes')) == [
+            core.Change(
+                '/scp-1511', '2013-07-01 15:15:00', 'TheDeadlyMoose', 2,
+                'retagged'),
+            core.Change(
+                '/fragment:tale-1', '2013-06-30 13:46:40', 'anqxyr', None,
+                None)]
+
+    def test_categories(self, parser):
+        assert parser.categories(load('categories')) == [
+            core.Category(50, 'Announcements', 'Site news.', 12),
+            core.Category(
+                51, 'Per page discussions', 'Discussions of the pages.',
+                3014)]
+
+    def test_threads(self, parser):
+        assert parser.threads(load('threads')) == [
+            (666715, 'SCP-1511', 'Page discussion.'), (700001, 'Hello', '')]
+
+    def test_parsers_agree(self):
+        # the serialized html may differ in the order of the attributes,
+        # but not in the parsed contents
+        soup, lxml = parsers.SoupParser(), parsers.LxmlParser()
+        assert soup.pdata(load('page'))[3] == lxml.pdata(load('page'))[3]
+        assert soup.text(load('page')) == lxml.text(load('page'))
+        assert list(soup.posts(load('posts'))) == list(
+            lxml.posts(load('posts')))
+
+
+class TestParsePage:
+
+    def test_parse_page(self, parser):
+        # history pages are downloaded newest first
+        older = (
+            '<table><tr><td>rev.</td></tr><tr id="revision-row-39167223">'
+            '<td>0.</td><td></td><td></td><td></td><td>anqxyr</td>'
+            '<td><span class="odate time_1372610077">x</span></td>'
+            '<td>INITIATE HEAVEN SUBROUTINE</td></tr></table>')
+        data = dict(
+            url='http://www.scp-wiki.net/scp-1511', id=18578010,
+            thread=666715, html=load('page'),
+            history=[load('history'), older],
+            votes=load('votes'), posts=[load('posts'), load('posts')])
+        result = parsers.parse_page(parser, data)
+        assert result['url'] == data['url']
+        assert result['html'] == parser.pdata(load('page'))[2]
+        assert result['tags'] == {'crystalline', 'euclid', 'scp'}
+        assert result['history'][0] == core.Revision(
+            39167223, 0, 'anqxyr', '2013-06-30 16:34:37',
+            'INITIATE HEAVEN SUBROUTINE')
+        assert [r.number for r in result['history']] == [0, 1, 2]
+        assert len(result['votes']) == 3
+        assert len(result['posts']) == 6
+
+    def test_missing_page(self, parser):
+        data = dict(url='http://www.scp-wiki.net/nothing', html=None)
+        assert parsers.parse_page(parser, data) is data
+        assert parsers.parse_page(parser, None) is None
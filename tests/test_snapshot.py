@@ -0,0 +1,639 @@
+#!/usr/bin/env python3
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import pytest
+import shutil
+import sqlite3
+import threading
+
+from pyscp import cache, orm, snapshot
+
+from fakewiki import FakeWiki, dump, make_page, make_site, take_snapshot
+
+###############################################################################
+
+ALL = [
+    'component:theme', 'fragment:tale-two', 'scp-001', 'scp-002', 'scp-003',
+    'scp-series', 'tale-one']
+
+
+def names(pages):
+    return [p.url.split('/')[-1] for p in pages]
+
+
+def page_stats(path):
+    """Read the PageStats rows of the snapshot, by page name."""
+    conn = sqlite3.connect(str(path))
+    try:
+        query = conn.execute(
+            'SELECT page.url, {0}.* FROM {0} '
+            'JOIN page ON page.id = {0}.page_id'
+            .format(orm.PageStats._meta.db_table))
+        columns = [c[0] for c in query.description][1:]
+        return {
+            url.split('/')[-1]: {
+                k: v for k, v in zip(columns, row) if k != 'id'}
+            for url, *row in query}
+    finally:
+        conn.close()
+
+
+@pytest.fixture(scope='module')
+def snapshot_path(tmp_path_factory):
+    return take_snapshot(
+        FakeWiki(make_site()),
+        tmp_path_factory.mktemp('snapshot') / 'snapshot.db')
+
+
+@pytest.fixture(scope='module')
+def old_snapshot_path(snapshot_path):
+    """Snapshot made before the page stats were added."""
+    path = snapshot_path.with_name('old.db')
+    shutil.copy(str(snapshot_path), str(path))
+    conn = sqlite3.connect(str(path))
+    conn.execute('DROP TABLE {}'.format(orm.PageStats._meta.db_table))
+    conn.close()
+    return path
+
+
+@pytest.fixture(params=['stats', 'no stats'])
+def wiki(request, snapshot_path, old_snapshot_path):
+    path = snapshot_path if request.param == 'stats' else old_snapshot_path
+    return snapshot.Wiki('www.test-wiki.net', str(path))
+
+
+class TestListPages:
+
+    def test_all(self, wiki):
+        assert names(wiki.list_pages()) == ALL
+
+    def test_streamed(self, wiki):
+        pages = wiki.list_pages()
+        assert iter(pages) is pages
+        assert next(pages).url == 'http://www.test-wiki.net/component:theme'
+        assert len(list(pages)) == len(ALL) - 1
+
+    def test_order(self, wiki):
+        assert names(wiki.list_pages(order='fullname desc')) == ALL[::-1]
+        assert names(wiki.list_pages(order='rating desc')) == [
+            'scp-003', 'component:theme', 'scp-001', 'scp-002', 'scp-series',
+            'fragment:tale-two', 'tale-one']
+        assert names(wiki.list_pages(order='created_at')) == [
+            'scp-001', 'scp-002', 'scp-003', 'scp-series', 'tale-one',
+            'fragment:tale-two', 'component:theme']
+        # ties are ordered by the url
+        assert names(wiki.list_pages(order='created_by asc')) == [
+            'component:theme', 'scp-001', 'scp-003', 'scp-002', 'tale-one',
+            'fragment:tale-two', 'scp-series']
+        assert sorted(names(wiki.list_pages(order='random'))) == ALL
+
+    def test_unknown_order(self, wiki):
+        with pytest.raises(ValueError):
+            wiki.list_pages(order='title')
+        with pytest.raises(ValueError):
+            wiki.list_pages(order='rating sideways')
+
+    def test_offset_and_limit(self, wiki):
+        assert names(wiki.list_pages(limit=2)) == ALL[:2]
+        assert names(wiki.list_pages(offset=2, limit=3)) == ALL[2:5]
+        assert names(wiki.list_pages(
+            order='created_at desc', limit=3)) == [
+                'component:theme', 'fragment:tale-two', 'tale-one']
+        assert names(wiki.list_pages(offset=10)) == []
+
+    def test_fields(self, wiki):
+        pages = list(wiki.list_pages(
+            fields=['rating', 'created', 'author'], order='rating desc',
+            limit=2))
+        assert [p._row for p in pages] == [
+            dict(id=1002, thread=5002, rating=5,
+                 created='2014-03-22 00:00:00', author='alice'),
+            dict(id=1006, thread=None, rating=3,
+                 created='2014-08-29 00:00:00', author='alice')]
+        assert [p.rating for p in pages] == [5, 3]
+        assert [p.created for p in pages] == [
+            '2014-03-22 00:00:00', '2014-08-29 00:00:00']
+        with pytest.raises(ValueError):
+            wiki.list_pages(fields=['title'])
+
+    def test_properties(self, wiki):
+        page, = wiki.list_pages(limit=1, offset=2)
+        assert page.url == 'http://www.test-wiki.net/scp-001'
+        assert page.tags == {'scp', 'keter'}
+        assert page.rating == 3
+        assert [r.user for r in page.history] == ['alice', 'bob', 'alice']
+        assert len(page.votes) == 6
+        assert [p.user for p in page.comments] == [
+            'voter0', 'voter1', 'voter2']
+        assert page.text == 'scp-001'
+
+    def test_author(self, wiki):
+        assert names(wiki.list_pages(author='alice')) == [
+            'component:theme', 'scp-001', 'scp-003']
+
+    def test_rating(self, wiki):
+        assert names(wiki.list_pages(rating='>2')) == [
+            'component:theme', 'scp-001', 'scp-003']
+        assert names(wiki.list_pages(rating='<=0')) == [
+            'fragment:tale-two', 'tale-one']
+
+    def test_created(self, wiki):
+        assert names(wiki.list_pages(created='>=2014-06')) == [
+            'component:theme', 'fragment:tale-two', 'tale-one']
+        assert names(wiki.list_pages(created='2014-02')) == ['scp-002']
+        assert names(wiki.list_pages(created='<2014-02-10')) == ['scp-001']
+
+
+class TestFilters:
+
+    def test_tag(self, wiki):
+        assert names(wiki.list_pages(tag='scp')) == [
+            'scp-001', 'scp-002', 'scp-003']
+
+    @pytest.mark.parametrize('tags, expected', [
+        ('scp', ['scp-001', 'scp-002', 'scp-003']),
+        ('tale hub', ['fragment:tale-two', 'scp-series', 'tale-one']),
+        ('+scp +safe', ['scp-003']),
+        ('scp -keter', ['scp-002', 'scp-003']),
+        ('+scp keter euclid', ['scp-001', 'scp-002']),
+        ('-scp -tale', ['component:theme', 'scp-series']),
+        ('-', ['component:theme']),
+        ('', ALL)])
+    def test_tags(self, wiki, tags, expected):
+        assert names(wiki.list_pages(tags=tags)) == expected
+
+    def test_current_page_tags(self, wiki):
+        with pytest.raises(ValueError):
+            wiki.list_pages(tags='=')
+
+    @pytest.mark.parametrize('category, expected', [
+        ('fragment', ['fragment:tale-two']),
+        ('component fragment', ['component:theme', 'fragment:tale-two']),
+        ('_default', ['scp-001', 'scp-002', 'scp-003', 'scp-series',
+                      'tale-one']),
+        ('-_default', ['component:theme', 'fragment:tale-two']),
+        ('* -component', ALL[1:]),
+        ('*', ALL)])
+    def test_category(self, wiki, category, expected):
+        assert names(wiki.list_pages(category=category)) == expected
+
+    def test_parent(self, snapshot_path):
+        wiki = snapshot.Wiki('www.test-wiki.net', str(snapshot_path))
+        assert names(wiki.list_pages(parent='scp-series')) == [
+            'scp-002', 'scp-003']
+        assert names(wiki.list_pages(parent='tale-one')) == [
+            'fragment:tale-two']
+        assert names(wiki.list_pages(parent='-')) == [
+            'component:theme', 'scp-001', 'scp-series', 'tale-one']
+
+    def test_parent_without_stats(self, old_snapshot_path):
+        wiki = snapshot.Wiki('www.test-wiki.net', str(old_snapshot_path))
+        with pytest.raises(RuntimeError):
+            wiki.list_pages(parent='scp-series')
+
+    def test_combined(self, snapshot_path):
+        wiki = snapshot.Wiki('www.test-wiki.net', str(snapshot_path))
+        pages = wiki.list_pages(
+            tags='scp tale', category='_default', parent='-',
+            order='rating desc', offset=1, limit=1)
+        assert names(pages) == ['tale-one']
+        pages = wiki.list_pages(
+            tags='-hub', category='-fragment', rating='>0', order='created_at',
+            limit=2)
+        assert names(pages) == ['scp-001', 'scp-002']
+
+
+class TestResume:
+
+    def test_resume(self, tmp_path):
+        wiki = FakeWiki(make_site())
+        path = tmp_path / 'snapshot.db'
+        creator = snapshot.SnapshotCreator(
+            str(path), fetch_workers=4, parse_workers=0)
+        saved = []
+        save = creator._save_page
+
+        def _save_page(data):
+            if len(saved) == 3:
+                raise KeyboardInterrupt
+            saved.append(data['url'].split('/')[-1])
+            save(data)
+
+        creator._save_page = _save_page
+        with pytest.raises(KeyboardInterrupt):
+            creator.take_snapshot(wiki)
+        orm.close()
+        with pytest.raises(FileExistsError):
+            snapshot.SnapshotCreator(str(path))
+
+        wiki.requests = []
+        creator = snapshot.SnapshotCreator(
+            str(path), resume=True, fetch_workers=4, parse_workers=0)
+        creator.take_snapshot(wiki)
+        fetched = {r[1] for r in wiki.requests if r[0] == 'get'}
+        assert fetched == set(ALL) - set(saved)
+
+        clean = take_snapshot(FakeWiki(make_site()), tmp_path / 'clean.db')
+        assert dump(path) == dump(clean)
+
+    def test_complete(self, tmp_path):
+        wiki = FakeWiki(make_site())
+        path = take_snapshot(wiki, tmp_path / 'snapshot.db')
+        wiki.requests = []
+        creator = snapshot.SnapshotCreator(
+            str(path), resume=True, parse_workers=0)
+        creator.take_snapshot(wiki)
+        assert wiki.requests == []
+        assert len(dump(path)) == len(ALL)
+
+
+class TestUpdate:
+
+    def test_update(self, tmp_path):
+        wiki = FakeWiki(make_site())
+        path = take_snapshot(wiki, tmp_path / 'snapshot.db')
+        wiki.edit('scp-002', text='scp-002 rewritten', tags={'scp', 'keter'})
+        wiki.edit('new-page', user='erin', tags={'tale'}, parent='tale-one')
+        wiki.delete('tale-one')
+
+        wiki.requests = []
+        creator = snapshot.SnapshotCreator(
+            str(path), update=True, fetch_workers=4, parse_workers=0)
+        creator.update_snapshot(wiki)
+        fetched = {r[1] for r in wiki.requests if r[0] == 'get'}
+        assert fetched == {'scp-002', 'new-page', 'tale-one'}
+
+        clean = take_snapshot(wiki, tmp_path / 'clean.db')
+        assert dump(path) == dump(clean)
+        updated = snapshot.Wiki('www.test-wiki.net', str(path))
+        assert names(updated.list_pages(tags='keter')) == [
+            'scp-001', 'scp-002']
+        assert names(updated.list_pages(parent='tale-one')) == [
+            'fragment:tale-two', 'new-page']
+        assert names(updated.list_pages(author='erin')) == ['new-page']
+
+    def test_cached_wiki(self, tmp_path):
+        rcache = cache.ResponseCache(str(tmp_path / 'cache.db'))
+        wiki = FakeWiki(make_site(), cache=rcache)
+        path = take_snapshot(wiki, tmp_path / 'snapshot.db')
+        for idx in range(2):
+            wiki.edit('scp-002', text='scp-002 v{}'.format(idx))
+            wiki.pages['scp-002']['votes'].append(('voter9', '-+'[idx]))
+            wiki.pages['scp-002']['posts'].append(
+                ('voter9', wiki._now(), 'comment {}'.format(idx)))
+            wiki.requests = []
+            creator = snapshot.SnapshotCreator(
+                str(path), update=True, fetch_workers=4, parse_workers=0)
+            creator.update_snapshot(wiki)
+            assert ('get', 'scp-002') in wiki.requests
+            clean = take_snapshot(
+                FakeWiki(wiki.pages), tmp_path / 'clean{}.db'.format(idx))
+            assert dump(path) == dump(clean)
+        rcache.close()
+
+    def test_nothing_changed(self, tmp_path):
+        wiki = FakeWiki(make_site())
+        path = take_snapshot(wiki, tmp_path / 'snapshot.db')
+        before = dump(path)
+        wiki.requests = []
+        creator = snapshot.SnapshotCreator(
+            str(path), update=True, parse_workers=0)
+        creator.update_snapshot(wiki)
+        assert [r[0] for r in wiki.requests] == [
+            'changes/SiteChangesListModule']
+        assert dump(path) == before
+
+    def test_missing(self, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            snapshot.SnapshotCreator(str(tmp_path / 'nothing.db'), update=True)
+
+
+class TestStats:
+
+    def test_values(self, snapshot_path):
+        stats = page_stats(snapshot_path)
+        assert sorted(stats) == ALL
+        assert stats['scp-001'] == dict(
+            page_id=1000, rating=3, upvotes=4, downvotes=1,
+            created='2014-01-01 00:00:00', author='alice', category='_default',
+            parent=None, revisions=3, comments=3, wordcount=1)
+        assert stats['scp-002']['parent'] == 'scp-series'
+        assert stats['fragment:tale-two']['category'] == 'fragment'
+
+    def test_recounted_after_update(self, tmp_path):
+        wiki = FakeWiki(make_site())
+        path = take_snapshot(wiki, tmp_path / 'snapshot.db')
+        wiki.edit('scp-002', text='a b c d e', parent=None)
+        wiki.pages['scp-002']['votes'].append(('voter9', '-'))
+        creator = snapshot.SnapshotCreator(
+            str(path), update=True, fetch_workers=4, parse_workers=0)
+        creator.update_snapshot(wiki)
+        stats = page_stats(path)
+        assert stats['scp-002'] == dict(
+            page_id=1001, rating=1, upvotes=2, downvotes=1,
+            created='2014-02-10 00:00:00', author='bob', category='_default',
+            parent=None, revisions=2, comments=1, wordcount=5)
+        clean = take_snapshot(wiki, tmp_path / 'clean.db')
+        assert stats == page_stats(clean)
+
+    def test_old_snapshot(self, tmp_path, snapshot_path, old_snapshot_path):
+        path = tmp_path / 'old.db'
+        shutil.copy(str(old_snapshot_path), str(path))
+        creator = snapshot.SnapshotCreator(
+            str(path), update=True, parse_workers=0)
+        creator.build_stats()
+        orm.finish_bulk_load()
+        assert page_stats(path) == page_stats(snapshot_path)
+        wiki = snapshot.Wiki('www.test-wiki.net', str(path))
+        assert names(wiki.list_pages(parent='scp-series')) == [
+            'scp-002', 'scp-003']
+
+    def test_old_columns(self, tmp_path, snapshot_path):
+        """A stats table without the parent column is counted anew."""
+        path = tmp_path / 'old.db'
+        shutil.copy(str(snapshot_path), str(path))
+        conn = sqlite3.connect(str(path))
+        conn.execute('DROP TABLE {}'.format(orm.PageStats._meta.db_table))
+        conn.execute(
+            'CREATE TABLE {} (id INTEGER PRIMARY KEY, page_id INTEGER, '
+            'wordcount INTEGER)'.format(orm.PageStats._meta.db_table))
+        conn.execute('INSERT INTO {} VALUES (1, 1000, 99)'.format(
+            orm.PageStats._meta.db_table))
+        conn.commit()
+        conn.close()
+        creator = snapshot.SnapshotCreator(
+            str(path), update=True, parse_workers=0)
+        creator.build_stats(recount=set())
+        orm.finish_bulk_load()
+        assert page_stats(path) == page_stats(snapshot_path)
+
+
+def search_site():
+    """The fake site, with the texts the search tests look for."""
+    site = make_site()
+    texts = {
+        'scp-001': 'containment breach',
+        'scp-002': 'containment breach breach breach',
+        'scp-003': 'containment procedures',
+        'scp-series': 'breach ' + 'filler ' * 30,
+        'component:theme': 'containment theme'}
+    for name, text in texts.items():
+        site[name]['text'] = text
+    return site
+
+
+@pytest.fixture(scope='module')
+def search_path(tmp_path_factory):
+    return take_snapshot(
+        FakeWiki(search_site()),
+        tmp_path_factory.mktemp('search') / 'snapshot.db', search=True)
+
+
+@pytest.fixture(params=['stats', 'no stats'])
+def search_wiki(request, search_path):
+    path = search_path
+    if request.param == 'no stats':
+        path = search_path.with_name('old.db')
+        if not path.exists():
+            shutil.copy(str(search_path), str(path))
+            conn = sqlite3.connect(str(path))
+            conn.execute(
+                'DROP TABLE {}'.format(orm.PageStats._meta.db_table))
+            conn.close()
+    return snapshot.Wiki('www.test-wiki.net', str(path))
+
+
+def found(results):
+    """Names of the found pages, and ids of the found posts."""
+    return [
+        r.url.split('/')[-1] if hasattr(r, 'url') else r.id
+        for r in results]
+
+
+class TestSearch:
+
+    def test_ranking(self, search_wiki):
+        # more matches in a shorter text rank higher
+        assert found(search_wiki.search('breach')) == [
+            'scp-002', 'scp-001', 'scp-series']
+        assert found(search_wiki.search('breach', limit=1)) == ['scp-002']
+
+    def test_posts(self, search_wiki):
+        results = search_wiki.search('comment AND "scp-003"')
+        assert sorted(found(results)) == list(range(50020, 50025))
+        assert results[0].user.startswith('voter')
+
+    def test_syntax(self, search_wiki):
+        assert found(search_wiki.search('title: theme')) == [
+            'component:theme']
+        assert sorted(found(search_wiki.search('contain*'))) == [
+            'component:theme', 'scp-001', 'scp-002', 'scp-003']
+        assert found(search_wiki.search('breach NOT filler')) == [
+            'scp-002', 'scp-001']
+
+    @pytest.mark.parametrize('tags, category, expected', [
+        ('scp', None, ['scp-001', 'scp-002', 'scp-003']),
+        ('scp safe', None, ['scp-003']),
+        (['scp', 'euclid'], None, ['scp-002']),
+        (None, 'component', ['component:theme']),
+        (None, '-component', ['scp-001', 'scp-002', 'scp-003']),
+        ('scp', '_default', ['scp-001', 'scp-002', 'scp-003']),
+        ('scp', 'component', []),
+        ('keter', '* -fragment', ['scp-001'])])
+    def test_filters(self, search_wiki, tags, category, expected):
+        results = search_wiki.search(
+            'containment', tags=tags, category=category)
+        assert sorted(found(results)) == expected
+
+    def test_filtered_posts(self, search_wiki):
+        assert sorted(found(search_wiki.search('comment', tags='tale'))) == [
+            50040, 50041]
+        assert found(search_wiki.search(
+            'comment', tags='tale', category='fragment')) == []
+        assert found(search_wiki.search('comment', tags='hub')) == []
+        assert len(search_wiki.search(
+            'comment', tags='scp', category='_default')) == 9
+
+    def test_no_index(self, snapshot_path):
+        wiki = snapshot.Wiki('www.test-wiki.net', str(snapshot_path))
+        with pytest.raises(RuntimeError):
+            wiki.search('scp')
+
+    def test_rebuilt_after_update(self, tmp_path):
+        wiki = FakeWiki(search_site())
+        path = take_snapshot(wiki, tmp_path / 'snapshot.db', search=True)
+        wiki.edit('scp-001', text='reclassified')
+        wiki.pages['scp-001']['posts'].append(
+            ('voter9', wiki._now(), 'fresh remark'))
+        wiki.edit('new-page', text='brand new breach', tags='scp')
+        wiki.delete('scp-002')
+        creator = snapshot.SnapshotCreator(
+            str(path), update=True, fetch_workers=4, parse_workers=0)
+        creator.update_snapshot(wiki)
+        updated = snapshot.Wiki('www.test-wiki.net', str(path))
+        assert found(updated.search('reclassified')) == ['scp-001']
+        (post,) = updated.search('fresh')
+        assert 'fresh remark' in post.content
+        assert found(updated.search('breach')) == ['new-page', 'scp-series']
+        # the posts of the unchanged pages are still there, once
+        assert len(updated.search('comment AND "scp-003"')) == 5
+        clean = take_snapshot(
+            FakeWiki(wiki.pages), tmp_path / 'clean.db', search=True)
+        clean = snapshot.Wiki('www.test-wiki.net', str(clean))
+        # equally relevant rows can come in any order
+        for query in 'breach', 'containment', 'comment', 'fresh':
+            assert (sorted(found(updated.search(query, limit=100)), key=str) ==
+                    sorted(found(clean.search(query, limit=100)), key=str))
+
+
+def read_pages(wiki, preload=True):
+    """Read everything about every page, counting the database queries."""
+    queries = []
+    execute_sql = wiki.db.execute_sql
+
+    def _execute_sql(sql, *args, **kwargs):
+        queries.append(sql)
+        return execute_sql(sql, *args, **kwargs)
+
+    wiki.db.execute_sql = _execute_sql
+    try:
+        if preload:
+            wiki.preload(['pdata', 'history', 'votes', 'tags', 'posts'] + (
+                ['stats'] if wiki._has_stats else []))
+        pages = [(
+            p.url, p.html, p.tags, p.history, p.votes, p.comments,
+            p.rating, p.created, p._raw_author, p.wordcount)
+            for p in wiki.list_pages()]
+    finally:
+        del wiki.db.execute_sql
+    return pages, len(queries)
+
+
+@pytest.fixture(scope='module')
+def large_snapshot_path(tmp_path_factory):
+    """Snapshot of the fake site, with twenty more pages."""
+    site = make_site()
+    for idx in range(len(site), len(site) + 20):
+        name = 'extra-{}'.format(idx)
+        site[name] = make_page(
+            name, idx, ['erin', 'bob'], 'scp', None, '+-+', 3)
+    return take_snapshot(
+        FakeWiki(site), tmp_path_factory.mktemp('large') / 'snapshot.db')
+
+
+class TestPreload:
+
+    @pytest.mark.parametrize('stats', [True, False])
+    def test_same_values(
+            self, snapshot_path, old_snapshot_path, large_snapshot_path,
+            stats):
+        path = snapshot_path if stats else old_snapshot_path
+        for path in path, large_snapshot_path:
+            lazy = snapshot.Wiki('www.test-wiki.net', str(path))
+            preloaded = snapshot.Wiki('www.test-wiki.net', str(path))
+            assert (read_pages(preloaded)[0] ==
+                    read_pages(lazy, preload=False)[0])
+
+    def test_queries(self, snapshot_path, large_snapshot_path):
+        small = snapshot.Wiki('www.test-wiki.net', str(snapshot_path))
+        large = snapshot.Wiki('www.test-wiki.net', str(large_snapshot_path))
+        pages, small_queries = read_pages(small)
+        assert len(pages) == len(ALL)
+        pages, large_queries = read_pages(large)
+        assert len(pages) == len(ALL) + 20
+        # one query for each preloaded field, and one for the listing
+        assert small_queries == large_queries == 7
+
+    def test_without_preload(self, snapshot_path, large_snapshot_path):
+        counts = []
+        for path in snapshot_path, large_snapshot_path:
+            wiki = snapshot.Wiki('www.test-wiki.net', str(path))
+            counts.append(read_pages(wiki, preload=False)[1])
+        assert counts[1] > counts[0] + 20
+
+    def test_unknown_field(self, snapshot_path):
+        wiki = snapshot.Wiki('www.test-wiki.net', str(snapshot_path))
+        with pytest.raises(ValueError):
+            wiki.preload(['pdata', 'source'])
+
+
+class TestDatabases:
+
+    @pytest.fixture
+    def edited_path(self, tmp_path):
+        wiki = FakeWiki(make_site())
+        wiki.edit('scp-002', text='scp-002 rewritten', tags={'scp', 'keter'})
+        wiki.delete('tale-one')
+        return take_snapshot(wiki, tmp_path / 'edited.db')
+
+    @staticmethod
+    def read(page):
+        return page.url, page.text, page.tags, page.votes, page.history
+
+    def test_interleaved(self, snapshot_path, edited_path):
+        first = snapshot.Wiki('www.test-wiki.net', str(snapshot_path))
+        second = snapshot.Wiki('www.test-wiki.net', str(edited_path))
+        expected = [
+            [self.read(p) for p in wiki.list_pages()]
+            for wiki in (first, second)]
+        assert expected[0] != expected[1]
+        # both cursors are open at once, and the pages read in turns
+        pages = zip(first.list_pages(), second.list_pages())
+        result = [], []
+        for one, two in pages:
+            result[0].append(self.read(one))
+            result[1].append(self.read(two))
+        count = len(ALL) - 1
+        assert result[0] == expected[0][:count]
+        assert result[1] == expected[1]
+        assert first('scp-002').text == 'scp-002 scp-002'
+        assert second('scp-002').text == 'scp-002 rewritten'
+
+    def test_global_connection(self, database, snapshot_path):
+        orm.create_tables('User')
+        orm.User.create(id=1, name='global')
+        orm.flush()
+        wiki = snapshot.Wiki('www.test-wiki.net', str(snapshot_path))
+        assert len(wiki('scp-001').votes) == 6
+        assert [u.name for u in orm.User.select()] == ['global']
+        with orm.db.using(wiki.db):
+            assert orm.User.select().count() > 1
+
+    def test_threads(self, snapshot_path, edited_path):
+        wikis = [
+            snapshot.Wiki('www.test-wiki.net', str(path))
+            for path in (snapshot_path, edited_path)]
+        expected = [[self.read(p) for p in w.list_pages()] for w in wikis]
+        results = {}
+        barrier = threading.Barrier(8)
+
+        def _read(idx):
+            wiki = wikis[idx % 2]
+            barrier.wait()
+            results[idx] = [self.read(p) for p in wiki.list_pages()]
+
+        threads = [
+            threading.Thread(target=_read, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(results) == list(range(8))
+        for idx, result in results.items():
+            assert result == expected[idx % 2]
+
+
+class TestParseProcesses:
+
+    def test_processes(self, tmp_path, snapshot_path):
+        path = tmp_path / 'snapshot.db'
+        creator = snapshot.SnapshotCreator(
+            str(path), fetch_workers=4, parse_workers=2)
+        assert creator.processes is None
+        creator.take_snapshot(FakeWiki(make_site()))
+        # the processes only run while the snapshot is taken
+        assert creator.processes is None
+        assert dump(path) == dump(snapshot_path)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import pytest
+import sqlite3
+
+from pyscp import orm, snapshot, store
+
+from fakewiki import FakeWiki, dump, make_site, take_snapshot
+
+###############################################################################
+
+
+@pytest.fixture(scope='module')
+def snapshots(tmp_path_factory):
+    """Two snapshots of the site, a day apart."""
+    directory = tmp_path_factory.mktemp('store')
+    wiki = FakeWiki(make_site())
+    first = take_snapshot(wiki, directory / 'first.db')
+    wiki.edit('scp-002', text='scp-002 rewritten')
+    wiki.pages['scp-003']['votes'].append(('voter7', '+'))
+    second = take_snapshot(wiki, directory / 'second.db')
+    return first, second
+
+
+@pytest.fixture
+def stored(tmp_path, snapshots):
+    path = tmp_path / 'test.store'
+    with store.Store(str(path)) as st:
+        st.add(str(snapshots[0]), time='2016-05-01 00:00:00')
+        st.add(str(snapshots[1]), time='2016-05-02 00:00:00')
+    return path
+
+
+def count(path, model, where=''):
+    conn = sqlite3.connect(str(path))
+    try:
+        return conn.execute('SELECT COUNT(*) FROM "{}__versions" {}'.format(
+            model._meta.db_table, where)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+class TestStore:
+
+    def test_snapshots(self, stored):
+        with store.Store(str(stored)) as st:
+            assert st.snapshots() == [
+                (1, '2016-05-01 00:00:00'), (2, '2016-05-02 00:00:00')]
+            assert st.resolve() == 2
+            assert st.resolve(1) == 1
+            assert st.resolve('2016-05-01') == 1
+            assert st.resolve('2016-05-01 12:00') == 1
+            assert st.resolve('2016-06') == 2
+            with pytest.raises(LookupError):
+                st.resolve('2015')
+            with pytest.raises(LookupError):
+                st.resolve(3)
+
+    def test_time_order(self, stored, snapshots):
+        with store.Store(str(stored)) as st:
+            with pytest.raises(ValueError):
+                st.add(str(snapshots[1]), time='2016-05-02 00:00:00')
+            with pytest.raises(FileNotFoundError):
+                st.add(str(stored) + '.missing', time='2017')
+            assert len(st.snapshots()) == 2
+
+    def test_dedup(self, stored):
+        # only the changed page has a second row
+        assert count(stored, orm.Page) == len(make_site()) + 1
+        assert count(stored, orm.Page, 'WHERE first = 1 AND last = 2') == 6
+        # the one new vote is the only new row
+        votes = sum(len(p['votes']) for p in make_site().values())
+        assert count(stored, orm.Vote) == votes + 1
+        assert count(stored, orm.Vote, 'WHERE first = 2') == 1
+        posts = sum(len(p['posts']) for p in make_site().values())
+        assert count(stored, orm.ForumPost) == posts
+        # each distinct text is saved once
+        conn = sqlite3.connect(str(stored))
+        blobs = conn.execute('SELECT COUNT(*) FROM blobs').fetchone()[0]
+        conn.close()
+        assert blobs == len(make_site()) + 1 + posts
+
+    def test_same_snapshot(self, stored, snapshots):
+        with store.Store(str(stored)) as st:
+            st.add(str(snapshots[1]), time='2016-05-03 00:00:00')
+        assert count(stored, orm.Page) == len(make_site()) + 1
+        assert count(stored, orm.Page, 'WHERE last = 3') == len(make_site())
+
+    def test_views(self, stored, snapshots):
+        assert store.is_store(str(stored))
+        assert not store.is_store(str(snapshots[0]))
+        assert dump(stored, snapshot=1) == dump(snapshots[0])
+        assert dump(stored, snapshot='2016-05-02') == dump(snapshots[1])
+        assert dump(stored) == dump(snapshots[1])
+
+    def test_not_a_store(self, snapshots):
+        with pytest.raises(ValueError):
+            snapshot.Wiki('www.test-wiki.net', str(snapshots[0]), snapshot=1)
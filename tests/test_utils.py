@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import pytest
+import threading
+import time
+
+from pyscp import utils
+
+###############################################################################
+
+
+class TestBoundedMap:
+
+    def test_ordered(self):
+        # the earlier items take longer, and still come first
+        result = utils.bounded_map(
+            lambda x: time.sleep(0.01 * (5 - x)) or x * 2, range(5), 3)
+        assert list(result) == [0, 2, 4, 6, 8]
+
+    def test_unordered(self):
+        result = utils.bounded_map(
+            lambda x: time.sleep(0.02 * (5 - x)) or x, range(5), 5,
+            ordered=False)
+        result = list(result)
+        assert sorted(result) == list(range(5))
+        assert result[0] == 4
+
+    def test_input_consumed_lazily(self):
+        consumed = []
+
+        def _items():
+            for i in range(100):
+                consumed.append(i)
+                yield i
+
+        result = utils.bounded_map(lambda x: x, _items(), 2, window=3)
+        assert next(result) == 0
+        assert len(consumed) <= 4
+        result.close()
+        assert len(consumed) <= 4
+
+    def test_exception(self):
+        def _func(x):
+            if x == 3:
+                raise ValueError(x)
+            return x
+
+        result = utils.bounded_map(_func, range(10), 2)
+        assert [next(result) for _ in range(3)] == [0, 1, 2]
+        with pytest.raises(ValueError):
+            next(result)
+
+    def test_empty(self):
+        assert list(utils.bounded_map(lambda x: x, [], 4)) == []
+
+
+class TestPipeline:
+
+    def test_results(self):
+        result = utils.pipeline(
+            range(50), (lambda x: x + 1, 4), (lambda x: x * 2, 2))
+        assert sorted(result) == [2 * (i + 1) for i in range(50)]
+
+    def test_single_stage(self):
+        assert sorted(utils.pipeline('abc', (str.upper, 1))) == [
+            'A', 'B', 'C']
+
+    def test_empty(self):
+        assert list(utils.pipeline([], (str, 3), (str, 2))) == []
+
+    def test_bounded(self):
+        consumed = []
+
+        def _items():
+            for i in range(1000):
+                consumed.append(i)
+                yield i
+
+        result = utils.pipeline(_items(), (lambda x: x, 2), size=2)
+        next(result)
+        time.sleep(0.2)
+        # two queues of two items, the workers, and the feeding thread
+        assert len(consumed) < 10
+        result.close()
+
+    def test_error(self):
+        def _func(x):
+            if x == 5:
+                raise ValueError(x)
+            return x
+
+        with pytest.raises(ValueError):
+            list(utils.pipeline(range(100), (_func, 3), (str, 2)))
+
+    def test_error_in_input(self):
+        def _items():
+            yield 1
+            raise KeyError('input')
+
+        with pytest.raises(KeyError):
+            list(utils.pipeline(_items(), (str, 2)))
+
+    def test_early_exit(self):
+        before = set(threading.enumerate())
+        result = utils.pipeline(
+            iter(range(10 ** 6)), (lambda x: x, 4), (lambda x: x, 3))
+        assert next(result) is not None
+        started = set(threading.enumerate()) - before
+        assert len(started) == 8
+        result.close()
+        # every thread gives up within a couple of polling intervals
+        deadline = time.time() + 5
+        while any(t.is_alive() for t in started) and time.time() < deadline:
+            time.sleep(0.05)
+        assert not any(t.is_alive() for t in started)
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import collections
+import logging
+import pytest
+import requests
+import threading
+import types
+
+from pyscp import core, wikidot
+
+from fakewiki import make_site
+
+###############################################################################
+
+
+class Clock:
+    """Fake time, which only moves when slept or advanced."""
+
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(wikidot.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(wikidot.time, 'sleep', clock.sleep)
+    monkeypatch.setattr(wikidot.random, 'uniform', lambda a, b: b)
+    return clock
+
+
+class FakeResponse:
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+@pytest.fixture
+def session(monkeypatch, clock):
+    """InsistentRequest answering with the statuses of `script`."""
+    session = wikidot.InsistentRequest(max_attempts=5, max_backoff=3)
+    session.script = []
+    session.calls = 0
+
+    def _request(self, method, url, **kwargs):
+        session.calls += 1
+        status = session.script.pop(0)
+        if isinstance(status, Exception):
+            raise status
+        return FakeResponse(status)
+
+    monkeypatch.setattr(requests.Session, 'request', _request)
+    return session
+
+
+class TestTokenBucket:
+
+    def test_burst(self, clock):
+        bucket = wikidot.TokenBucket(rate=10, burst=5)
+        assert [bucket.reserve() for _ in range(5)] == [0] * 5
+        # past the burst, each request waits for its own token
+        assert bucket.reserve() == pytest.approx(0.1)
+        assert bucket.reserve() == pytest.approx(0.2)
+
+    def test_refill(self, clock):
+        bucket = wikidot.TokenBucket(rate=10, burst=5)
+        for _ in range(5):
+            bucket.reserve()
+        clock.now += 0.25
+        assert [bucket.reserve() for _ in range(3)] == pytest.approx(
+            [0, 0, 0.05])
+        # the bucket never holds more than the burst
+        clock.now += 60
+        assert [bucket.reserve() for _ in range(5)] == [0] * 5
+        assert bucket.reserve() > 0
+
+    def test_acquire(self, clock):
+        bucket = wikidot.TokenBucket(rate=4)
+        for _ in range(12):
+            bucket.acquire()
+        # 4 at once, then the rest at the rate
+        assert clock.now == pytest.approx(100 + 8 / 4)
+
+
+class TestAdaptiveConcurrency:
+
+    def test_decrease(self):
+        limiter = wikidot.AdaptiveConcurrency(10)
+        limiter.failure()
+        assert limiter.limit == 5
+        limiter.failure()
+        limiter.failure()
+        limiter.failure()
+        assert limiter.limit == 1
+        limiter.failure()
+        assert limiter.limit == 1
+
+    def test_increase(self):
+        limiter = wikidot.AdaptiveConcurrency(10)
+        limiter.failure()
+        # about one slot more per limit's worth of successes
+        for _ in range(5):
+            limiter.success()
+        assert 5.8 < limiter.limit < 6
+        for _ in range(100):
+            limiter.success()
+        assert limiter.limit == 10
+
+    def test_limit(self):
+        limiter = wikidot.AdaptiveConcurrency(2)
+        limiter.failure()
+        entered = threading.Event()
+
+        def _enter():
+            with limiter:
+                entered.set()
+
+        with limiter:
+            thread = threading.Thread(target=_enter)
+            thread.start()
+            assert not entered.wait(0.1)
+        assert entered.wait(5)
+        thread.join()
+
+
+class TestInsistentRequest:
+
+    def test_ok(self, session, clock):
+        session.script = [200]
+        assert session.get('http://x/a').status_code == 200
+        assert clock.sleeps == [0]
+
+    def test_not_found(self, session, clock):
+        session.script = [404, 200]
+        with pytest.raises(requests.HTTPError):
+            session.get('http://x/a')
+        assert session.calls == 1
+        assert max(clock.sleeps) == 0
+
+    def test_redirect(self, session):
+        session.script = [302]
+        with pytest.raises(requests.HTTPError):
+            session.get('http://x/a')
+
+    def test_backoff(self, session, clock):
+        session.script = [500, requests.ConnectionError(), 429, 503, 200]
+        assert session.post('http://x/a').status_code == 200
+        assert session.calls == 5
+        backoff = [d for d in clock.sleeps if d]
+        assert backoff == [1, 2, 3, 3]
+
+    def test_concurrency(self, session):
+        session.script = [429, 503, 200, 200]
+        session.get('http://x/a')
+        _, concurrency = session._limiter('http://x/b')
+        assert concurrency.limit == pytest.approx(5 + 1 / 5)
+        # the other hosts are unaffected
+        _, other = session._limiter('http://y/a')
+        assert other.limit == 20
+
+    def test_max_attempts(self, session):
+        session.script = [500] * 10
+        with pytest.raises(requests.ConnectionError):
+            session.get('http://x/a')
+        assert session.calls == 5
+
+
+class TestPrefetch:
+
+    def read(self, page):
+        return page.html, page.history, page.votes, page.comments
+
+    def test_prefetch(self, fake_wiki):
+        pages = fake_wiki.prefetch(map(fake_wiki, sorted(make_site())))
+        counts = collections.Counter(r[0] for r in fake_wiki.requests)
+        # every page and module was downloaded once
+        assert counts['get'] == len(pages) == len(make_site())
+        assert counts['pagerate/WhoRatedPageModule'] == len(pages)
+        assert counts['history/PageRevisionListModule'] == sum(
+            (len(p['revisions']) + 1) // 2 for p in make_site().values())
+        fake_wiki.requests = []
+        values = [self.read(p) for p in pages]
+        assert fake_wiki.requests == []
+        assert values == [
+            self.read(fake_wiki(p.url)) for p in pages]
+
+    def test_fields(self, fake_wiki):
+        pages = fake_wiki.prefetch(
+            [fake_wiki('scp-001'), fake_wiki('scp-002')],
+            fields=['votes'], workers=2)
+        assert sorted(r[0] for r in fake_wiki.requests) == [
+            'get', 'get', 'pagerate/WhoRatedPageModule',
+            'pagerate/WhoRatedPageModule']
+        fake_wiki.requests = []
+        assert [len(p.votes) for p in pages] == [6, 2]
+        assert fake_wiki.requests == []
+
+    def test_failed(self, fake_wiki, caplog):
+        pages = [fake_wiki('missing'), fake_wiki('scp-003')]
+        with caplog.at_level(logging.WARNING, logger='pyscp.wikidot'):
+            assert fake_wiki.prefetch(pages, progress=True) == pages
+        assert 'Failed to prefetch pdata of ' in caplog.text
+        fake_wiki.requests = []
+        assert len(pages[1].comments) == 5
+        assert fake_wiki.requests == []
+
+
+class TestListPagesFields:
+
+    FIELDS = ['title', 'author', 'created', 'rating', 'tags']
+
+    @staticmethod
+    def read(page):
+        return (
+            page.url, page._raw_title, page._raw_author, page.created,
+            page.rating, page.tags)
+
+    def test_fields(self, fake_wiki):
+        pages = list(fake_wiki.list_pages(fields=self.FIELDS))
+        values = [self.read(p) for p in pages]
+        assert {r[0] for r in fake_wiki.requests} == {'list/ListPagesModule'}
+        assert not fake_wiki.fallbacks
+        # same as when read from each page separately
+        assert values == [self.read(fake_wiki(p.url)) for p in pages]
+        assert values[2] == (
+            'http://www.test-wiki.net/scp-001', 'SCP-001', 'alice',
+            '2014-01-01 00:00:00', 3, {'scp', 'keter'})
+
+    def test_module_body(self, fake_wiki):
+        list(fake_wiki.list_pages(fields=['rating', 'tags'], body='title'))
+        body = fake_wiki.requests[0][1]['module_body'].split('\n')
+        assert sorted(body) == [
+            '||fullname||%%fullname%% ||', '||rating||%%rating%% ||',
+            '||tags||%%tags%% ||', '||title||%%title%% ||']
+        with pytest.raises(ValueError):
+            list(fake_wiki.list_pages(fields=['votes']))
+
+    def test_fallback(self, fake_wiki, caplog):
+        pages = list(fake_wiki.list_pages(fields=['tags']))
+        with caplog.at_level(logging.WARNING, logger='pyscp.wikidot'):
+            ratings = [p.rating for p in pages]
+            [p.rating for p in pages]
+            [p.tags for p in pages]
+        assert ratings == [3, 0, 3, 2, 5, 1, -2]
+        assert fake_wiki.fallbacks == {'rating': 2 * len(pages)}
+        # warned once per field
+        assert len(caplog.records) == 1
+        assert "fields=['rating']" in caplog.text
+        pages[0]._raw_author
+        assert fake_wiki.fallbacks['author'] == 1
+
+    def test_no_fallback(self, fake_wiki):
+        # the pages not made by list_pages don't count
+        assert fake_wiki('scp-001').rating == 3
+        assert not fake_wiki.fallbacks
+
+
+class TestAnalysis:
+
+    TEXT = (
+        'Item <a href="/scp-002">SCP-002</a>, see '
+        '<a href="http://elsewhere.net/x">this</a> and '
+        '<a href="/scp-003|">SCP-003</a> <a href="/scp-002">again</a> '
+        '<a href="/image.png">image</a> <a>nothing</a> '
+        '<img src="http://www.test-wiki.net/local--files/scp-001/a.jpg"/>')
+
+    @pytest.fixture
+    def page(self, fake_wiki):
+        fake_wiki.pages['scp-002']['text'] = self.TEXT
+        return fake_wiki('scp-002')
+
+    def test_values(self, page):
+        site = 'http://www.test-wiki.net'
+        assert page._raw_title == 'SCP-002'
+        assert page.text == (
+            'Item SCP-002, see this and SCP-003 again image nothing ')
+        assert page.wordcount == 9
+        assert page.links == [site + '/scp-002', site + '/scp-003']
+        assert page.images == [site + '/local--files/scp-001/a.jpg']
+        assert page.parent == site + '/scp-series'
+        assert page._wiki('scp-001').parent is None
+
+    def test_single_parse(self, page, monkeypatch):
+        parsed = []
+        soup = core.bs4.BeautifulSoup
+        monkeypatch.setattr(core, 'bs4', types.SimpleNamespace(
+            BeautifulSoup=lambda *args: parsed.append(1) or soup(*args)))
+        page.text, page.links, page.images, page.parent, page.wordcount
+        assert len(parsed) == 1
+        # the parse tree isn't kept
+        assert '_soup' not in page._cache
+        assert '_analysis' in page._cache
+
+    def test_keep_soup(self, page, monkeypatch):
+        monkeypatch.setattr(page._wiki, 'keep_soup', True)
+        page.text
+        assert page._cache['_soup'].find(id='page-content') is not None
+
+    def test_empty(self, page):
+        page._cache = {'_pdata': (None, None, None)}
+        assert page.text == ''
+        assert page.links == []
+        assert page.wordcount == 0
+        assert page.parent is None
+
+
+class TestIterPosts:
+
+    def thread(self, wiki):
+        # scp-003 has five posts, two per page
+        return wiki.Thread(wiki, 5002)
+
+    def requested(self, wiki):
+        return [r[1].get('pageNo', 1) for r in wiki.requests]
+
+    def test_posts(self, fake_wiki):
+        posts = list(self.thread(fake_wiki).iter_posts())
+        assert [p.id for p in posts] == list(range(50020, 50025))
+        assert [p.user for p in posts] == [
+            'voter{}'.format(i) for i in range(5)]
+        assert self.requested(fake_wiki) == [1, 2, 3]
+        assert self.thread(fake_wiki).posts == posts
+
+    def test_lazy(self, fake_wiki):
+        posts = self.thread(fake_wiki).iter_posts()
+        assert [next(posts).id for _ in range(3)] == [50020, 50021, 50022]
+        # only the pages reached so far were downloaded
+        assert self.requested(fake_wiki) == [1, 2]
+        posts.close()
+
+    def test_prefetch(self, fake_wiki):
+        posts = list(self.thread(fake_wiki).iter_posts(prefetch=4))
+        assert [p.id for p in posts] == list(range(50020, 50025))
+        assert sorted(self.requested(fake_wiki)) == [1, 2, 3]
+
+    def test_no_thread(self, fake_wiki):
+        assert list(fake_wiki.Thread(fake_wiki, None).iter_posts()) == []
+        assert fake_wiki('scp-series').comments == []
+        assert fake_wiki.requests == [('get', 'scp-series')]
+
+
+class TestIterHistory:
+
+    @pytest.fixture
+    def page(self, fake_wiki):
+        # seven revisions, in four pages of history
+        fake_wiki.pages['scp-003']['revisions'] = [
+            ('user{}'.format(i), 1400000000 + i * 60, 'rev {}'.format(i))
+            for i in range(7)]
+        page = fake_wiki('scp-003')
+        page._id
+        fake_wiki.requests = []
+        return page
+
+    def requested(self, page):
+        return [r[1]['page'] for r in page._wiki.requests]
+
+    def test_order(self, page):
+        revisions = list(page.iter_history())
+        assert [r.number for r in revisions] == [6, 5, 4, 3, 2, 1, 0]
+        assert self.requested(page) == [1, 2, 3, 4]
+        assert page.history == revisions[::-1]
+        assert [r.user for r in page.history] == [
+            'user{}'.format(i) for i in range(7)]
+        assert page.created == page.history[0].time
+
+    def test_workers(self, page):
+        revisions = list(page.iter_history(workers=3))
+        assert [r.number for r in revisions] == [6, 5, 4, 3, 2, 1, 0]
+        assert sorted(self.requested(page)) == [1, 2, 3, 4]
+
+    def test_perpage(self, page):
+        list(page.iter_history(perpage=100))
+        assert page._wiki.requests[0][1]['perpage'] == 100
+
+    @pytest.mark.parametrize('number, expected, pages', [
+        (5, [6], [1]),
+        (4, [5, 6], [1, 2]),
+        (3, [4, 5, 6], [1, 2]),
+        (6, [], [1]),
+        (-1, [0, 1, 2, 3, 4, 5, 6], [1, 2, 3, 4])])
+    def test_since(self, page, number, expected, pages):
+        revisions = page.history_since(number)
+        assert [r.number for r in revisions] == expected
+        # the download stops at the given revision
+        assert self.requested(page) == pages